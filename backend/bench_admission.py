@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Benchmark goodput under overload with and without admission control.
+
+Drives a simulated backend whose service time grows with the number of
+requests in flight (as the event loop does when upstream or Mongo calls pile
+up) with an open-loop arrival rate above its capacity. A response counts as
+goodput when it succeeds within the client deadline. Runs the same load
+through AdmissionMiddleware and prints goodput per route group for both:
+
+    python bench_admission.py --rate 400 --capacity 50 --seconds 10
+"""
+
+import argparse
+import asyncio
+import random
+import time
+
+from server import AdmissionController, AdmissionMiddleware
+
+# Share of arrivals per path; auth and admin have their own limits and priority over tool slots, so the tool flood cannot starve them
+TRAFFIC = (("/api/tools/phone-lookup", 0.8), ("/api/auth/me", 0.15), ("/api/admin/users", 0.05))
+
+
+class SimulatedBackend:
+    def __init__(self, capacity: int, service_ms: float):
+        self.capacity = capacity
+        self.service_ms = service_ms
+        self.in_flight = 0
+
+    async def __call__(self, scope, receive, send):
+        self.in_flight += 1
+        try:
+            await asyncio.sleep(self.service_ms / 1000 * max(1.0, self.in_flight / self.capacity))
+        finally:
+            self.in_flight -= 1
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"{}"})
+
+
+async def call(app, path: str) -> int:
+    status = 0
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    await app({"type": "http", "method": "GET", "path": path, "headers": []}, receive, send)
+    return status
+
+
+async def run(app, rate: float, seconds: float, deadline_ms: float) -> dict:
+    results = {path: {"sent": 0, "good": 0, "shed": 0, "late": 0} for path, _ in TRAFFIC}
+    paths, weights = zip(*TRAFFIC)
+
+    async def one(path: str):
+        started = time.perf_counter()
+        try:
+            status = await asyncio.wait_for(call(app, path), deadline_ms / 1000 * 5)
+        except asyncio.TimeoutError:
+            status = None
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if status == 503:
+            results[path]["shed"] += 1
+        elif status == 200 and elapsed_ms <= deadline_ms:
+            results[path]["good"] += 1
+        else:
+            results[path]["late"] += 1
+
+    tasks = []
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        path = random.choices(paths, weights)[0]
+        results[path]["sent"] += 1
+        tasks.append(asyncio.create_task(one(path)))
+        await asyncio.sleep(random.expovariate(rate))
+    await asyncio.gather(*tasks)
+    return results
+
+
+def report(label: str, results: dict, seconds: float):
+    print(f"\n{label}")
+    print(f"  {'path':<26}{'sent':>7}{'good/s':>9}{'shed':>7}{'late':>7}")
+    for path, r in results.items():
+        print(f"  {path:<26}{r['sent']:>7}{r['good'] / seconds:>9.1f}{r['shed']:>7}{r['late']:>7}")
+    total = sum(r["good"] for r in results.values())
+    print(f"  goodput: {total / seconds:.1f} req/s")
+
+
+async def main(args):
+    print(f"Capacity {args.capacity} in flight x {args.service_ms:.0f} ms "
+          f"= {args.capacity / args.service_ms * 1000:.0f} req/s; offered {args.rate:.0f} req/s")
+    plain = await run(SimulatedBackend(args.capacity, args.service_ms), args.rate, args.seconds, args.deadline_ms)
+    report("Without admission control", plain, args.seconds)
+
+    controller = AdmissionController(register=False)
+    limited = AdmissionMiddleware(SimulatedBackend(args.capacity, args.service_ms), controller)
+    admitted = await run(limited, args.rate, args.seconds, args.deadline_ms)
+    report("With admission control", admitted, args.seconds)
+    print("  learned limits: " + ", ".join(f"{l.name}={l.limit:.1f}" for l in controller.limiters))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rate", type=float, default=400, help="Offered requests per second")
+    parser.add_argument("--capacity", type=int, default=50, help="In-flight requests before service time grows")
+    parser.add_argument("--service-ms", type=float, default=200)
+    parser.add_argument("--deadline-ms", type=float, default=1000, help="Client deadline for a useful response")
+    parser.add_argument("--seconds", type=float, default=10)
+    asyncio.run(main(parser.parse_args()))
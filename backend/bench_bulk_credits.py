@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Benchmark bulk credit grants against the per-user update_credits loop.
+
+Seeds N throwaway users, grants each of them credits once through the
+/admin/credits handler in a loop and once through apply_bulk_credits, and
+prints rows/second for both. Point DB_NAME at a scratch database:
+
+    MONGO_URL=mongodb://localhost:27017 DB_NAME=omnihub_bench python bench_bulk_credits.py --users 2000
+"""
+
+import argparse
+import asyncio
+import time
+import uuid
+
+import server
+from server import BulkCreditItem, CreditUpdate, apply_bulk_credits, update_credits
+
+
+async def seed_users(count: int) -> list:
+    tag = uuid.uuid4().hex[:8]
+    user_ids = [str(uuid.uuid4()) for _ in range(count)]
+    users = [{
+        "_id": user_ids[i],
+        "id": user_ids[i],
+        "email": f"bench_{tag}_{i}@bench.local",
+        "name": f"Bench {i}",
+        "role": "user",
+        "credits": 0,
+        "is_active": True,
+        "created_at": server.timestamp()
+    } for i in range(count)]
+    await server.db.users.insert_many(users)
+    return user_ids
+
+
+async def main(count: int):
+    admin = {"id": "bench-admin"}
+    await server.refresh_migration_status()
+    if not server.migration_complete("user_id_keys"):
+        await server.db.users.create_index("id", unique=True)
+    user_ids = await seed_users(count)
+
+    started = time.perf_counter()
+    for user_id in user_ids:
+        await update_credits(CreditUpdate(user_id=user_id, amount=10, reason="bench loop"), admin)
+    loop_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    result = await apply_bulk_credits([BulkCreditItem(user_id=u, amount=10) for u in user_ids], "bench bulk", admin)
+    bulk_seconds = time.perf_counter() - started
+
+    print(f"Users: {count}")
+    print(f"Per-user loop: {loop_seconds:.3f}s ({count / loop_seconds:,.0f} rows/s)")
+    print(f"Bulk write:    {bulk_seconds:.3f}s ({count / bulk_seconds:,.0f} rows/s), applied {result['applied']}")
+    print(f"Speedup:       {loop_seconds / bulk_seconds:.1f}x")
+
+    await server.db.users.delete_many(server.user_filter({"$in": user_ids}))
+    await server.db.credit_logs.delete_many({"admin_id": admin["id"]})
+    server.client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=1000)
+    args = parser.parse_args()
+    asyncio.run(main(args.users))
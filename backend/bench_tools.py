@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Benchmark a registered tool's execution policy against a simulated upstream.
+
+Runs the tool's ToolSpec pipeline (concurrency limit, timeout budget, retries)
+with an open-loop arrival rate against an upstream whose latency is
+log-normal and which fails a share of calls with a transport error. Policy
+fields can be overridden exactly as TOOL_POLICIES does, to compare settings
+before rolling them out:
+
+    python bench_tools.py --tool eyecon_lookup --rate 50 --error-rate 0.2
+    python bench_tools.py --tool eyecon_lookup --rate 50 --error-rate 0.2 --policy '{"retries": 0}'
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+
+import httpx
+from fastapi import HTTPException
+
+from server import TOOL_REGISTRY, ToolError, ToolSpec
+
+
+class SimulatedUpstream:
+    def __init__(self, median_ms: float, sigma: float, error_rate: float):
+        self.median_ms = median_ms
+        self.sigma = sigma
+        self.error_rate = error_rate
+
+    async def __call__(self, http, remaining: float):
+        await asyncio.sleep(self.median_ms / 1000 * math.exp(random.gauss(0, self.sigma)))
+        if random.random() < self.error_rate:
+            raise httpx.ConnectError("simulated upstream failure")
+        return {"ok": True}
+
+
+async def run(spec: ToolSpec, upstream: SimulatedUpstream, rate: float, seconds: float) -> dict:
+    results = {"sent": 0, "ok": 0, "failed": 0, "timeout": 0, "shed": 0}
+    latencies = []
+
+    async def one():
+        started = time.perf_counter()
+        try:
+            await spec.execute(upstream)
+            results["ok"] += 1
+            latencies.append((time.perf_counter() - started) * 1000)
+        except HTTPException:
+            results["shed"] += 1
+        except ToolError as e:
+            results["timeout" if e.status == "timeout" else "failed"] += 1
+        except httpx.TransportError:
+            results["failed"] += 1
+
+    tasks = []
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        results["sent"] += 1
+        tasks.append(asyncio.create_task(one()))
+        await asyncio.sleep(random.expovariate(rate))
+    await asyncio.gather(*tasks)
+    latencies.sort()
+    results["p50_ms"] = latencies[len(latencies) // 2] if latencies else 0
+    results["p99_ms"] = latencies[int(len(latencies) * 0.99)] if latencies else 0
+    results["upstream_calls"] = results["sent"] - results["shed"] + spec.retried
+    return results
+
+
+async def main(args):
+    base = TOOL_REGISTRY[args.tool]
+    spec = ToolSpec(base.name, **{f: getattr(base, f) for f in ToolSpec.POLICY_FIELDS},
+                    charge=base.charge, upstream=base.upstream, metric=f"bench.{base.metric}")
+    for field, value in json.loads(args.policy).items():
+        if field not in ToolSpec.POLICY_FIELDS:
+            raise SystemExit(f"unknown policy field {field!r}")
+        try:
+            setattr(spec, field, ToolSpec.coerce_policy(field, value))
+        except ValueError as e:
+            raise SystemExit(str(e))
+    spec.start()
+
+    upstream = SimulatedUpstream(args.median_ms, args.sigma, args.error_rate)
+    print(f"{args.tool}: " + ", ".join(f"{k}={v}" for k, v in spec.policy().items() if k != "upstream"))
+    print(f"Upstream median {args.median_ms:.0f} ms, sigma {args.sigma}, error rate {args.error_rate:.0%}; "
+          f"offered {args.rate:.0f} calls/s for {args.seconds:.0f} s")
+    r = await run(spec, upstream, args.rate, args.seconds)
+    print(f"  sent {r['sent']}  ok {r['ok']} ({r['ok'] / max(r['sent'], 1):.1%})  failed {r['failed']}  "
+          f"timeout {r['timeout']}  shed {r['shed']}")
+    print(f"  retries {spec.retried}  upstream calls {r['upstream_calls']}  "
+          f"p50 {r['p50_ms']:.0f} ms  p99 {r['p99_ms']:.0f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--tool", default="phone_lookup", choices=sorted(TOOL_REGISTRY))
+    parser.add_argument("--policy", default="{}", help="JSON policy overrides, as in TOOL_POLICIES")
+    parser.add_argument("--rate", type=float, default=50, help="Offered calls per second")
+    parser.add_argument("--median-ms", type=float, default=300, help="Median upstream latency")
+    parser.add_argument("--sigma", type=float, default=0.6, help="Log-normal spread of upstream latency")
+    parser.add_argument("--error-rate", type=float, default=0.1, help="Share of upstream calls that fail")
+    parser.add_argument("--seconds", type=float, default=10)
+    asyncio.run(main(parser.parse_args()))
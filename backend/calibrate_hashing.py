@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Pick password hashing cost settings for this host.
+
+Times bcrypt (and argon2, when argon2-cffi is installed) at increasing cost
+and reports the highest cost whose median hash time stays under the target
+login latency. Prints the .env lines to use:
+
+    python calibrate_hashing.py --target-ms 250
+"""
+
+import argparse
+import statistics
+import time
+
+from passlib.hash import argon2, bcrypt
+
+SAMPLE_PASSWORD = "Calibrate@123"
+
+
+def median_ms(hasher, samples: int) -> float:
+    timings = []
+    for _ in range(samples):
+        started = time.perf_counter()
+        hasher.hash(SAMPLE_PASSWORD)
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def calibrate_bcrypt(target_ms: float, samples: int):
+    best = None
+    for rounds in range(10, 17):
+        elapsed = median_ms(bcrypt.using(rounds=rounds), samples)
+        print(f"  bcrypt rounds={rounds:<2} {elapsed:8.1f} ms")
+        if elapsed > target_ms:
+            break
+        best = (rounds, elapsed)
+    return best
+
+
+def calibrate_argon2(target_ms: float, samples: int, memory_cost: int, parallelism: int):
+    best = None
+    for time_cost in range(1, 11):
+        hasher = argon2.using(time_cost=time_cost, memory_cost=memory_cost, parallelism=parallelism)
+        elapsed = median_ms(hasher, samples)
+        print(f"  argon2 time_cost={time_cost:<2} {elapsed:8.1f} ms")
+        if elapsed > target_ms:
+            break
+        best = (time_cost, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pick password hashing cost settings for this host.")
+    parser.add_argument("--target-ms", type=float, default=250, help="Maximum hash time per login")
+    parser.add_argument("--samples", type=int, default=5, help="Hashes timed per cost setting")
+    parser.add_argument("--argon2-memory-kib", type=int, default=65536)
+    parser.add_argument("--argon2-parallelism", type=int, default=2)
+    args = parser.parse_args()
+
+    print(f"Target: {args.target_ms:.0f} ms per hash\n")
+    env_lines = []
+
+    print("bcrypt:")
+    best = calibrate_bcrypt(args.target_ms, args.samples)
+    if best:
+        env_lines.append(f"BCRYPT_ROUNDS={best[0]}  # {best[1]:.0f} ms")
+    else:
+        print("  even the minimum cost exceeds the target")
+
+    if argon2.has_backend():
+        print("\nargon2:")
+        best = calibrate_argon2(args.target_ms, args.samples, args.argon2_memory_kib, args.argon2_parallelism)
+        if best:
+            env_lines += [
+                f"ARGON2_TIME_COST={best[0]}  # {best[1]:.0f} ms",
+                f"ARGON2_MEMORY_COST={args.argon2_memory_kib}",
+                f"ARGON2_PARALLELISM={args.argon2_parallelism}",
+            ]
+        else:
+            print("  even the minimum cost exceeds the target")
+    else:
+        print("\nargon2: skipped (pip install argon2-cffi to enable)")
+
+    print("\nSuggested .env:")
+    for line in env_lines:
+        print(f"  {line}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+"""
+Image rendering for the image proxy, run in a separate process pool.
+
+Kept out of server.py so pool processes import only Pillow, not the app.
+"""
+
+import io
+
+from PIL import Image, ImageOps
+
+MAX_SOURCE_PIXELS = 40_000_000
+
+
+def render_webp(source: bytes, width: int, quality: int) -> bytes:
+    """Downscale source to at most `width` pixels wide and encode it as WebP.
+
+    Raises ValueError when the source is not a decodable image.
+    """
+    Image.MAX_IMAGE_PIXELS = MAX_SOURCE_PIXELS
+    try:
+        image = Image.open(io.BytesIO(source))
+        image.load()
+    except Image.DecompressionBombError:
+        raise ValueError("image dimensions too large") from None
+    except OSError:
+        raise ValueError("not a decodable image") from None
+    with image:
+        image = ImageOps.exif_transpose(image)
+        if image.width > width:
+            image = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info or image.mode in ("LA", "PA", "P") else "RGB")
+        output = io.BytesIO()
+        image.save(output, "WEBP", quality=quality, method=4)
+        return output.getvalue()
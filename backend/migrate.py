@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Run pending schema migrations and print their progress and measurements.
+
+Runs every unfinished migration in version order, online and throttled,
+under the same lease the workers use with MIGRATIONS_AUTO=on, then prints
+each migration's status with index sizes and hot-query latency from before
+and after it ran. user_id_keys needs a replica set (it moves documents in
+transactions) unless the API is stopped and --offline is given.
+
+    python migrate.py
+    python migrate.py --status     # only print status and measurements
+    python migrate.py --offline    # API stopped: no transactions, no waits for workers
+    python migrate.py --measure    # print current index sizes and hot-query latency
+"""
+
+import argparse
+import asyncio
+
+import server
+
+
+def print_measurement(label: str, measurement: dict):
+    print(f"    {label} ({measurement['measured_at']:%Y-%m-%d %H:%M:%S})")
+    for collection, sizes in measurement["index_bytes"].items():
+        if "error" in sizes:
+            print(f"      {collection:<12} index sizes unavailable: {sizes['error']}")
+        else:
+            print(f"      {collection:<12} {sizes['total'] or 0:>12,} index bytes  "
+                  + ", ".join(f"{name}={size:,}" for name, size in sizes.items() if name != "total"))
+    for name, latency in measurement["query_ms"].items():
+        if latency:
+            print(f"      {name:<24} p50 {latency['p50']:>8.3f} ms  p95 {latency['p95']:>8.3f} ms  ({latency['samples']} samples)")
+
+
+async def main(args):
+    if args.measure:
+        await server.refresh_migration_status()
+        print_measurement("now", await server.measure_schema())
+        return
+    if not args.status:
+        try:
+            finished = await server.run_migrations(offline=args.offline)
+        except server.MigrationError as e:
+            raise SystemExit(f"Migration stopped: {e}")
+        print(f"Finished: {', '.join(finished) or 'nothing to do (or another process holds the lease)'}")
+    for state in await server.get_migrations(admin={"role": "admin"}):
+        print(f"\n  {state['version']:>3} {state['name']:<20} {state['status']:<9} {state.get('migrated', 0):>10,} documents")
+        print(f"      {state['description']}")
+        if state.get("error"):
+            print(f"      error: {state['error']}")
+        for label in ("before", "after"):
+            if state.get(label):
+                print_measurement(label, state[label])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--status", action="store_true", help="Print status without running migrations")
+    parser.add_argument("--offline", action="store_true", help="The API is stopped: skip transactions and worker waits")
+    parser.add_argument("--measure", action="store_true", help="Measure index sizes and hot-query latency now")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Report where worker cold start goes.
+
+Prints the import-time tree of server.py (from `python -X importtime`),
+heaviest subtrees first, then starts uvicorn and measures the time until
+the first request to /api/ is answered:
+
+    python profile_startup.py --depth 2 --top 15
+    python profile_startup.py --skip-first-request
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+import urllib.request
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def import_tree():
+    """Return [(depth, module, self_us, cumulative_us)] in import order."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import server"],
+        cwd=BACKEND_DIR, env=os.environ.copy(), capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        sys.exit(result.stderr)
+    rows = []
+    for line in result.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            rows.append((len(indent) // 2, module, int(self_us), int(cumulative_us)))
+    # importtime prints children before their parent; reverse to get a top-down tree
+    return list(reversed(rows))
+
+
+def print_tree(rows, max_depth: int, top: int):
+    children = {}
+    stack = []
+    for depth, module, self_us, cumulative_us in rows:
+        node = (module, self_us, cumulative_us)
+        del stack[depth:]
+        parent = stack[-1] if stack else None
+        children.setdefault(parent, []).append(node)
+        stack.append(node)
+
+    def walk(parent, depth):
+        for module, self_us, cumulative_us in sorted(children.get(parent, []), key=lambda n: -n[2])[:top]:
+            print(f"{cumulative_us / 1000:9.1f} ms {self_us / 1000:8.1f} ms  {'  ' * depth}{module}")
+            if depth + 1 < max_depth:
+                walk((module, self_us, cumulative_us), depth + 1)
+
+    print(f"{'cumulative':>12} {'self':>10}  module")
+    walk(None, 0)
+
+
+def time_to_first_request(port: int, timeout: float) -> float:
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=os.environ.copy()
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/api/", timeout=1) as response:
+                    if response.status == 200:
+                        return (time.perf_counter() - started) * 1000
+            except OSError:
+                time.sleep(0.02)
+        raise SystemExit(f"No response within {timeout:.0f}s")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report where worker cold start goes.")
+    parser.add_argument("--depth", type=int, default=2, help="Levels of the import tree to show")
+    parser.add_argument("--top", type=int, default=10, help="Children shown per node")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--skip-first-request", action="store_true", help="Only profile imports")
+    args = parser.parse_args()
+
+    rows = import_tree()
+    total_us = next(cumulative for depth, module, _, cumulative in rows if depth == 0 and module == "server")
+    print(f"Import of server.py: {total_us / 1000:.1f} ms\n")
+    print_tree(rows, args.depth, args.top)
+
+    if not args.skip_first_request:
+        elapsed = time_to_first_request(args.port, args.timeout)
+        print(f"\nProcess start to first response: {elapsed:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
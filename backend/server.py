@@ -1,34 +1,103 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, Query
+import time
+_IMPORT_STARTED = time.perf_counter()  # taken before any other import, for cold-start metrics
+
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request, status, Query, UploadFile, File, Form
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
+from starlette.background import BackgroundTask
+from starlette.exceptions import HTTPException as StarletteHTTPException
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, UpdateOne, monitoring
+from pymongo.errors import BulkWriteError, DuplicateKeyError, ExecutionTimeout, NetworkTimeout, OperationFailure, PyMongoError, WaitQueueTimeoutError
 import os
+import re
+import abc
+import io
+import csv
+import copy
+import sys
+import json
+import hmac
+import base64
+import asyncio
+import hashlib
 import logging
+import queue
+import atexit
+import random
+import secrets
+import math
+import threading
+import tracemalloc
+import functools
+import itertools
+import contextlib
+import importlib.util
+import logging.handlers
 from pathlib import Path
-from pydantic import BaseModel, Field, EmailStr
-from typing import List, Optional
+from collections import OrderedDict, deque
+from contextvars import ContextVar
+from fnmatch import fnmatch
+from urllib.parse import urljoin, quote
+from pydantic import BaseModel, BeforeValidator, Field, EmailStr
+from typing import Annotated, Callable, List, Optional
 import uuid
 from datetime import datetime, timezone, timedelta
 from jose import JWTError, jwt
-from passlib.context import CryptContext
-import httpx
+
+def _lazy_import(name: str):
+    """Return a module whose code only runs on first attribute access.
+
+    Keeps dependencies used by a few routes off the worker cold-start path."""
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+# Only the tool routes and the HLS proxy make outbound calls
+httpx = _lazy_import("httpx")
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
-
 # JWT Configuration
 JWT_SECRET = os.environ.get('JWT_SECRET', 'omnihub_secret_key')
 JWT_ALGORITHM = os.environ.get('JWT_ALGORITHM', 'HS256')
-ACCESS_TOKEN_EXPIRE_MINUTES = int(os.environ.get('ACCESS_TOKEN_EXPIRE_MINUTES', 1440))
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.environ.get('ACCESS_TOKEN_EXPIRE_MINUTES', 15))
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.environ.get('REFRESH_TOKEN_EXPIRE_DAYS', 30))
 
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Password hashing - the first scheme hashes new passwords; hashes made with other
+# schemes or older cost settings are upgraded on the next successful login.
+# Run calibrate_hashing.py on the target host to choose the cost values.
+PASSWORD_SCHEMES = [s.strip() for s in os.environ.get('PASSWORD_SCHEMES', 'bcrypt').split(',') if s.strip()]
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', 12))
+ARGON2_TIME_COST = int(os.environ.get('ARGON2_TIME_COST', 3))
+ARGON2_MEMORY_COST = int(os.environ.get('ARGON2_MEMORY_COST', 65536))
+ARGON2_PARALLELISM = int(os.environ.get('ARGON2_PARALLELISM', 2))
+
+_pwd_context = None
+
+def password_context():
+    # Built on first login/register rather than at import; passlib loads its hash backends eagerly
+    global _pwd_context
+    if _pwd_context is None:
+        from passlib.context import CryptContext
+        _pwd_context = CryptContext(
+            schemes=PASSWORD_SCHEMES,
+            deprecated="auto",
+            bcrypt__rounds=BCRYPT_ROUNDS,
+            argon2__time_cost=ARGON2_TIME_COST,
+            argon2__memory_cost=ARGON2_MEMORY_COST,
+            argon2__parallelism=ARGON2_PARALLELISM
+        )
+    return _pwd_context
 
 # Security
 security = HTTPBearer()
@@ -41,6 +110,10 @@ api_router = APIRouter(prefix="/api")
 
 # ============== MODELS ==============
 
+# created_at on the wire: the ISO string clients have always received, whichever
+# form it is stored in (see created_at_dates under SCHEMA MIGRATIONS)
+WireTimestamp = Annotated[str, BeforeValidator(lambda value: iso_timestamp(value))]
+
 class UserBase(BaseModel):
     email: EmailStr
     name: str
@@ -59,18 +132,57 @@ class UserResponse(BaseModel):
     role: str
     credits: int
     is_active: bool
-    created_at: str
+    created_at: WireTimestamp
 
 class TokenResponse(BaseModel):
     access_token: str
+    refresh_token: Optional[str] = None
     token_type: str = "bearer"
+    expires_in: int = ACCESS_TOKEN_EXPIRE_MINUTES * 60
     user: UserResponse
 
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
+class UserDirectoryResponse(BaseModel):
+    users: List[UserResponse]
+    next_cursor: Optional[str] = None
+    total: int
+    total_is_estimate: bool
+
 class CreditUpdate(BaseModel):
     user_id: str
     amount: int
     reason: str
 
+class ChannelCreate(BaseModel):
+    id: str = Field(..., pattern=r"^[a-z0-9_]+$")
+    name: str
+    logo: str = ""
+    stream_url: str
+    category: str
+    provider: str = "Tamasha"
+    active: bool = True
+    position: Optional[int] = None
+
+class ChannelUpdate(BaseModel):
+    name: Optional[str] = None
+    logo: Optional[str] = None
+    stream_url: Optional[str] = None
+    category: Optional[str] = None
+    provider: Optional[str] = None
+    active: Optional[bool] = None
+    position: Optional[int] = None
+
+class BulkCreditItem(BaseModel):
+    user_id: str
+    amount: int
+    reason: Optional[str] = None
+
+class BulkCreditUpdate(BaseModel):
+    items: List[BulkCreditItem]
+    reason: str
+
 class UsageLogResponse(BaseModel):
     id: str
     user_id: str
@@ -79,7 +191,7 @@ class UsageLogResponse(BaseModel):
     credits_used: int
     status: str
     details: Optional[str] = None
-    created_at: str
+    created_at: WireTimestamp
 
 class CreditLogResponse(BaseModel):
     id: str
@@ -89,7 +201,7 @@ class CreditLogResponse(BaseModel):
     balance_after: int
     reason: str
     admin_id: str
-    created_at: str
+    created_at: WireTimestamp
 
 # Tool request models
 class PhoneLookupRequest(BaseModel):
@@ -114,74 +226,1218 @@ class TamashaOTPRequest(BaseModel):
     otp: Optional[str] = None
 
 # Credit costs
-CREDIT_COSTS = {
-    "live_tv": 1,
-    "tamasha_otp": 2,
-    "temp_email": 1,
-    "youtube_download": 3,
-    "image_enhance": 2,
-    "phone_lookup": 1,
-    "eyecon_lookup": 1
+CREDIT_COSTS: dict = {}  # tool -> credits per use, filled in from TOOL_REGISTRY
+
+# ============== METRICS ==============
+# In-process counters and latency histograms, registered by name and
+# reported together at /api/admin/metrics.
+
+METRICS: dict = {}
+
+class LatencyHistogram:
+    BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+    def __init__(self, name: Optional[str]):
+        self.counts = [0] * (len(self.BUCKETS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        if name is not None:
+            METRICS[name] = self
+
+    def observe(self, ms: float):
+        index = next((i for i, bound in enumerate(self.BUCKETS_MS) if ms <= bound), len(self.BUCKETS_MS))
+        self.counts[index] += 1
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def percentile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-th percentile."""
+        if not self.count:
+            return 0.0
+        rank, seen = q * self.count, 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return min(float(self.BUCKETS_MS[i]), round(self.max_ms, 2)) if i < len(self.BUCKETS_MS) else round(self.max_ms, 2)
+        return self.max_ms
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total_ms / self.count, 2) if self.count else 0,
+            "p50_ms": self.percentile(0.5),
+            "p95_ms": self.percentile(0.95),
+            "p99_ms": self.percentile(0.99),
+            "max_ms": round(self.max_ms, 2)
+        }
+
+class Gauge:
+    def __init__(self, name: str):
+        self.value = None
+        METRICS[name] = self
+
+    def set(self, value):
+        self.value = value
+
+    def snapshot(self):
+        return self.value
+
+class Counter:
+    def __init__(self, name: str):
+        self.value = 0
+        METRICS[name] = self
+
+    def increment(self, amount: int = 1):
+        self.value += amount
+
+    def snapshot(self) -> int:
+        return self.value
+
+IMPORT_DURATION_MS = Gauge("startup.import_ms")
+TIME_TO_FIRST_REQUEST_MS = Gauge("startup.time_to_first_request_ms")
+LOGIN_LATENCY = LatencyHistogram("auth.login_latency")
+PASSWORD_HASH_CPU = LatencyHistogram("auth.password_hash_cpu")
+PASSWORD_REHASHES = Counter("auth.password_rehashes")
+
+# ============== MEMORY ==============
+# Every in-process cache or buffer registers a MemoryAccount: a byte budget,
+# a way to measure its current size and, when entries can be dropped safely,
+# a way to shrink it. The memory watchdog trims any cache over its own budget
+# and, when the worker's RSS goes over MEMORY_BUDGET_BYTES, cuts every
+# shrinkable cache by MEMORY_PRESSURE_SHRINK. RSS rarely falls after Python
+# frees memory, so it cuts again only if RSS keeps growing (by another
+# MEMORY_PRESSURE_STEP of the budget), not on every check while it stays
+# over. Sizes of plain dicts and deques are estimated from a sample of their
+# entries.
+
+MEMORY_BUDGET_BYTES = int(os.environ.get('MEMORY_BUDGET_BYTES', 1024 * 1024 * 1024))  # worker RSS; 0 disables pressure
+MEMORY_BUDGETS = os.environ.get('MEMORY_BUDGETS', '')  # per-account overrides, e.g. "hls.playlists=67108864"
+MEMORY_CHECK_SECONDS = float(os.environ.get('MEMORY_CHECK_SECONDS', 10))
+MEMORY_PRESSURE_SHRINK = float(os.environ.get('MEMORY_PRESSURE_SHRINK', 0.25))
+MEMORY_PRESSURE_STEP = 0.05
+MEMORY_SAMPLE_SIZE = 32
+
+MEMORY_ACCOUNTS: dict = {}
+MEMORY_PRESSURE_EVENTS = Counter("memory.pressure_events")
+MEMORY_EVICTED_BYTES = Counter("memory.evicted_bytes")
+
+_pressure_rss = 0  # RSS at the last pressure trim; 0 while under budget
+
+_budget_overrides = {
+    name.strip(): int(value) for name, _, value in
+    (item.rpartition("=") for item in MEMORY_BUDGETS.split(",") if item.strip())
+}
+
+def _deep_sizeof(obj, depth: int = 4) -> int:
+    """Approximate bytes held by obj and what it references, a few levels deep."""
+    size = sys.getsizeof(obj)
+    if depth == 0 or isinstance(obj, (str, bytes, bytearray, int, float, bool)) or obj is None:
+        return size
+    if isinstance(obj, dict):
+        return size + sum(_deep_sizeof(k, depth - 1) + _deep_sizeof(v, depth - 1) for k, v in obj.items())
+    if isinstance(obj, (list, tuple, set, frozenset, deque)):
+        return size + sum(_deep_sizeof(item, depth - 1) for item in obj)
+    if hasattr(obj, "__dict__"):
+        return size + _deep_sizeof(vars(obj), depth - 1)
+    slots = getattr(type(obj), "__slots__", ())
+    return size + sum(_deep_sizeof(getattr(obj, name, None), depth - 1) for name in slots)
+
+def estimate_container_bytes(container) -> int:
+    """Size of a dict or sequence, extrapolated from a sample of its entries."""
+    # The query profiler and the logging queue are mutated by other threads, which
+    # can make iteration fail mid-sample; take a fresh sample when it does
+    for _ in range(3):
+        try:
+            count = len(container)
+            items = container.items() if isinstance(container, dict) else container
+            sample = list(itertools.islice(items, MEMORY_SAMPLE_SIZE))
+            per_entry = sum(_deep_sizeof(item) for item in sample) / len(sample) if sample else 0
+            return sys.getsizeof(container) + int(per_entry * count)
+        except RuntimeError:
+            continue
+    return sys.getsizeof(container)
+
+def _shrink_oldest(container, target_bytes: int, size_bytes: int) -> int:
+    """Drop the oldest entries of a dict (insertion or LRU order) or deque to about target_bytes."""
+    if size_bytes <= target_bytes or not container:
+        return 0
+    per_entry = size_bytes / len(container)
+    drop = min(len(container), math.ceil((size_bytes - target_bytes) / per_entry))
+    if isinstance(container, dict):
+        for key in list(itertools.islice(container, drop)):
+            container.pop(key, None)
+    else:
+        for _ in range(drop):
+            container.popleft()
+    return int(drop * per_entry)
+
+class MemoryAccount:
+    def __init__(self, name: str, budget_bytes: int, size: Callable[[], int],
+                 shrink: Optional[Callable[[int], int]] = None, entries: Optional[Callable[[], int]] = None):
+        self.name = name
+        self.budget_bytes = _budget_overrides.get(name, budget_bytes)
+        self.size = size
+        self.shrink = shrink  # target bytes -> bytes freed; None for state that must not be dropped
+        self.entries = entries
+        self.evicted_bytes = 0
+        MEMORY_ACCOUNTS[name] = self
+
+    def trim(self, target_bytes: int) -> int:
+        if self.shrink is None:
+            return 0
+        freed = self.shrink(max(0, target_bytes))
+        self.evicted_bytes += freed
+        MEMORY_EVICTED_BYTES.increment(freed)
+        return freed
+
+    def snapshot(self) -> dict:
+        size = self.size()
+        return {
+            "bytes": size,
+            "budget_bytes": self.budget_bytes,
+            "over_budget": size > self.budget_bytes,
+            "entries": self.entries() if self.entries else None,
+            "evictable": self.shrink is not None,
+            "evicted_bytes": self.evicted_bytes
+        }
+
+def account_container(name: str, budget_bytes: int, container, evictable: bool = True) -> MemoryAccount:
+    """Account a dict or deque whose oldest entries can be dropped (or, with evictable=False, only measured)."""
+    return MemoryAccount(
+        name, budget_bytes,
+        size=lambda: estimate_container_bytes(container),
+        shrink=(lambda target: _shrink_oldest(container, target, estimate_container_bytes(container))) if evictable else None,
+        entries=lambda: len(container)
+    )
+
+def process_rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # Not Linux: fall back to the peak, which is all getrusage reports
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+def enforce_memory_budgets() -> dict:
+    """Trim caches over their own budget, and every cache when RSS goes (further) over the global budget."""
+    global _pressure_rss
+    freed = {}
+    for account in list(MEMORY_ACCOUNTS.values()):
+        if account.shrink is not None and account.size() > account.budget_bytes:
+            freed[account.name] = account.trim(account.budget_bytes)
+    rss = process_rss_bytes()
+    if not MEMORY_BUDGET_BYTES or rss <= MEMORY_BUDGET_BYTES:
+        _pressure_rss = 0
+    elif not _pressure_rss or rss > _pressure_rss + MEMORY_BUDGET_BYTES * MEMORY_PRESSURE_STEP:
+        _pressure_rss = rss
+        MEMORY_PRESSURE_EVENTS.increment()
+        for account in list(MEMORY_ACCOUNTS.values()):
+            if account.shrink is not None:
+                size = account.size()
+                freed[account.name] = freed.get(account.name, 0) + account.trim(int(size * (1 - MEMORY_PRESSURE_SHRINK)))
+        logger.warning("RSS %d MB over the %d MB budget; trimmed caches by %d KB",
+                       rss >> 20, MEMORY_BUDGET_BYTES >> 20, sum(freed.values()) >> 10)
+    return freed
+
+async def _memory_watchdog():
+    while True:
+        await asyncio.sleep(MEMORY_CHECK_SECONDS)
+        try:
+            enforce_memory_budgets()
+        except Exception:
+            logger.exception("Memory budget check failed")
+
+class MemoryReport:
+    def snapshot(self) -> dict:
+        return {
+            "rss_bytes": process_rss_bytes(),
+            "budget_bytes": MEMORY_BUDGET_BYTES,
+            "accounted_bytes": sum(account.size() for account in list(MEMORY_ACCOUNTS.values()))
+        }
+
+METRICS["memory"] = MemoryReport()
+
+# ============== TRACING ==============
+# TracingMiddleware opens a trace per request. Mongo commands (reported by a
+# pymongo command listener - Motor copies the request context into its
+# executor threads), upstream httpx calls and functions marked @traced()
+# record spans into it. Finished traces are kept at TRACE_SAMPLE_RATE, and
+# always when slower than TRACE_SLOW_MS, then exported in the background as
+# JSON lines to TRACE_FILE or as OTLP/HTTP JSON to TRACE_OTLP_ENDPOINT.
+
+TRACE_EXPORT = os.environ.get('TRACE_EXPORT', 'off')  # off, file or otlp
+TRACE_FILE = os.environ.get('TRACE_FILE', str(ROOT_DIR / 'traces.jsonl'))
+TRACE_OTLP_ENDPOINT = os.environ.get('TRACE_OTLP_ENDPOINT', 'http://localhost:4318/v1/traces')
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', 0.01))
+TRACE_SLOW_MS = float(os.environ.get('TRACE_SLOW_MS', 1000))
+TRACE_QUEUE_SIZE = int(os.environ.get('TRACE_QUEUE_SIZE', 1000))
+TRACE_RECENT_LIMIT = 200
+
+TRACES_KEPT = Counter("tracing.kept")
+TRACES_DROPPED = Counter("tracing.dropped")
+TRACE_EXPORT_ERRORS = Counter("tracing.export_errors")
+
+class Trace:
+    def __init__(self, method: str, path: str):
+        self.trace_id = secrets.token_hex(16)
+        self.method = method
+        self.path = path
+        self.endpoint = None
+        self.status = None
+        self.started = time.perf_counter()
+        self.started_ns = time.time_ns()
+        self.spans = []
+
+    def add_span(self, name: str, started: float, duration_ms: float, span_id: str = None, **attrs):
+        # Called from Motor's executor threads too; list.append is atomic
+        self.spans.append({
+            "span_id": span_id or secrets.token_hex(8),
+            "parent_id": _current_span_id.get(),
+            "name": name,
+            "start_ms": round((started - self.started) * 1000, 3),
+            "duration_ms": round(duration_ms, 3),
+            **attrs
+        })
+
+    def to_dict(self, duration_ms: float) -> dict:
+        summary = {}
+        for span in self.spans:
+            kind = span.get("kind")
+            if kind in ("mongo", "upstream"):
+                summary[f"{kind}_calls"] = summary.get(f"{kind}_calls", 0) + 1
+                summary[f"{kind}_ms"] = round(summary.get(f"{kind}_ms", 0) + span["duration_ms"], 3)
+        return {
+            "trace_id": self.trace_id,
+            "method": self.method,
+            "path": self.path,
+            "endpoint": self.endpoint,
+            "status": self.status,
+            "started_at": datetime.fromtimestamp(self.started_ns / 1e9, timezone.utc).isoformat(),
+            "started_ns": self.started_ns,
+            "duration_ms": round(duration_ms, 3),
+            "summary": summary,
+            "spans": self.spans
+        }
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+_current_span_id: ContextVar[Optional[str]] = ContextVar("current_span_id", default=None)
+_trace_queue: asyncio.Queue = asyncio.Queue(maxsize=TRACE_QUEUE_SIZE)
+_recent_traces = deque(maxlen=TRACE_RECENT_LIMIT)
+account_container("tracing.recent", 16 * 1024 * 1024, _recent_traces)
+account_container("tracing.export_queue", 16 * 1024 * 1024, _trace_queue._queue, evictable=False)
+
+def traced(name: str = None):
+    """Record each call of the decorated coroutine function as a span on the current trace."""
+    def decorator(fn):
+        label = name or fn.__name__
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            trace = _current_trace.get()
+            if trace is None:
+                return await fn(*args, **kwargs)
+            span_id = secrets.token_hex(8)
+            started = time.perf_counter()
+            token = _current_span_id.set(span_id)
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                _current_span_id.reset(token)
+                trace.add_span(label, started, (time.perf_counter() - started) * 1000, span_id=span_id, kind="app")
+        return wrapper
+    return decorator
+
+class MongoSpanListener(monitoring.CommandListener):
+    def __init__(self):
+        self._collections = {}  # (request_id, connection_id) -> collection, while a command is in flight
+
+    def started(self, event):
+        if _current_trace.get() is None:
+            return
+        target = event.command.get(event.command_name)
+        collection = target if isinstance(target, str) else event.command.get("collection")
+        self._collections[(event.request_id, event.connection_id)] = collection
+
+    def succeeded(self, event):
+        self._record(event, "ok")
+
+    def failed(self, event):
+        self._record(event, "error")
+
+    def _record(self, event, outcome: str):
+        collection = self._collections.pop((event.request_id, event.connection_id), None)
+        trace = _current_trace.get()
+        if trace is None:
+            return
+        duration_ms = event.duration_micros / 1000
+        trace.add_span(
+            f"mongo.{event.command_name}", time.perf_counter() - duration_ms / 1000, duration_ms,
+            kind="mongo", collection=collection, outcome=outcome
+        )
+
+class TracingTransport:
+    """Wraps an httpx transport and records every upstream request as a span."""
+
+    def __init__(self, transport):
+        self.transport = transport
+
+    async def handle_async_request(self, request):
+        trace = _current_trace.get()
+        if trace is None:
+            return await self.transport.handle_async_request(request)
+        started = time.perf_counter()
+        outcome = None
+        try:
+            response = await self.transport.handle_async_request(request)
+            outcome = response.status_code
+            return response
+        except Exception as e:
+            outcome = type(e).__name__
+            raise
+        finally:
+            trace.add_span(
+                f"http.{request.method}", started, (time.perf_counter() - started) * 1000,
+                kind="upstream", host=request.url.host, outcome=outcome
+            )
+
+    async def __aenter__(self):
+        await self.transport.__aenter__()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.transport.__aexit__(*args)
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+def upstream_client(limits: "httpx.Limits" = None, **kwargs) -> "httpx.AsyncClient":
+    """httpx client for upstream services, with its requests traced."""
+    transport = httpx.AsyncHTTPTransport(limits=limits or httpx.Limits(max_connections=100, max_keepalive_connections=20))
+    return httpx.AsyncClient(transport=TracingTransport(transport), **kwargs)
+
+def finish_trace(trace: Trace):
+    duration_ms = (time.perf_counter() - trace.started) * 1000
+    if duration_ms < TRACE_SLOW_MS and random.random() >= TRACE_SAMPLE_RATE:
+        return
+    data = trace.to_dict(duration_ms)
+    TRACES_KEPT.increment()
+    _recent_traces.append(data)
+    try:
+        _trace_queue.put_nowait(data)
+    except asyncio.QueueFull:
+        TRACES_DROPPED.increment()
+
+def _otlp_payload(traces: list) -> dict:
+    def attributes(values: dict):
+        return [{"key": k, "value": {"stringValue": str(v)}} for k, v in values.items() if v is not None]
+
+    spans = []
+    for t in traces:
+        root_id = t["trace_id"][:16]
+        spans.append({
+            "traceId": t["trace_id"], "spanId": root_id, "name": f"{t['method']} {t['path']}", "kind": 2,
+            "startTimeUnixNano": str(t["started_ns"]),
+            "endTimeUnixNano": str(t["started_ns"] + int(t["duration_ms"] * 1e6)),
+            "attributes": attributes({"http.method": t["method"], "http.target": t["path"],
+                                      "http.status_code": t["status"], "endpoint": t["endpoint"]})
+        })
+        for span in t["spans"]:
+            start_ns = t["started_ns"] + int(span["start_ms"] * 1e6)
+            extra = {k: v for k, v in span.items() if k not in ("span_id", "parent_id", "name", "start_ms", "duration_ms")}
+            spans.append({
+                "traceId": t["trace_id"], "spanId": span["span_id"], "parentSpanId": span["parent_id"] or root_id,
+                "name": span["name"], "kind": 3 if extra.get("kind") in ("mongo", "upstream") else 1,
+                "startTimeUnixNano": str(start_ns),
+                "endTimeUnixNano": str(start_ns + int(span["duration_ms"] * 1e6)),
+                "attributes": attributes(extra)
+            })
+    return {"resourceSpans": [{
+        "resource": {"attributes": attributes({"service.name": "omnihub-api"})},
+        "scopeSpans": [{"scope": {"name": "omnihub.tracing"}, "spans": spans}]
+    }]}
+
+def _append_trace_lines(traces: list):
+    with open(TRACE_FILE, "a") as f:
+        f.writelines(json.dumps(t) + "\n" for t in traces)
+
+async def _export_traces():
+    """Drain kept traces in batches to the configured sink."""
+    exporter = httpx.AsyncClient(timeout=10) if TRACE_EXPORT == "otlp" else None
+    try:
+        while True:
+            batch = [await _trace_queue.get()]
+            while not _trace_queue.empty() and len(batch) < 100:
+                batch.append(_trace_queue.get_nowait())
+            try:
+                if exporter is not None:
+                    response = await exporter.post(TRACE_OTLP_ENDPOINT, json=_otlp_payload(batch))
+                    response.raise_for_status()
+                else:
+                    await asyncio.to_thread(_append_trace_lines, batch)
+            except Exception as e:
+                TRACE_EXPORT_ERRORS.increment()
+                logger.warning("Trace export failed: %s", e)
+    finally:
+        if exporter is not None:
+            await exporter.aclose()
+
+# ============== QUERY PROFILER ==============
+# A command listener groups every Mongo command by query shape: collection,
+# operation, the filter's field names and operators (never its values) and
+# the sort. Each shape keeps a count and latency histogram; getMore batches
+# are charged to the find or aggregate that opened the cursor. Executions
+# slower than PROFILER_EXPLAIN_MS queue their command for an executionStats
+# explain, run in the background on the analytics pool at most once per
+# PROFILER_EXPLAIN_EVERY_SECONDS per shape, and shapes that examine over
+# PROFILER_SCAN_RATIO documents per document returned are flagged.
+
+QUERY_PROFILER = os.environ.get('QUERY_PROFILER', 'on') == 'on'
+PROFILER_MAX_SHAPES = int(os.environ.get('PROFILER_MAX_SHAPES', 500))
+PROFILER_EXPLAIN_MS = float(os.environ.get('PROFILER_EXPLAIN_MS', 100))
+PROFILER_EXPLAIN_EVERY_SECONDS = int(os.environ.get('PROFILER_EXPLAIN_EVERY_SECONDS', 600))
+PROFILER_SCAN_RATIO = float(os.environ.get('PROFILER_SCAN_RATIO', 100))
+PROFILER_SCAN_MIN_DOCS = 1000  # below this even a collection scan is cheap
+
+# command name -> (field holding the filter, field holding the sort)
+PROFILED_COMMANDS = {
+    "find": ("filter", "sort"),
+    "count": ("query", None),
+    "distinct": ("query", None),
+    "findAndModify": ("query", "sort"),
+    "aggregate": (None, None),
+    "update": (None, None),
+    "delete": (None, None),
+    "insert": (None, None),
+}
+EXPLAINABLE_COMMANDS = {"find", "count", "distinct", "findAndModify", "aggregate", "update", "delete"}
+
+def _filter_shape(query) -> str:
+    """Field names and operators of a filter, e.g. {"a": {"$in": [..]}, "b": 1} -> "a:$in,b"."""
+    if not isinstance(query, dict):
+        return ""
+    parts = []
+    for key, value in query.items():
+        if key in ("$or", "$and", "$nor") and isinstance(value, list):
+            parts.append(f"{key}(" + "|".join(sorted({_filter_shape(clause) for clause in value})) + ")")
+        elif isinstance(value, dict) and value and all(k.startswith("$") for k in value):
+            parts.append(f"{key}:" + ",".join(sorted(value)))
+        else:
+            parts.append(key)
+    return ",".join(sorted(parts))
+
+def _command_shape(command_name: str, command) -> tuple:
+    """(collection, operation, filter shape, sort shape) of a command"""
+    collection = command.get(command_name)
+    filter_field, sort_field = PROFILED_COMMANDS[command_name]
+    query = command.get(filter_field) if filter_field else None
+    sort = command.get(sort_field) if sort_field else None
+    if command_name == "aggregate":
+        stages = [next(iter(stage)) for stage in command.get("pipeline", [])]
+        query = next((stage["$match"] for stage in command.get("pipeline", []) if "$match" in stage), None)
+        sort = next((stage["$sort"] for stage in command.get("pipeline", []) if "$sort" in stage), None)
+        command_name = "aggregate[" + ",".join(stages) + "]"
+    elif command_name in ("update", "delete"):
+        statements = command.get("updates" if command_name == "update" else "deletes") or [{}]
+        query = statements[0].get("q")
+    sort_shape = ",".join(f"{k}:{v}" for k, v in sort.items()) if isinstance(sort, dict) else ""
+    return (collection if isinstance(collection, str) else "?", command_name, _filter_shape(query), sort_shape)
+
+def _returned_count(command_name: str, reply) -> int:
+    cursor = reply.get("cursor")
+    if isinstance(cursor, dict):
+        return len(cursor.get("firstBatch", cursor.get("nextBatch", ())))
+    if command_name == "findAndModify":
+        return 1 if reply.get("value") is not None else 0
+    return reply.get("n", 0) if isinstance(reply.get("n"), int) else 0
+
+def _plan_summary(explain: dict) -> dict:
+    """Winning plan stages and executionStats totals from an explain reply."""
+    def find(node, key):
+        if isinstance(node, dict):
+            if key in node:
+                return node[key]
+            children = node.values()
+        elif isinstance(node, list):
+            children = node
+        else:
+            return None
+        for child in children:
+            found = find(child, key)
+            if found is not None:
+                return found
+        return None
+
+    stages = []
+    node = find(explain, "winningPlan")
+    while isinstance(node, dict):
+        node = node.get("queryPlan", node)
+        stage = node.get("stage")
+        if stage:
+            stages.append(f"{stage}({node['indexName']})" if node.get("indexName") else stage)
+        node = node.get("inputStage") or (node.get("inputStages") or [None])[0]
+    stats = find(explain, "executionStats") or {}
+    return {
+        "plan": " > ".join(stages),
+        "docs_examined": stats.get("totalDocsExamined", 0),
+        "keys_examined": stats.get("totalKeysExamined", 0),
+        "returned": stats.get("nReturned", 0),
+        "millis": stats.get("executionTimeMillis", 0),
+    }
+
+class QueryShapeStats:
+    __slots__ = ("shape", "count", "errors", "returned", "get_mores", "latency", "explain", "explained_at", "flagged")
+
+    def __init__(self, shape: tuple):
+        self.shape = shape
+        self.count = 0
+        self.errors = 0
+        self.returned = 0
+        self.get_mores = 0
+        self.latency = LatencyHistogram(None)
+        self.explain = None
+        self.explained_at = 0.0
+        self.flagged = False
+
+    def to_dict(self) -> dict:
+        collection, operation, query, sort = self.shape
+        return {
+            "collection": collection, "operation": operation, "filter": query, "sort": sort,
+            **self.latency.snapshot(),  # its count includes getMore batches; replaced below
+            "count": self.count, "errors": self.errors, "returned": self.returned, "get_mores": self.get_mores,
+            "total_ms": round(self.latency.total_ms, 1), "explain": self.explain, "flagged": self.flagged
+        }
+
+class QueryProfiler(monitoring.CommandListener):
+    def __init__(self):
+        self.shapes = {}  # shape -> QueryShapeStats
+        self.overflow = 0  # executions of shapes past PROFILER_MAX_SHAPES
+        self._in_flight = {}  # (request_id, connection_id) -> (shape, command)
+        self._cursors = OrderedDict()  # open cursor id -> shape
+        self._explain_queue = {}  # shape -> (database, command) awaiting explain
+        METRICS["query_profiler"] = self
+
+    def started(self, event):
+        name = event.command_name
+        if name == "getMore":
+            shape = self._cursors.get(event.command.get("getMore"))
+        elif name in PROFILED_COMMANDS:
+            shape = _command_shape(name, event.command)
+        else:
+            return
+        if shape is not None:
+            self._in_flight[(event.request_id, event.connection_id)] = (shape, event.command, event.database_name)
+
+    def succeeded(self, event):
+        entry = self._in_flight.pop((event.request_id, event.connection_id), None)
+        if entry is None:
+            return
+        shape, command, database = entry
+        stats = self._stats(shape)
+        if stats is None:
+            return
+        duration_ms = event.duration_micros / 1000
+        stats.latency.observe(duration_ms)
+        stats.returned += _returned_count(event.command_name, event.reply)
+        if event.command_name == "getMore":
+            stats.get_mores += 1
+        else:
+            stats.count += 1
+        cursor = event.reply.get("cursor")
+        cursor_id = cursor.get("id") if isinstance(cursor, dict) else 0
+        if cursor_id:
+            self._cursors[cursor_id] = shape
+            while len(self._cursors) > 10000:
+                self._cursors.popitem(last=False)
+        elif event.command_name == "getMore":
+            self._cursors.pop(command.get("getMore"), None)
+        if (duration_ms >= PROFILER_EXPLAIN_MS and event.command_name in EXPLAINABLE_COMMANDS
+                and time.monotonic() - stats.explained_at >= PROFILER_EXPLAIN_EVERY_SECONDS):
+            self._explain_queue[shape] = (database, command)
+
+    def failed(self, event):
+        entry = self._in_flight.pop((event.request_id, event.connection_id), None)
+        if entry is not None and (stats := self._stats(entry[0])) is not None:
+            stats.errors += 1
+            stats.latency.observe(event.duration_micros / 1000)
+
+    def _stats(self, shape: tuple) -> Optional[QueryShapeStats]:
+        stats = self.shapes.get(shape)
+        if stats is None:
+            if len(self.shapes) >= PROFILER_MAX_SHAPES:
+                self.overflow += 1
+                return None
+            stats = self.shapes[shape] = QueryShapeStats(shape)
+        return stats
+
+    async def explain_pending(self, client: AsyncIOMotorClient):
+        """Explain the queued slow commands, one per shape."""
+        while self._explain_queue:
+            shape, (database, command) = self._explain_queue.popitem()
+            stats = self.shapes.get(shape)
+            if stats is None:
+                continue
+            stats.explained_at = time.monotonic()
+            explained = {k: v for k, v in command.items()
+                         if not k.startswith("$") and k not in ("lsid", "txnNumber", "autocommit", "startTransaction")}
+            try:
+                reply = await client[database].command({"explain": explained, "verbosity": "executionStats"})
+            except Exception as e:
+                logger.info("Explain failed for %s.%s: %s", shape[0], shape[1], e)
+                continue
+            stats.explain = _plan_summary(reply)
+            examined = stats.explain["docs_examined"]
+            stats.flagged = examined >= PROFILER_SCAN_MIN_DOCS and examined > PROFILER_SCAN_RATIO * max(stats.explain["returned"], 1)
+
+    def report(self, sort: str = "total_ms", limit: int = 20) -> list:
+        shapes = sorted((s.to_dict() for s in list(self.shapes.values())), key=lambda s: s[sort], reverse=True)
+        return shapes[:limit]
+
+    def reset(self):
+        self.shapes.clear()
+        self.overflow = 0
+
+    def snapshot(self) -> dict:
+        return {
+            "shapes_tracked": len(self.shapes),
+            "overflow": self.overflow,
+            "flagged": sum(1 for s in list(self.shapes.values()) if s.flagged),
+            "explains_pending": len(self._explain_queue)
+        }
+
+_query_profiler = QueryProfiler() if QUERY_PROFILER else None
+if _query_profiler is not None:
+    account_container("query_profiler.shapes", 8 * 1024 * 1024, _query_profiler.shapes, evictable=False)
+
+async def _explain_slow_queries():
+    while True:
+        await asyncio.sleep(10)
+        try:
+            await _query_profiler.explain_pending(analytics_client)
+        except Exception:
+            logger.exception("Query explain failed")
+
+class PoolMonitor(monitoring.ConnectionPoolListener):
+    """Connection checkout waits and pool occupancy for one Motor client."""
+
+    def __init__(self, profile: str, settings: dict):
+        self.profile = profile
+        self.settings = settings
+        self.wait = LatencyHistogram(f"mongo_pool.{profile}.checkout_wait")
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.checkouts = 0
+        self.waited = 0  # checkouts that took over 1 ms, i.e. had to queue or dial
+        self.timeouts = 0
+        self._started = threading.local()  # checkout start, per driver thread
+        METRICS[f"mongo_pool.{profile}"] = self
+
+    def connection_check_out_started(self, event):
+        self._started.at = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        wait_ms = (time.perf_counter() - getattr(self._started, "at", time.perf_counter())) * 1000
+        self.wait.observe(wait_ms)
+        self.checkouts += 1
+        self.waited += wait_ms > 1
+        self.in_use += 1
+        self.peak_in_use = max(self.peak_in_use, self.in_use)
+
+    def connection_check_out_failed(self, event):
+        self.timeouts += event.reason == monitoring.ConnectionCheckOutFailedReason.TIMEOUT
+
+    def connection_checked_in(self, event):
+        self.in_use -= 1
+
+    def _ignore(self, event):
+        pass
+
+    pool_created = pool_ready = pool_cleared = pool_closed = _ignore
+    connection_created = connection_ready = connection_closed = _ignore
+
+    def snapshot(self) -> dict:
+        return {
+            **self.settings, "in_use": self.in_use, "peak_in_use": self.peak_in_use,
+            "checkouts": self.checkouts, "waited": self.waited, "timeouts": self.timeouts
+        }
+
+# MongoDB connection
+# Queries are routed by read profile, each with its own Motor client and pool:
+# - primary: auth, credits and the ledger. Reads and writes on the primary,
+#   so a balance is never read from a lagging secondary.
+# - analytics: admin listings, logs and reports. Prefers secondaries, caps
+#   every operation at MONGO_ANALYTICS_TIMEOUT_MS (sent to the server as
+#   maxTimeMS) and queues on its own small pool, so a heavy admin query waits
+#   behind other admin queries instead of tool requests.
+mongo_url = os.environ['MONGO_URL']
+MONGO_POOL_SIZE = int(os.environ.get('MONGO_POOL_SIZE', 100))
+MONGO_ANALYTICS_URL = os.environ.get('MONGO_ANALYTICS_URL', mongo_url)
+MONGO_ANALYTICS_POOL_SIZE = int(os.environ.get('MONGO_ANALYTICS_POOL_SIZE', 10))
+MONGO_ANALYTICS_READ_PREFERENCE = os.environ.get('MONGO_ANALYTICS_READ_PREFERENCE', 'secondaryPreferred')
+MONGO_ANALYTICS_MAX_STALENESS_SECONDS = int(os.environ.get('MONGO_ANALYTICS_MAX_STALENESS_SECONDS', 120))
+MONGO_ANALYTICS_TIMEOUT_MS = int(os.environ.get('MONGO_ANALYTICS_TIMEOUT_MS', 5000))
+
+READ_PROFILES = {
+    "primary": {"maxPoolSize": MONGO_POOL_SIZE},
+    "analytics": {
+        "maxPoolSize": MONGO_ANALYTICS_POOL_SIZE,
+        "readPreference": MONGO_ANALYTICS_READ_PREFERENCE,
+        "timeoutMS": MONGO_ANALYTICS_TIMEOUT_MS,
+        # Only valid for non-primary read preferences; the server minimum is 90
+        **({"maxStalenessSeconds": MONGO_ANALYTICS_MAX_STALENESS_SECONDS}
+           if MONGO_ANALYTICS_READ_PREFERENCE != "primary" and MONGO_ANALYTICS_MAX_STALENESS_SECONDS > 0 else {})
+    },
 }
 
+def _profile_client(profile: str, url: str) -> AsyncIOMotorClient:
+    settings = READ_PROFILES[profile]
+    listeners = [MongoSpanListener(), PoolMonitor(profile, settings)]
+    if _query_profiler is not None:
+        listeners.append(_query_profiler)
+    return AsyncIOMotorClient(url, tz_aware=True, event_listeners=listeners, **settings)
+
+client = _profile_client("primary", mongo_url)
+db = client[os.environ['DB_NAME']]
+analytics_client = _profile_client("analytics", MONGO_ANALYTICS_URL)
+analytics_db = analytics_client[os.environ['DB_NAME']]
+
+@app.exception_handler(ExecutionTimeout)
+@app.exception_handler(NetworkTimeout)
+@app.exception_handler(WaitQueueTimeoutError)
+async def query_timeout_handler(request: Request, exc: Exception):
+    """Analytics queries over their time budget (server- or client-side), or stuck waiting on their pool"""
+    return JSONResponse(
+        {"detail": "Query exceeded its time limit; narrow the request or retry later"},
+        status_code=503, headers={"Retry-After": "5"}
+    )
+
 # ============== HELPERS ==============
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
-    expire = datetime.now(timezone.utc) + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
-    to_encode.update({"exp": expire})
+    now = datetime.now(timezone.utc)
+    expire = now + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
+    # iat has one-second resolution; revocation compares the millisecond issue time
+    to_encode.update({"exp": expire, "iat": int(now.timestamp()), "iat_ms": int(now.timestamp() * 1000)})
     return jwt.encode(to_encode, JWT_SECRET, algorithm=JWT_ALGORITHM)
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+def _timed_hash(fn, *args):
+    # thread_time measures CPU spent by this worker thread only
+    started = time.thread_time()
+    try:
+        return fn(*args)
+    finally:
+        PASSWORD_HASH_CPU.observe((time.thread_time() - started) * 1000)
+
+# Hashing is deliberately slow, so it runs in a worker thread instead of the event loop
+async def verify_and_update_password(plain_password: str, hashed_password: str):
+    """Return (valid, new_hash); new_hash is set when the stored hash should be upgraded."""
+    return await asyncio.to_thread(_timed_hash, password_context().verify_and_update, plain_password, hashed_password)
+
+async def get_password_hash(password: str) -> str:
+    return await asyncio.to_thread(_timed_hash, password_context().hash, password)
+
+# Every user document carries a version that each change to its balance, status
+# or usage increments in the same update, so user-scoped reads can be answered
+# with 304 when the client already has the current version.
+def user_etag(user: dict, view: str) -> str:
+    return f'"{view}-{user["id"]}-{user.get("version", 0)}"'
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    return header is not None and (header.strip() == "*" or etag in (tag.strip() for tag in header.split(",")))
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "private, no-cache"})
+
+# ============== TOKENS ==============
+# Access tokens are short-lived JWTs. Verified claims are kept in a small LRU
+# keyed by token digest until they expire, so repeat requests skip signature
+# checks. Revocation (suspension, logout everywhere) is a per-user "issued
+# before" watermark held in memory and synced from token_revocations; entries
+# only need to outlive the access token lifetime. Refresh tokens are opaque,
+# stored as digests, single-use and rotated on every refresh; replaying a
+# used one revokes its whole family.
 
-def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', 10000))
+TOKEN_REVOCATION_SYNC_SECONDS = int(os.environ.get('TOKEN_REVOCATION_SYNC_SECONDS', 5))
+REFRESH_REUSE_GRACE_SECONDS = 10
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+_token_cache: "OrderedDict[bytes, dict]" = OrderedDict()  # token digest -> verified claims
+_revoked_before: dict = {}  # user id -> epoch milliseconds; tokens issued earlier are rejected
+account_container("tokens.cache", 16 * 1024 * 1024, _token_cache)
+account_container("tokens.revocations", 8 * 1024 * 1024, _revoked_before, evictable=False)
+
+def _token_digest(token: str) -> bytes:
+    return hashlib.blake2b(token.encode(), digest_size=16).digest()
+
+def verify_access_token(token: str) -> dict:
+    """Return verified claims for an access token, raising JWTError if invalid."""
+    digest = _token_digest(token)
+    claims = _token_cache.get(digest)
+    if claims is None:
+        claims = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+        _token_cache[digest] = claims
+        if len(_token_cache) > TOKEN_CACHE_SIZE:
+            _token_cache.popitem(last=False)
+    elif claims["exp"] <= time.time():
+        del _token_cache[digest]
+        raise JWTError("Signature has expired.")
+    else:
+        _token_cache.move_to_end(digest)
+    
+    issued_ms = claims.get("iat_ms", claims.get("iat", 0) * 1000)
+    if issued_ms < _revoked_before.get(claims.get("sub"), 0):
+        raise JWTError("Token revoked")
+    return claims
+
+async def revoke_user_tokens(user_id: str):
+    """Invalidate every access and refresh token issued to a user so far."""
+    # +1 so a token issued in the same millisecond is revoked too; one issued right after is not
+    revoked_before = int(time.time() * 1000) + 1
+    _revoked_before[user_id] = revoked_before
+    await db.token_revocations.update_one(
+        {"_id": user_id},
+        {"$set": {
+            "revoked_before_ms": revoked_before,
+            "expires_at": datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES + 1)
+        }, "$unset": {"revoked_before": ""}},
+        upsert=True
+    )
+    await db.refresh_tokens.delete_many({"user_id": user_id})
+
+async def _sync_token_revocations():
+    global _revoked_before
+    while True:
+        try:
+            # Only revocations younger than the access token lifetime are kept, so this stays small
+            revocations = await db.token_revocations.find({}, {"revoked_before_ms": 1, "revoked_before": 1}).to_list(None)
+            # revoked_before (epoch seconds) is what earlier versions wrote; it expires with the access token lifetime
+            _revoked_before = {
+                r["_id"]: r.get("revoked_before_ms", r.get("revoked_before", 0) * 1000) for r in revocations
+            }
+        except Exception:
+            logger.exception("Token revocation sync failed")
+        await asyncio.sleep(TOKEN_REVOCATION_SYNC_SECONDS)
+
+async def issue_refresh_token(user_id: str, family_id: Optional[str] = None) -> str:
+    token = secrets.token_urlsafe(32)
+    await db.refresh_tokens.insert_one({
+        "_id": hashlib.sha256(token.encode()).hexdigest(),
+        "user_id": user_id,
+        "family_id": family_id or str(uuid.uuid4()),
+        "used_at": None,
+        "expires_at": datetime.now(timezone.utc) + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+    })
+    return token
+
+async def rotate_refresh_token(token: str):
+    """Consume a refresh token, returning (user_id, replacement token)."""
+    digest = hashlib.sha256(token.encode()).hexdigest()
+    now = datetime.now(timezone.utc)
+    stored = await db.refresh_tokens.find_one_and_update(
+        {"_id": digest, "used_at": None, "expires_at": {"$gt": now}},
+        {"$set": {"used_at": now}}
+    )
+    if stored is None:
+        used = await db.refresh_tokens.find_one({"_id": digest, "used_at": {"$lt": now - timedelta(seconds=REFRESH_REUSE_GRACE_SECONDS)}})
+        if used:
+            # A rotated token came back outside the grace window for concurrent tabs: assume it leaked
+            logger.warning("Refresh token reuse detected for user %s", used["user_id"])
+            await db.refresh_tokens.delete_many({"family_id": used["family_id"]})
+        raise HTTPException(status_code=401, detail="Invalid refresh token")
+    return stored["user_id"], await issue_refresh_token(stored["user_id"], stored["family_id"])
+
+async def get_current_claims(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    """Authenticate from the token alone, for routes that never read the user document."""
     try:
-        payload = jwt.decode(credentials.credentials, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        user_id = payload.get("sub")
-        if user_id is None:
-            raise HTTPException(status_code=401, detail="Invalid token")
-        user = await db.users.find_one({"id": user_id}, {"_id": 0})
-        if user is None:
-            raise HTTPException(status_code=401, detail="User not found")
-        if not user.get("is_active", True):
-            raise HTTPException(status_code=403, detail="User suspended")
-        return user
+        claims = verify_access_token(credentials.credentials)
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
+    if claims.get("sub") is None:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    return claims
+
+# The recent_activity buffer is only needed by the usage history endpoint
+USER_PROJECTION = {"_id": 0, "recent_activity": 0}
+
+async def _load_active_user(user_id: str, projection: dict) -> dict:
+    user = await db.users.find_one(user_filter(user_id), projection)
+    if user is None:
+        raise HTTPException(status_code=401, detail="User not found")
+    if not user.get("is_active", True):
+        raise HTTPException(status_code=403, detail="User suspended")
+    return user
+
+def _batch_user(request: Request) -> Optional[dict]:
+    """The user already loaded by /api/batch, when running as one of its sub-requests."""
+    user = request.scope.get("batch_user")
+    return dict(user) if user is not None else None
+
+@traced()
+async def get_current_user(request: Request, claims: dict = Depends(get_current_claims)):
+    user = _batch_user(request)
+    if user is not None:
+        user.pop("recent_activity", None)
+        return user
+    return await _load_active_user(claims["sub"], USER_PROJECTION)
 
 async def require_admin(user: dict = Depends(get_current_user)):
     if user.get("role") != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
     return user
 
+@traced()
 async def check_credits(user: dict, tool: str):
     cost = CREDIT_COSTS.get(tool, 1)
     if user.get("credits", 0) < cost:
         raise HTTPException(status_code=402, detail=f"Insufficient credits. Required: {cost}, Available: {user.get('credits', 0)}")
     return cost
 
+@traced()
 async def deduct_credits(user_id: str, tool: str, cost: int, status_str: str = "success", details: str = None):
-    user = await db.users.find_one({"id": user_id}, {"_id": 0})
-    new_balance = user.get("credits", 0) - cost
-    await db.users.update_one({"id": user_id}, {"$set": {"credits": new_balance}})
-    
-    # Log usage
-    usage_log = {
+    """Charge cost in one conditional update and return the new balance, or raise 402 if it no longer covers it."""
+    entry = _usage_entry(tool, cost, status_str, details)
+    user = await db.users.find_one_and_update(
+        {**user_filter(user_id), "credits": {"$gte": cost}},
+        {"$inc": {"credits": -cost, "version": 1}, **_push_activity(entry)},
+        projection={"_id": 0, "email": 1, "credits": 1}
+    )
+    if user is None:
+        # A concurrent charge spent the credits check_credits saw
+        current = await db.users.find_one(user_filter(user_id), {"_id": 0, "credits": 1}) or {}
+        raise HTTPException(status_code=402, detail=f"Insufficient credits. Required: {cost}, Available: {current.get('credits', 0)}")
+    await _log_usage(user_id, user.get("email"), entry)
+    return user["credits"] - cost  # read atomically with the update, before it
+
+# ============== CREDIT HOLDS ==============
+# Two-phase charging for tools that call an upstream service: hold_credits
+# reserves the cost with one conditional update, then the handler either
+# commits the hold when the upstream call succeeded or releases it when it
+# failed. Holds live in a small credit_holds collection; any left behind by a
+# crashed or hung request are refunded by the background sweeper once stale.
+
+CREDIT_HOLD_TTL_SECONDS = int(os.environ.get('CREDIT_HOLD_TTL_SECONDS', 120))
+CREDIT_HOLD_SWEEP_SECONDS = int(os.environ.get('CREDIT_HOLD_SWEEP_SECONDS', 30))
+
+# Every charge also pushes its usage entry onto a bounded recent_activity array
+# on the user, in the same update, so the usage history page reads one small
+# document; usage_logs keeps the full history for deeper paging and admins.
+RECENT_ACTIVITY_SIZE = int(os.environ.get('RECENT_ACTIVITY_SIZE', 50))
+
+def _usage_entry(tool: str, credits_used: int, status_str: str, details: str = None) -> dict:
+    return {
         "id": str(uuid.uuid4()),
-        "user_id": user_id,
-        "user_email": user.get("email"),
         "tool": tool,
-        "credits_used": cost,
+        "credits_used": credits_used,
         "status": status_str,
         "details": details,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": timestamp()
     }
-    await db.usage_logs.insert_one(usage_log)
-    return new_balance
+
+def _push_activity(entry: dict) -> dict:
+    """Update fragment adding entry to the front of the user's recent_activity buffer."""
+    return {"$push": {"recent_activity": {"$each": [entry], "$position": 0, "$slice": RECENT_ACTIVITY_SIZE}}}
+
+async def _log_usage(user_id: str, user_email: str, entry: dict):
+    await db.usage_logs.insert_one({**entry, "user_id": user_id, "user_email": user_email})
+
+@traced()
+async def hold_credits(user: dict, tool: str) -> dict:
+    """Reserve a tool's cost from the user's balance, or raise 402."""
+    cost = CREDIT_COSTS.get(tool, 1)
+    result = await db.users.update_one(
+        {**user_filter(user["id"]), "credits": {"$gte": cost}},
+        {"$inc": {"credits": -cost, "held_credits": cost, "version": 1}}
+    )
+    if result.modified_count == 0:
+        raise HTTPException(status_code=402, detail=f"Insufficient credits. Required: {cost}, Available: {user.get('credits', 0)}")
+    
+    hold = {"id": str(uuid.uuid4()), "user_id": user["id"], "user_email": user.get("email"), "tool": tool, "amount": cost}
+    await db.credit_holds.insert_one({
+        "_id": hold["id"],
+        "user_id": user["id"],
+        "amount": cost,
+        "expires_at": datetime.now(timezone.utc) + timedelta(seconds=CREDIT_HOLD_TTL_SECONDS)
+    })
+    return hold
+
+@traced()
+async def commit_hold(hold: dict, status_str: str = "success", details: str = None) -> int:
+    """Settle a hold as a charge and log the usage. Returns the credits charged."""
+    cost = hold["amount"]
+    entry = _usage_entry(hold["tool"], cost, status_str, details)
+    if await db.credit_holds.find_one_and_delete({"_id": hold["id"]}):
+        await db.users.update_one(user_filter(hold["user_id"]), {"$inc": {"held_credits": -cost, "version": 1}, **_push_activity(entry)})
+    else:
+        # The sweeper already refunded this hold; charge again only if the balance allows
+        result = await db.users.update_one(
+            {**user_filter(hold["user_id"]), "credits": {"$gte": cost}},
+            {"$inc": {"credits": -cost, "version": 1}, **_push_activity(entry)}
+        )
+        if result.modified_count == 0:
+            cost = 0
+            entry = _usage_entry(hold["tool"], 0, "hold_expired", details)
+            await db.users.update_one(user_filter(hold["user_id"]), {"$inc": {"version": 1}, **_push_activity(entry)})
+    await _log_usage(hold["user_id"], hold["user_email"], entry)
+    return cost
+
+@traced()
+async def release_hold(hold: dict, status_str: str, details: str = None):
+    """Return a hold to the user's balance, logging the failed attempt at no charge."""
+    entry = _usage_entry(hold["tool"], 0, status_str, details)
+    if not await _refund_hold(hold["id"], entry):
+        await db.users.update_one(user_filter(hold["user_id"]), {"$inc": {"version": 1}, **_push_activity(entry)})
+    await _log_usage(hold["user_id"], hold["user_email"], entry)
+
+async def _refund_hold(hold_id: str, entry: dict = None) -> bool:
+    # find_one_and_delete makes commit, release and the sweeper mutually exclusive per hold
+    stored = await db.credit_holds.find_one_and_delete({"_id": hold_id})
+    if not stored:
+        return False
+    await db.users.update_one(
+        user_filter(stored["user_id"]),
+        {"$inc": {"credits": stored["amount"], "held_credits": -stored["amount"], "version": 1}, **(_push_activity(entry) if entry else {})}
+    )
+    return True
+
+async def expire_stale_holds() -> int:
+    stale = await db.credit_holds.find(
+        {"expires_at": {"$lt": datetime.now(timezone.utc)}}, {"_id": 1}
+    ).to_list(1000)
+    released = 0
+    for stored in stale:
+        if await _refund_hold(stored["_id"]):
+            released += 1
+    if released:
+        logger.warning("Released %d stale credit holds", released)
+    return released
+
+async def _credit_hold_sweeper():
+    while True:
+        try:
+            await expire_stale_holds()
+        except Exception:
+            logger.exception("Credit hold sweep failed")
+        await asyncio.sleep(CREDIT_HOLD_SWEEP_SECONDS)
+
+# ============== IDEMPOTENCY ==============
+# POST /api/tools/* requests carrying an Idempotency-Key header run at most once
+# per key. The first request stores a pending record; once it completes with a
+# final outcome (2xx, or 409/422), the response and its headers are kept for
+# IDEMPOTENCY_TTL_SECONDS and replayed to any retry. Any other status releases
+# the key, so a client that tops up after a 402 or waits out a 429 can retry it.
+# Duplicates arriving while the first is still running wait for its result:
+# in-process through a shared future, across workers by polling the record.
+
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', 24 * 3600))
+IDEMPOTENCY_WAIT_SECONDS = float(os.environ.get('IDEMPOTENCY_WAIT_SECONDS', 40))
+IDEMPOTENCY_POLL_SECONDS = 0.2
+IDEMPOTENT_PATH_PREFIX = "/api/tools/"
+IDEMPOTENCY_CACHED_STATUSES = (409, 422)  # besides 2xx
+# Describe the original transfer rather than the response, so they are not replayed
+IDEMPOTENCY_UNREPLAYED_HEADERS = {"content-length", "content-type", "transfer-encoding", "connection", "date", "server"}
+
+_idempotency_inflight: dict = {}  # store key -> future resolving to the stored response
+
+def _idempotency_response(record: dict) -> Response:
+    response = Response(
+        content=record["body"],
+        status_code=record["status_code"],
+        media_type=record.get("media_type"),
+        headers={"Idempotent-Replayed": "true"}
+    )
+    response.raw_headers.extend((name.encode("latin-1"), value.encode("latin-1")) for name, value in record.get("headers", []))
+    return response
+
+async def _idempotency_wait(store_key: str, fingerprint: str) -> Response:
+    """Wait for another worker to finish the request that owns store_key."""
+    deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+    while time.monotonic() < deadline:
+        record = await db.idempotency_keys.find_one({"_id": store_key})
+        if record is None:
+            break
+        if record["fingerprint"] != fingerprint:
+            return JSONResponse(status_code=422, content={"detail": "Idempotency-Key reused with a different request"})
+        if record["state"] == "done":
+            return _idempotency_response(record)
+        await asyncio.sleep(IDEMPOTENCY_POLL_SECONDS)
+    return JSONResponse(status_code=409, content={"detail": "A request with this Idempotency-Key is still in progress"})
+
+@app.middleware("http")
+async def idempotency_middleware(request, call_next):
+    key = request.headers.get("idempotency-key")
+    if not key or request.method != "POST" or not request.url.path.startswith(IDEMPOTENT_PATH_PREFIX):
+        return await call_next(request)
+    if len(key) > 255:
+        return JSONResponse(status_code=400, content={"detail": "Idempotency-Key too long"})
+    
+    # Keys are scoped to the verified user, not the bearer string, so a retry after a token
+    # refresh still finds its record and one user can never replay another's response
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    try:
+        subject = verify_access_token(token).get("sub") if scheme.lower() == "bearer" else None
+    except JWTError:
+        subject = None
+    if subject is None:
+        return await call_next(request)  # the route rejects it
+    store_key = hashlib.sha256(f"{subject}|{key}".encode()).hexdigest()
+    body = await request.body()
+    fingerprint = hashlib.sha256(request.url.path.encode() + b"|" + body).hexdigest()
+    
+    future = _idempotency_inflight.get(store_key)
+    if future is not None:
+        record = await asyncio.shield(future)
+        if record["fingerprint"] != fingerprint:
+            return JSONResponse(status_code=422, content={"detail": "Idempotency-Key reused with a different request"})
+        return _idempotency_response(record)
+    
+    now = datetime.now(timezone.utc)
+    try:
+        await db.idempotency_keys.insert_one({
+            "_id": store_key,
+            "fingerprint": fingerprint,
+            "state": "pending",
+            # A crashed worker's pending record must not block retries for the full TTL
+            "expires_at": now + timedelta(seconds=IDEMPOTENCY_WAIT_SECONDS * 2)
+        })
+    except DuplicateKeyError:
+        return await _idempotency_wait(store_key, fingerprint)
+    
+    future = asyncio.get_running_loop().create_future()
+    _idempotency_inflight[store_key] = future
+    try:
+        response = await call_next(request)
+        content = b"".join([chunk async for chunk in response.body_iterator])
+        record = {
+            "fingerprint": fingerprint,
+            "status_code": response.status_code,
+            "media_type": response.headers.get("content-type"),
+            "headers": [[name, value] for name, value in response.headers.items() if name not in IDEMPOTENCY_UNREPLAYED_HEADERS],
+            "body": content
+        }
+        if 200 <= response.status_code < 300 or response.status_code in IDEMPOTENCY_CACHED_STATUSES:
+            await db.idempotency_keys.update_one({"_id": store_key}, {"$set": {
+                **record,
+                "state": "done",
+                "expires_at": datetime.now(timezone.utc) + timedelta(seconds=IDEMPOTENCY_TTL_SECONDS)
+            }})
+        else:
+            # Errors that may clear up (402 after a top-up, 429, 5xx) are not cached,
+            # so the client can retry with the same key
+            await db.idempotency_keys.delete_one({"_id": store_key})
+        future.set_result(record)
+        return Response(content=content, status_code=response.status_code, headers=dict(response.headers))
+    except BaseException as e:
+        await db.idempotency_keys.delete_one({"_id": store_key})
+        future.set_exception(e)
+        future.exception()  # mark retrieved; waiters re-raise it themselves
+        raise
+    finally:
+        _idempotency_inflight.pop(store_key, None)
 
 # ============== AUTH ROUTES ==============
 
@@ -193,20 +1449,24 @@ async def register(user_data: UserCreate):
     
     user_id = str(uuid.uuid4())
     user = {
+        "_id": user_id,
         "id": user_id,
         "email": user_data.email,
         "name": user_data.name,
-        "password_hash": get_password_hash(user_data.password),
+        "email_lower": user_data.email.lower(),
+        "name_lower": user_data.name.lower(),
+        "password_hash": await get_password_hash(user_data.password),
         "role": "user",
         "credits": 0,
         "is_active": True,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": timestamp()
     }
     await db.users.insert_one(user)
     
     access_token = create_access_token(data={"sub": user_id, "role": "user"})
     return TokenResponse(
         access_token=access_token,
+        refresh_token=await issue_refresh_token(user_id),
         user=UserResponse(
             id=user_id,
             email=user["email"],
@@ -220,16 +1480,31 @@ async def register(user_data: UserCreate):
 
 @api_router.post("/auth/login", response_model=TokenResponse)
 async def login(login_data: UserLogin):
+    started = time.perf_counter()
+    try:
+        return await _login(login_data)
+    finally:
+        LOGIN_LATENCY.observe((time.perf_counter() - started) * 1000)
+
+async def _login(login_data: UserLogin) -> TokenResponse:
     user = await db.users.find_one({"email": login_data.email}, {"_id": 0})
-    if not user or not verify_password(login_data.password, user["password_hash"]):
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid email or password")
+    valid, new_hash = await verify_and_update_password(login_data.password, user["password_hash"])
+    if not valid:
         raise HTTPException(status_code=401, detail="Invalid email or password")
     
     if not user.get("is_active", True):
         raise HTTPException(status_code=403, detail="Account suspended")
     
+    if new_hash:
+        await db.users.update_one(user_filter(user["id"]), {"$set": {"password_hash": new_hash}})
+        PASSWORD_REHASHES.increment()
+    
     access_token = create_access_token(data={"sub": user["id"], "role": user["role"]})
     return TokenResponse(
         access_token=access_token,
+        refresh_token=await issue_refresh_token(user["id"]),
         user=UserResponse(
             id=user["id"],
             email=user["email"],
@@ -241,8 +1516,44 @@ async def login(login_data: UserLogin):
         )
     )
 
+@api_router.post("/auth/refresh", response_model=TokenResponse)
+async def refresh_tokens(data: RefreshRequest):
+    user_id, refresh_token = await rotate_refresh_token(data.refresh_token)
+    user = await db.users.find_one(user_filter(user_id), {"_id": 0})
+    if not user:
+        raise HTTPException(status_code=401, detail="User not found")
+    if not user.get("is_active", True):
+        raise HTTPException(status_code=403, detail="Account suspended")
+    
+    access_token = create_access_token(data={"sub": user["id"], "role": user["role"]})
+    return TokenResponse(
+        access_token=access_token,
+        refresh_token=refresh_token,
+        user=UserResponse(
+            id=user["id"],
+            email=user["email"],
+            name=user["name"],
+            role=user["role"],
+            credits=user["credits"],
+            is_active=user["is_active"],
+            created_at=user["created_at"]
+        )
+    )
+
+@api_router.post("/auth/logout")
+async def logout(data: RefreshRequest):
+    digest = hashlib.sha256(data.refresh_token.encode()).hexdigest()
+    stored = await db.refresh_tokens.find_one({"_id": digest}, {"family_id": 1})
+    if stored:
+        await db.refresh_tokens.delete_many({"family_id": stored["family_id"]})
+    return {"message": "Logged out"}
+
 @api_router.get("/auth/me", response_model=UserResponse)
-async def get_me(user: dict = Depends(get_current_user)):
+async def get_me(request: Request, response: Response, user: dict = Depends(get_current_user)):
+    etag = user_etag(user, "me")
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    response.headers.update({"ETag": etag, "Cache-Control": "private, no-cache"})
     return UserResponse(
         id=user["id"],
         email=user["email"],
@@ -257,12 +1568,90 @@ async def get_me(user: dict = Depends(get_current_user)):
 
 @api_router.get("/admin/users", response_model=List[UserResponse])
 async def get_all_users(admin: dict = Depends(require_admin)):
-    users = await db.users.find({}, {"_id": 0, "password_hash": 0}).to_list(1000)
+    users = await analytics_db.users.find({}, {"_id": 0, "password_hash": 0, "recent_activity": 0}).to_list(1000)
     return [UserResponse(**u) for u in users]
 
+# Keyset pagination: the cursor encodes the (sort value, id) of the last row
+# returned, so every page is an index range scan no matter how deep it is.
+USER_DIRECTORY_SORT_FIELDS = {"created_at": "created_at", "credits": "credits", "name": "name_lower"}
+USER_DIRECTORY_COUNT_CAP = 10000
+
+def _encode_cursor(values: list) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+def _decode_cursor(cursor: str) -> list:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(values, list) or len(values) != 2:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+@api_router.get("/admin/users/directory", response_model=UserDirectoryResponse)
+async def get_user_directory(
+    admin: dict = Depends(require_admin),
+    q: Optional[str] = Query(None, max_length=100),
+    mode: str = Query("prefix", pattern="^(prefix|text)$"),
+    sort: str = Query("created_at", pattern="^(created_at|credits|name)$"),
+    order: str = Query("desc", pattern="^(asc|desc)$"),
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None
+):
+    """Paged, indexed user listing with prefix or full-text search on email and name"""
+    field = USER_DIRECTORY_SORT_FIELDS[sort]
+    direction = -1 if order == "desc" else 1
+    
+    clauses = []
+    if q:
+        if mode == "text":
+            clauses.append({"$text": {"$search": q}})
+        else:
+            prefix = {"$regex": f"^{re.escape(q.lower())}"}
+            clauses.append({"$or": [{"email_lower": prefix}, {"name_lower": prefix}]})
+    search_filter = clauses[0] if clauses else {}
+    
+    if cursor:
+        last_value, last_id = _decode_cursor(cursor)
+        op = "$lt" if direction == -1 else "$gt"
+        if field == "created_at":
+            try:
+                clauses.append(created_at_keyset(op, last_value, last_id))
+            except (TypeError, ValueError):
+                raise HTTPException(status_code=400, detail="Invalid cursor")
+        else:
+            clauses.append({"$or": [{field: {op: last_value}}, {field: last_value, "id": {op: last_id}}]})
+    query = {"$and": clauses} if len(clauses) > 1 else (clauses[0] if clauses else {})
+    
+    users = await analytics_db.users.find(query, {"_id": 0, "password_hash": 0, "recent_activity": 0}) \
+        .sort([(field, direction), ("id", direction)]) \
+        .limit(limit + 1) \
+        .to_list(limit + 1)
+    
+    next_cursor = None
+    if len(users) > limit:
+        users = users[:limit]
+        last = users[-1]
+        last_value = iso_timestamp(last["created_at"]) if field == "created_at" else last.get(field)
+        next_cursor = _encode_cursor([last_value, last["id"]])
+    
+    if search_filter:
+        total = await analytics_db.users.count_documents(search_filter, limit=USER_DIRECTORY_COUNT_CAP)
+        total_is_estimate = total >= USER_DIRECTORY_COUNT_CAP
+    else:
+        total = await analytics_db.users.estimated_document_count()
+        total_is_estimate = True
+    
+    return UserDirectoryResponse(
+        users=[UserResponse(**u) for u in users],
+        next_cursor=next_cursor,
+        total=total,
+        total_is_estimate=total_is_estimate
+    )
+
 @api_router.post("/admin/credits")
 async def update_credits(data: CreditUpdate, admin: dict = Depends(require_admin)):
-    user = await db.users.find_one({"id": data.user_id}, {"_id": 0})
+    user = await db.users.find_one(user_filter(data.user_id), {"_id": 0})
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
@@ -270,7 +1659,7 @@ async def update_credits(data: CreditUpdate, admin: dict = Depends(require_admin
     if new_balance < 0:
         raise HTTPException(status_code=400, detail="Cannot reduce credits below 0")
     
-    await db.users.update_one({"id": data.user_id}, {"$set": {"credits": new_balance}})
+    await db.users.update_one(user_filter(data.user_id), {"$set": {"credits": new_balance}, "$inc": {"version": 1}})
     
     # Log credit change
     credit_log = {
@@ -281,90 +1670,1811 @@ async def update_credits(data: CreditUpdate, admin: dict = Depends(require_admin
         "balance_after": new_balance,
         "reason": data.reason,
         "admin_id": admin["id"],
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": timestamp()
     }
     await db.credit_logs.insert_one(credit_log)
     
     return {"message": "Credits updated", "new_balance": new_balance}
 
+BULK_CREDIT_MAX_ROWS = int(os.environ.get('BULK_CREDIT_MAX_ROWS', 5000))
+BULK_CREDIT_DEDUCTION_CONCURRENCY = 16  # conditional deductions in flight at once
+
+async def apply_bulk_credits(items: List[BulkCreditItem], default_reason: str, admin: dict,
+                             rows: Optional[List[int]] = None, rejected: Optional[list] = None) -> dict:
+    """Validate and apply many credit changes: grants with one bulk_write, deductions as
+    conditional updates, and their credit_logs with one insert_many.
+
+    Returns per-row outcomes in row order. Rows default to item positions; the CSV
+    upload passes line numbers instead, plus the lines it could not parse."""
+    if len(items) > BULK_CREDIT_MAX_ROWS:
+        raise HTTPException(status_code=400, detail=f"At most {BULK_CREDIT_MAX_ROWS} rows per request")
+    
+    outcomes = {row: outcome for row, outcome in (rejected or [])}
+    user_ids = list({item.user_id for item in items})
+    users = {
+        u["id"]: u for u in await db.users.find(
+            user_filter({"$in": user_ids}), {"_id": 0, "id": 1, "email": 1, "credits": 1}
+        ).to_list(len(user_ids))
+    }
+    
+    seen = set()
+    accepted = []  # (row, item)
+    for row, item in zip(rows or range(len(items)), items):
+        error = None
+        if item.amount == 0:
+            error = "Amount must be non-zero"
+        elif item.user_id in seen:
+            error = "Duplicate user_id in batch"
+        elif item.user_id not in users:
+            error = "User not found"
+        elif users[item.user_id].get("credits", 0) + item.amount < 0:
+            error = "Cannot reduce credits below 0"
+        seen.add(item.user_id)
+        if error:
+            outcomes[row] = {"user_id": item.user_id, "amount": item.amount, "status": "rejected", "error": error}
+        else:
+            accepted.append((row, item))
+    
+    if accepted:
+        failed = {}  # row -> error, for changes that did not apply
+        grants = [(row, item) for row, item in accepted if item.amount > 0]
+        if grants:
+            try:
+                await db.users.bulk_write([
+                    UpdateOne(user_filter(item.user_id), {"$inc": {"credits": item.amount, "version": 1}}) for _, item in grants
+                ], ordered=False)
+            except BulkWriteError as e:
+                # Unordered: every other grant was still applied
+                for error in e.details.get("writeErrors", []):
+                    failed[grants[error["index"]][0]] = error.get("errmsg", "Write failed")
+        
+        # Deductions are conditional, so a charge racing the batch can make one miss;
+        # each is its own update so its result tells whether it applied
+        slots = asyncio.Semaphore(BULK_CREDIT_DEDUCTION_CONCURRENCY)
+        
+        async def deduct(row: int, item: BulkCreditItem):
+            async with slots:
+                result = await db.users.update_one(
+                    {**user_filter(item.user_id), "credits": {"$gte": -item.amount}},
+                    {"$inc": {"credits": item.amount, "version": 1}}
+                )
+            if result.modified_count == 0:
+                failed[row] = "Cannot reduce credits below 0"
+        
+        await asyncio.gather(*(deduct(row, item) for row, item in accepted if item.amount < 0))
+        
+        # Balances are read back after the write: the ones read for validation miss any
+        # charge that ran in between
+        after = {
+            u["id"]: u async for u in db.users.find(
+                user_filter({"$in": [item.user_id for _, item in accepted]}), {"_id": 0, "id": 1, "credits": 1}
+            )
+        }
+        
+        now = timestamp()
+        credit_logs = []
+        for row, item in accepted:
+            error = "User not found" if item.user_id not in after else failed.get(row)
+            if error:
+                outcomes[row] = {"user_id": item.user_id, "amount": item.amount, "status": "rejected", "error": error}
+                continue
+            balance_after = after[item.user_id].get("credits", 0)
+            credit_logs.append({
+                "id": str(uuid.uuid4()),
+                "user_id": item.user_id,
+                "user_email": users[item.user_id].get("email"),
+                "amount": item.amount,
+                "balance_after": balance_after,
+                "reason": item.reason or default_reason,
+                "admin_id": admin["id"],
+                "created_at": now
+            })
+            outcomes[row] = {"user_id": item.user_id, "amount": item.amount, "status": "applied", "balance_after": balance_after}
+        if credit_logs:
+            await db.credit_logs.insert_many(credit_logs, ordered=False)
+    
+    results = [{"row": row, **outcomes[row]} for row in sorted(outcomes)]
+    applied = sum(1 for r in results if r["status"] == "applied")
+    return {"applied": applied, "rejected": len(results) - applied, "results": results}
+
+@api_router.post("/admin/credits/bulk")
+async def bulk_update_credits(data: BulkCreditUpdate, admin: dict = Depends(require_admin)):
+    return await apply_bulk_credits(data.items, data.reason, admin)
+
+@api_router.post("/admin/credits/bulk/csv")
+async def bulk_update_credits_csv(file: UploadFile = File(...), reason: str = Form(...), admin: dict = Depends(require_admin)):
+    """Apply credits from a CSV of user_id,amount[,reason] rows (header optional)"""
+    try:
+        text = (await file.read()).decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="CSV must be UTF-8 encoded")
+    
+    items, rows, rejected = [], [], []
+    for line_no, fields in enumerate(csv.reader(io.StringIO(text)), start=1):
+        if not any(f.strip() for f in fields):
+            continue
+        user_id = fields[0].strip()
+        amount = fields[1].strip() if len(fields) > 1 else ""
+        if line_no == 1 and user_id.lower() == "user_id":
+            continue
+        try:
+            row_reason = fields[2].strip() if len(fields) > 2 else ""
+            items.append(BulkCreditItem(user_id=user_id, amount=int(amount), reason=row_reason or None))
+            rows.append(line_no)
+        except ValueError:
+            rejected.append((line_no, {"user_id": user_id, "amount": amount, "status": "rejected", "error": "Invalid amount"}))
+    
+    return await apply_bulk_credits(items, reason, admin, rows, rejected)
+
 @api_router.post("/admin/users/{user_id}/suspend")
 async def suspend_user(user_id: str, admin: dict = Depends(require_admin)):
-    user = await db.users.find_one({"id": user_id}, {"_id": 0})
+    user = await db.users.find_one(user_filter(user_id), {"_id": 0})
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     if user.get("role") == "admin":
         raise HTTPException(status_code=400, detail="Cannot suspend admin")
     
     new_status = not user.get("is_active", True)
-    await db.users.update_one({"id": user_id}, {"$set": {"is_active": new_status}})
+    await db.users.update_one(user_filter(user_id), {"$set": {"is_active": new_status}, "$inc": {"version": 1}})
+    if not new_status:
+        await revoke_user_tokens(user_id)
     return {"message": f"User {'unsuspended' if new_status else 'suspended'}", "is_active": new_status}
 
+@api_router.get("/admin/metrics")
+async def get_metrics(admin: dict = Depends(require_admin)):
+    """Snapshot of every registered in-process metric"""
+    return {name: metric.snapshot() for name, metric in METRICS.items()}
+
+@api_router.get("/admin/memory")
+async def get_memory(admin: dict = Depends(require_admin)):
+    """Worker RSS against its budget and the size of every accounted cache and buffer"""
+    accounts = {name: account.snapshot() for name, account in list(MEMORY_ACCOUNTS.items())}
+    return {
+        **METRICS["memory"].snapshot(),
+        "pressure_events": MEMORY_PRESSURE_EVENTS.value,
+        "evicted_bytes": MEMORY_EVICTED_BYTES.value,
+        "tracemalloc": tracemalloc.is_tracing(),
+        "accounts": dict(sorted(accounts.items(), key=lambda item: item[1]["bytes"], reverse=True))
+    }
+
+_tracemalloc_baseline: Optional[tracemalloc.Snapshot] = None
+
+def _take_allocation_snapshot() -> tracemalloc.Snapshot:
+    return tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+        tracemalloc.Filter(False, "<unknown>"),
+    ))
+
+def _allocation_stat(stat, group_by: str) -> dict:
+    frames = [frame.filename if group_by == "filename" else f"{frame.filename}:{frame.lineno}" for frame in stat.traceback]
+    entry = {"where": frames[0] if group_by != "traceback" else frames, "size_bytes": stat.size, "count": stat.count}
+    if isinstance(stat, tracemalloc.StatisticDiff):
+        entry.update(size_diff_bytes=stat.size_diff, count_diff=stat.count_diff)
+    return entry
+
+@api_router.post("/admin/memory/tracemalloc")
+async def start_tracemalloc(admin: dict = Depends(require_admin), frames: int = Query(1, ge=1, le=25)):
+    """Start tracing allocations (costs CPU and memory while on) and take the baseline for diffs"""
+    global _tracemalloc_baseline
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+    _tracemalloc_baseline = await asyncio.to_thread(_take_allocation_snapshot)
+    return {"message": "Tracing allocations", "frames": tracemalloc.get_traceback_limit()}
+
+@api_router.get("/admin/memory/tracemalloc")
+async def get_tracemalloc(
+    admin: dict = Depends(require_admin),
+    group_by: str = Query("lineno", pattern="^(lineno|filename|traceback)$"),
+    diff: bool = Query(False, description="Compare against the baseline instead of listing totals"),
+    limit: int = Query(25, ge=1, le=200)
+):
+    """Top allocation sites now, or their growth since the baseline"""
+    if not tracemalloc.is_tracing() or _tracemalloc_baseline is None:
+        raise HTTPException(status_code=409, detail="Allocation tracing is off; POST /api/admin/memory/tracemalloc first")
+    snapshot = await asyncio.to_thread(_take_allocation_snapshot)
+    if diff:
+        stats = await asyncio.to_thread(snapshot.compare_to, _tracemalloc_baseline, group_by)
+    else:
+        stats = await asyncio.to_thread(snapshot.statistics, group_by)
+    traced, peak = tracemalloc.get_traced_memory()
+    return {
+        "traced_bytes": traced,
+        "peak_traced_bytes": peak,
+        "stats": [_allocation_stat(stat, group_by) for stat in stats[:limit]]
+    }
+
+@api_router.delete("/admin/memory/tracemalloc")
+async def stop_tracemalloc(admin: dict = Depends(require_admin)):
+    global _tracemalloc_baseline
+    _tracemalloc_baseline = None
+    tracemalloc.stop()
+    return {"message": "Allocation tracing stopped"}
+
+@api_router.get("/admin/traces")
+async def get_traces(
+    admin: dict = Depends(require_admin),
+    path: Optional[str] = Query(None, description="Glob on the request path, e.g. /api/tools/*"),
+    min_ms: float = Query(0),
+    limit: int = Query(50, le=TRACE_RECENT_LIMIT)
+):
+    """Most recent kept traces, newest first, with the Mongo/upstream time of each"""
+    traces = [t for t in reversed(_recent_traces)
+              if t["duration_ms"] >= min_ms and (path is None or fnmatch(t["path"], path))]
+    return {"traces": traces[:limit], "sample_rate": TRACE_SAMPLE_RATE, "slow_ms": TRACE_SLOW_MS}
+
+@api_router.get("/admin/query-profile")
+async def get_query_profile(
+    admin: dict = Depends(require_admin),
+    sort: str = Query("total_ms", pattern="^(total_ms|count|p95_ms|max_ms|returned|errors)$"),
+    flagged: bool = Query(False, description="Only shapes whose explain examined too many documents"),
+    limit: int = Query(20, ge=1, le=PROFILER_MAX_SHAPES)
+):
+    """Top Mongo query shapes by total time (or another column), with their latest explain"""
+    if _query_profiler is None:
+        raise HTTPException(status_code=404, detail="Query profiler is disabled")
+    shapes = _query_profiler.report(sort, PROFILER_MAX_SHAPES)
+    if flagged:
+        shapes = [s for s in shapes if s["flagged"]]
+    return {"shapes": shapes[:limit], **_query_profiler.snapshot()}
+
+@api_router.delete("/admin/query-profile")
+async def reset_query_profile(admin: dict = Depends(require_admin)):
+    if _query_profiler is None:
+        raise HTTPException(status_code=404, detail="Query profiler is disabled")
+    _query_profiler.reset()
+    return {"message": "Query profile reset"}
+
+@api_router.get("/admin/credit-holds")
+async def get_credit_holds(admin: dict = Depends(require_admin), limit: int = Query(100, le=1000)):
+    """Outstanding credit holds, oldest expiry first"""
+    holds = await analytics_db.credit_holds.find({}).sort("expires_at", 1).to_list(limit)
+    return {
+        "holds": [{"id": h.pop("_id"), **h, "expires_at": h["expires_at"].isoformat()} for h in holds],
+        "total": await analytics_db.credit_holds.count_documents({})
+    }
+
 @api_router.get("/admin/usage-logs", response_model=List[UsageLogResponse])
 async def get_usage_logs(admin: dict = Depends(require_admin), limit: int = Query(100, le=1000)):
-    logs = await db.usage_logs.find({}, {"_id": 0}).sort("created_at", -1).to_list(limit)
+    logs = await analytics_db.usage_logs.find({}, {"_id": 0}).sort("created_at", -1).to_list(limit)
     return logs
 
 @api_router.get("/admin/credit-logs", response_model=List[CreditLogResponse])
 async def get_credit_logs(admin: dict = Depends(require_admin), limit: int = Query(100, le=1000)):
-    logs = await db.credit_logs.find({}, {"_id": 0}).sort("created_at", -1).to_list(limit)
+    logs = await analytics_db.credit_logs.find({}, {"_id": 0}).sort("created_at", -1).to_list(limit)
     return logs
 
+# ============== LEDGER RECONCILIATION ==============
+# Checks that each user's balance equals the credits granted in credit_logs
+# minus the credits charged in usage_logs, less anything currently held. A
+# pass reads only log records past a (created_at, id) watermark kept per
+# collection, folds them into a running sum per user in ledger_balances, and
+# then compares just the users it touched plus those already flagged, so its
+# cost follows new activity rather than total history. Records younger than
+# RECONCILE_LAG_SECONDS wait for the next pass, so an insert that commits
+# late is never stranded behind the watermark. A charge reaches the user a
+# moment before its usage log is written, so a mismatch is only recorded in
+# ledger_drift if it is still there RECONCILE_CONFIRM_SECONDS later.
+
+RECONCILE_INTERVAL_SECONDS = int(os.environ.get('RECONCILE_INTERVAL_SECONDS', 300))  # 0 disables the background task
+RECONCILE_BATCH_SIZE = int(os.environ.get('RECONCILE_BATCH_SIZE', 500))
+RECONCILE_BATCH_PAUSE_SECONDS = float(os.environ.get('RECONCILE_BATCH_PAUSE_SECONDS', 0.2))
+RECONCILE_LAG_SECONDS = int(os.environ.get('RECONCILE_LAG_SECONDS', 60))
+RECONCILE_CONFIRM_SECONDS = float(os.environ.get('RECONCILE_CONFIRM_SECONDS', 5))
+RECONCILE_LEASE_SECONDS = 120
+
+# (collection, amount field, sign) of every record that moves a balance
+LEDGER_STREAMS = (("credit_logs", "amount", 1), ("usage_logs", "credits_used", -1))
+
+LEDGER_RECORDS_FOLDED = Counter("ledger.records_folded")
+LEDGER_ACCOUNTS_CHECKED = Counter("ledger.accounts_checked")
+LEDGER_DRIFTED_ACCOUNTS = Gauge("ledger.drifted_accounts")
+LEDGER_LAST_PASS_MS = Gauge("ledger.last_pass_ms")
+
+_reconcile_owner = secrets.token_hex(8)
+
+def _ledger_key(record: dict) -> str:
+    return f"{iso_timestamp(record['created_at'])}|{record['id']}"
+
+def _initial_credit_log(user: dict) -> dict:
+    """credit_logs record for the credits a seeded account starts with"""
+    return {
+        "id": str(uuid.uuid4()),
+        "user_id": user["id"],
+        "user_email": user["email"],
+        "amount": user["credits"],
+        "balance_after": user["credits"],
+        "reason": "Initial credits",
+        "admin_id": "system",
+        "created_at": user["created_at"]
+    }
+
+async def _acquire_reconcile_lease() -> bool:
+    """Take or renew the lease that keeps one worker reconciling at a time."""
+    now = datetime.now(timezone.utc)
+    try:
+        await db.reconciliation_state.find_one_and_update(
+            {"_id": "credit_ledger", "$or": [
+                {"lease_until": {"$lt": now}}, {"lease_owner": _reconcile_owner}, {"lease_until": {"$exists": False}}
+            ]},
+            {"$set": {"lease_owner": _reconcile_owner, "lease_until": now + timedelta(seconds=RECONCILE_LEASE_SECONDS)}},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        return False
+
+async def _fold_ledger_stream(collection: str, field: str, sign: int, cutoff: datetime) -> set:
+    """Add records past the collection's watermark to the per-user sums. Returns the users touched."""
+    touched = set()
+    while await _acquire_reconcile_lease():
+        state = await db.reconciliation_state.find_one({"_id": "credit_ledger"}, {collection: 1})
+        watermark = state.get(collection)
+        query = created_at_filter("$lt", cutoff)
+        if watermark:
+            created_at, record_id = watermark.split("|", 1)
+            query = {"$and": [query, created_at_keyset("$gt", created_at, record_id)]}
+        records = await db[collection].find(query, {"_id": 0, "id": 1, "user_id": 1, "created_at": 1, field: 1}) \
+            .sort([("created_at", 1), ("id", 1)]) \
+            .limit(RECONCILE_BATCH_SIZE) \
+            .to_list(RECONCILE_BATCH_SIZE)
+        if not records:
+            break
+        
+        # Skip records a user's sum already includes, in case an earlier pass
+        # stopped between updating the sums and saving the watermark
+        through_field = f"through_{collection}"
+        user_ids = list({r["user_id"] for r in records})
+        through = {b["_id"]: b.get(through_field, "") for b in await db.ledger_balances.find(
+            {"_id": {"$in": user_ids}}, {through_field: 1}
+        ).to_list(len(user_ids))}
+        sums = {}
+        for r in records:
+            key = _ledger_key(r)
+            if key <= through.get(r["user_id"], ""):
+                continue
+            total, last = sums.get(r["user_id"], (0, key))
+            sums[r["user_id"]] = (total + sign * (r.get(field) or 0), max(last, key))
+        if sums:
+            await db.ledger_balances.bulk_write([
+                UpdateOne({"_id": user_id}, {"$inc": {"sum": total}, "$set": {through_field: last}}, upsert=True)
+                for user_id, (total, last) in sums.items()
+            ], ordered=False)
+        await db.reconciliation_state.update_one({"_id": "credit_ledger"}, {"$set": {collection: _ledger_key(records[-1])}})
+        LEDGER_RECORDS_FOLDED.increment(len(records))
+        touched.update(r["user_id"] for r in records)
+        if len(records) < RECONCILE_BATCH_SIZE:
+            break
+        await asyncio.sleep(RECONCILE_BATCH_PAUSE_SECONDS)
+    return touched
+
+async def _find_drift(user_ids: list, state: dict) -> dict:
+    """Users whose balance differs from their ledger, as user_id -> drift record."""
+    users = await db.users.find(
+        user_filter({"$in": user_ids}), {"_id": 0, "id": 1, "email": 1, "credits": 1, "held_credits": 1}
+    ).to_list(len(user_ids))
+    balances = {b["_id"]: b for b in await db.ledger_balances.find({"_id": {"$in": user_ids}}).to_list(len(user_ids))}
+    # Records past the watermarks are not in the sums yet; add this user's directly
+    pending = dict.fromkeys(user_ids, 0)
+    for collection, field, sign in LEDGER_STREAMS:
+        watermark = state.get(collection, "")
+        since = created_at_filter("$gte", watermark.split("|", 1)[0]) if watermark else {}
+        async for r in db[collection].find(
+            {"user_id": {"$in": user_ids}, **since},
+            {"_id": 0, "id": 1, "user_id": 1, "created_at": 1, field: 1}
+        ):
+            if _ledger_key(r) > watermark:
+                pending[r["user_id"]] += sign * (r.get(field) or 0)
+    
+    drift = {}
+    for user in users:
+        balance = balances.get(user["id"], {})
+        expected = balance.get("opening", 0) + balance.get("sum", 0) + pending[user["id"]] - user.get("held_credits", 0)
+        actual = user.get("credits", 0)
+        if actual != expected:
+            drift[user["id"]] = {
+                "user_email": user.get("email"), "expected": expected, "actual": actual,
+                "drift": actual - expected, "abs_drift": abs(actual - expected)
+            }
+    LEDGER_ACCOUNTS_CHECKED.increment(len(users))
+    return drift
+
+async def reconcile_ledger() -> Optional[dict]:
+    """One incremental pass. Returns its summary, or None if another worker holds the lease."""
+    if not await _acquire_reconcile_lease():
+        return None
+    started = time.perf_counter()
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=RECONCILE_LAG_SECONDS)
+    touched = set()
+    for collection, field, sign in LEDGER_STREAMS:
+        touched |= await _fold_ledger_stream(collection, field, sign, cutoff)
+    
+    flagged = set(await db.ledger_drift.distinct("_id"))
+    candidates = list(touched | flagged)
+    state = await db.reconciliation_state.find_one({"_id": "credit_ledger"}) or {}
+    drift = {}
+    for i in range(0, len(candidates), RECONCILE_BATCH_SIZE):
+        # Renewed per batch: a large flagged set can outlast the lease
+        if not await _acquire_reconcile_lease():
+            return None
+        drift.update(await _find_drift(candidates[i:i + RECONCILE_BATCH_SIZE], state))
+        await asyncio.sleep(RECONCILE_BATCH_PAUSE_SECONDS)
+    if drift:
+        await asyncio.sleep(RECONCILE_CONFIRM_SECONDS)
+        confirmed = {}
+        suspects = list(drift)
+        for i in range(0, len(suspects), RECONCILE_BATCH_SIZE):
+            if not await _acquire_reconcile_lease():
+                return None
+            confirmed.update(await _find_drift(suspects[i:i + RECONCILE_BATCH_SIZE], state))
+        drift = confirmed
+    
+    now = datetime.now(timezone.utc)
+    resolved = list(flagged - drift.keys())
+    if resolved:
+        await db.ledger_drift.delete_many({"_id": {"$in": resolved}})
+    for user_id, record in drift.items():
+        await db.ledger_drift.update_one(
+            {"_id": user_id},
+            {"$set": {**record, "checked_at": now.isoformat()}, "$setOnInsert": {"detected_at": now.isoformat()}},
+            upsert=True
+        )
+    
+    summary = {
+        "finished_at": now.isoformat(),
+        "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+        "accounts_checked": len(candidates),
+        "drifted": len(drift),
+        "resolved": len(resolved)
+    }
+    await db.reconciliation_state.update_one({"_id": "credit_ledger"}, {"$set": {"last_pass": summary}})
+    LEDGER_DRIFTED_ACCOUNTS.set(len(drift))
+    LEDGER_LAST_PASS_MS.set(summary["duration_ms"])
+    if drift:
+        logger.warning("Ledger drift on %d accounts (%d newly checked)", len(drift), len(touched))
+    return summary
+
+async def _reconcile_ledger_periodically():
+    while True:
+        await asyncio.sleep(RECONCILE_INTERVAL_SECONDS)
+        try:
+            await reconcile_ledger()
+        except Exception:
+            logger.exception("Ledger reconciliation failed")
+
+@api_router.get("/admin/ledger/drift")
+async def get_ledger_drift(admin: dict = Depends(require_admin), limit: int = Query(100, le=1000)):
+    """Accounts whose balance disagrees with their credit and usage logs, largest drift first"""
+    accounts = await analytics_db.ledger_drift.find({}, {"abs_drift": 0}).sort("abs_drift", -1).to_list(limit)
+    state = await analytics_db.reconciliation_state.find_one({"_id": "credit_ledger"}) or {}
+    return {
+        "accounts": [{"user_id": a.pop("_id"), **a} for a in accounts],
+        "total": await analytics_db.ledger_drift.count_documents({}),
+        "last_pass": state.get("last_pass"),
+        "watermarks": {collection: state.get(collection) for collection, _, _ in LEDGER_STREAMS}
+    }
+
+@api_router.post("/admin/ledger/drift/{user_id}/accept")
+async def accept_ledger_drift(user_id: str, admin: dict = Depends(require_admin)):
+    """Take an account's current drift as its opening balance, e.g. for balances set before logging"""
+    record = await db.ledger_drift.find_one_and_delete({"_id": user_id})
+    if not record:
+        raise HTTPException(status_code=404, detail="No drift recorded for this user")
+    await db.ledger_balances.update_one({"_id": user_id}, {"$inc": {"opening": record["drift"]}}, upsert=True)
+    logger.warning("Ledger drift of %d accepted for %s by %s", record["drift"], record.get("user_email"), admin["email"])
+    return {"message": "Drift accepted", "opening_adjustment": record["drift"]}
+
+# ============== LOG TAIL ==============
+# Admins watch new usage and credit log records over Server-Sent Events.
+# Each worker follows the log collections once, however many admins are
+# watching: a single change stream (or, on a standalone server, a poller on
+# the (created_at, id) index) runs while at least one viewer is connected and
+# publishes every new record, serialized once, to each viewer's bounded
+# queue. Filters are applied on the server. Every event id is the record's
+# "created_at|id" position, so a reconnecting client (Last-Event-ID) is first
+# sent what it missed; a viewer that falls LOG_TAIL_BUFFER events behind is
+# sent a `lagged` event and disconnected to reconnect the same way.
+
+LOG_TAIL_COLLECTIONS = ("usage_logs", "credit_logs")
+LOG_TAIL_BUFFER = int(os.environ.get('LOG_TAIL_BUFFER', 500))
+LOG_TAIL_BACKFILL = int(os.environ.get('LOG_TAIL_BACKFILL', 200))
+LOG_TAIL_POLL_SECONDS = float(os.environ.get('LOG_TAIL_POLL_SECONDS', 1))
+LOG_TAIL_POLL_OVERLAP_SECONDS = 5  # re-read window for records committed out of created_at order
+LOG_TAIL_HEARTBEAT_SECONDS = float(os.environ.get('LOG_TAIL_HEARTBEAT_SECONDS', 15))
+
+def _log_tail_frame(collection: str, doc: dict) -> bytes:
+    doc = {**doc, "created_at": iso_timestamp(doc["created_at"])}
+    return f"id: {doc['created_at']}|{doc['id']}\nevent: {collection}\ndata: {json.dumps(doc, default=str)}\n\n".encode()
+
+class LogTailViewer:
+    __slots__ = ("queue", "collections", "filters")
+
+    def __init__(self, collections: set, filters: dict):
+        self.queue = asyncio.Queue(LOG_TAIL_BUFFER)
+        self.collections = collections
+        self.filters = filters  # field -> required value
+
+    def matches(self, collection: str, doc: dict) -> bool:
+        return collection in self.collections and all(doc.get(k) == v for k, v in self.filters.items())
+
+class LogTail:
+    def __init__(self):
+        self.viewers = set()
+        self.task: Optional[asyncio.Task] = None
+        self.mode = "idle"
+        self.resume_token = None
+        self.published = 0
+        self.delivered = 0
+        self.lagged = 0
+        METRICS["log_tail"] = self
+
+    def subscribe(self, collections: set, filters: dict) -> LogTailViewer:
+        viewer = LogTailViewer(collections, filters)
+        self.viewers.add(viewer)
+        if self.task is None:
+            self.task = asyncio.create_task(self._follow())
+        return viewer
+
+    def unsubscribe(self, viewer: LogTailViewer):
+        self.viewers.discard(viewer)
+        if not self.viewers and self.task is not None:
+            self.task.cancel()
+            self.task = None
+            self.mode = "idle"
+            # The next viewer starts from now; Last-Event-ID backfill covers anything older
+            self.resume_token = None
+
+    async def stop(self):
+        self.viewers.clear()
+        if self.task is not None:
+            self.task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self.task
+            self.task = None
+        self.mode = "idle"
+        self.resume_token = None
+
+    def disconnect(self, viewer: LogTailViewer):
+        # Drop its backlog and tell it to reconnect from its last event id
+        self.viewers.discard(viewer)
+        while not viewer.queue.empty():
+            viewer.queue.get_nowait()
+        viewer.queue.put_nowait(None)
+
+    def publish(self, collection: str, doc: dict):
+        self.published += 1
+        frame = None
+        for viewer in list(self.viewers):
+            if not viewer.matches(collection, doc):
+                continue
+            frame = frame or _log_tail_frame(collection, doc)
+            try:
+                viewer.queue.put_nowait((doc["id"], frame))
+                self.delivered += 1
+            except asyncio.QueueFull:
+                self.lagged += 1
+                self.disconnect(viewer)
+
+    async def _follow(self):
+        try:
+            await self._follow_change_stream()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.info("Log tail change stream unavailable (%s); polling the log collections", e)
+        self.mode = "polling"
+        await self._poll()
+
+    async def _follow_change_stream(self):
+        pipeline = [{"$match": {"operationType": "insert", "ns.coll": {"$in": list(LOG_TAIL_COLLECTIONS)}}}]
+        while True:
+            try:
+                async with db.watch(pipeline, resume_after=self.resume_token) as stream:
+                    self.mode = "change_stream"
+                    async for change in stream:
+                        self.resume_token = change["_id"]
+                        doc = change["fullDocument"]
+                        doc.pop("_id", None)
+                        self.publish(change["ns"]["coll"], doc)
+            except PyMongoError as e:
+                if self.resume_token is None:
+                    raise
+                if isinstance(e, OperationFailure):
+                    # The driver already retried anything resumable; the server rejected the
+                    # token itself (e.g. it has left the oplog). Restart from now and have the
+                    # viewers reconnect, so their Last-Event-ID backfill covers the gap.
+                    logger.warning("Log tail change stream cannot resume (%s); restarting from now", e)
+                    self.resume_token = None
+                    for viewer in list(self.viewers):
+                        self.disconnect(viewer)
+                    continue
+                # The stream was working; resume where it stopped
+                logger.warning("Log tail change stream interrupted (%s); resuming", e)
+                await asyncio.sleep(1)
+
+    async def _poll(self):
+        overlap = timedelta(seconds=LOG_TAIL_POLL_OVERLAP_SECONDS)
+        watermarks = {}
+        seen = {}  # collection -> {id: created_at} of records published inside the overlap window
+        for collection in LOG_TAIL_COLLECTIONS:
+            latest = await db[collection].find({}, {"created_at": 1}).sort([("created_at", -1), ("id", -1)]).limit(1).to_list(1)
+            watermarks[collection] = parse_timestamp(latest[0]["created_at"]) if latest else None
+            seen[collection] = OrderedDict()
+        # The first pass only records what is already inside the overlap window
+        primed = False
+        while True:
+            if primed:
+                await asyncio.sleep(LOG_TAIL_POLL_SECONDS)
+            for collection in LOG_TAIL_COLLECTIONS:
+                since = watermarks[collection]
+                window = {} if since is None else created_at_filter("$gte", since - overlap)
+                position = None
+                try:
+                    # Page through the whole window on the (created_at, id) keyset, so a
+                    # burst of more than LOG_TAIL_BUFFER records cannot pin the watermark
+                    while True:
+                        query = window if position is None else {"$and": [window, created_at_keyset("$gt", *position)]}
+                        docs = await db[collection].find(query, {"_id": 0}).sort(
+                            [("created_at", 1), ("id", 1)]).limit(LOG_TAIL_BUFFER).to_list(None)
+                        for doc in docs:
+                            created_at = parse_timestamp(doc["created_at"])
+                            if watermarks[collection] is None or created_at > watermarks[collection]:
+                                watermarks[collection] = created_at
+                            if doc["id"] in seen[collection]:
+                                continue
+                            seen[collection][doc["id"]] = created_at
+                            if primed:
+                                self.publish(collection, doc)
+                        if len(docs) < LOG_TAIL_BUFFER:
+                            break
+                        position = (docs[-1]["created_at"], docs[-1]["id"])
+                except Exception:
+                    logger.exception("Log tail poll of %s failed", collection)
+                    continue
+                # Forget ids that have left the overlap window
+                recent = seen[collection]
+                while recent and next(iter(recent.values())) < watermarks[collection] - overlap:
+                    recent.popitem(last=False)
+            primed = True
+
+    def snapshot(self) -> dict:
+        return {
+            "mode": self.mode, "viewers": len(self.viewers), "published": self.published,
+            "delivered": self.delivered, "lagged": self.lagged
+        }
+
+_log_tail = LogTail()
+MemoryAccount(
+    "log_tail.queues", 16 * 1024 * 1024,
+    lambda: sum(len(item[1]) for viewer in _log_tail.viewers for item in viewer.queue._queue if item),
+    entries=lambda: sum(viewer.queue.qsize() for viewer in _log_tail.viewers)
+)
+
+async def _log_tail_backfill(position: str, collections: set, filters: dict) -> tuple:
+    """Records after `position` (newest LOG_TAIL_BACKFILL), oldest first, and whether older ones were skipped."""
+    created_at, _, record_id = position.partition("|")
+    query = {**filters, **created_at_keyset("$gt", created_at, record_id)}
+    missed = []
+    for collection in LOG_TAIL_COLLECTIONS:
+        if collection in collections:
+            docs = await analytics_db[collection].find(query, {"_id": 0}).sort(
+                [("created_at", -1), ("id", -1)]).limit(LOG_TAIL_BACKFILL + 1).to_list(None)
+            missed.extend((collection, doc) for doc in docs)
+    missed.sort(key=lambda item: (parse_timestamp(item[1]["created_at"]), item[1]["id"]))
+    return missed[-LOG_TAIL_BACKFILL:], len(missed) > LOG_TAIL_BACKFILL
+
+@api_router.get("/admin/logs/stream")
+async def stream_logs(
+    request: Request,
+    admin: dict = Depends(require_admin),
+    collections: str = Query(",".join(LOG_TAIL_COLLECTIONS)),
+    user_id: Optional[str] = None,
+    tool: Optional[str] = None,
+    status: Optional[str] = None,
+    since: Optional[str] = Query(None, description="Event id to resume after; the Last-Event-ID header takes precedence")
+):
+    """New usage and credit log records as Server-Sent Events, one event type per collection"""
+    wanted = set(filter(None, collections.split(",")))
+    if not wanted or not wanted <= set(LOG_TAIL_COLLECTIONS):
+        raise HTTPException(status_code=400, detail=f"collections must be a subset of {', '.join(LOG_TAIL_COLLECTIONS)}")
+    filters = {k: v for k, v in (("user_id", user_id), ("tool", tool), ("status", status)) if v is not None}
+    position = request.headers.get("last-event-id") or since
+    if position:
+        try:
+            parse_timestamp(position.partition("|")[0])
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid event id")
+    
+    async def events():
+        # Subscribe before the backfill so nothing committed in between is lost
+        viewer = _log_tail.subscribe(wanted, filters)
+        try:
+            yield b"retry: 3000\n\n"
+            sent = set()
+            if position:
+                missed, truncated = await _log_tail_backfill(position, wanted, filters)
+                if truncated:
+                    yield b"event: gap\ndata: {}\n\n"
+                for collection, doc in missed:
+                    sent.add(doc["id"])
+                    yield _log_tail_frame(collection, doc)
+            while True:
+                try:
+                    item = await asyncio.wait_for(viewer.queue.get(), LOG_TAIL_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield b": ping\n\n"
+                    continue
+                if item is None:
+                    yield b"event: lagged\ndata: {}\n\n"
+                    return
+                record_id, frame = item
+                if record_id in sent:
+                    sent.discard(record_id)
+                    continue
+                yield frame
+        finally:
+            _log_tail.unsubscribe(viewer)
+    
+    return StreamingResponse(
+        events(), media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# ============== SCHEMA MIGRATIONS ==============
+# Versioned data migrations that run online, in throttled batches, while the
+# API keeps serving. Each one moves through states recorded in the migrations
+# collection, which every worker re-reads every MIGRATION_POLL_SECONDS:
+#
+#   running   writers switch to the new layout and readers accept both; old
+#             documents are converted in batches, saving a checkpoint after
+#             each so an interrupted run resumes. Once every worker has seen
+#             `running`, a second sweep catches documents written in the old
+#             layout in the meantime
+#   complete  readers use the new layout only; once they all have, whatever
+#             only the old layout needed (the unique users.id index) is dropped
+#
+# One process runs migrations at a time under a lease. With MIGRATIONS_AUTO=on
+# the workers start pending migrations themselves; otherwise run
+# `python migrate.py` once every worker runs this version. Index sizes and
+# hot-query latency are measured before and after each migration.
+
+MIGRATIONS_AUTO = os.environ.get('MIGRATIONS_AUTO', 'off') == 'on'
+MIGRATION_BATCH_SIZE = int(os.environ.get('MIGRATION_BATCH_SIZE', 500))
+MIGRATION_BATCH_PAUSE_SECONDS = float(os.environ.get('MIGRATION_BATCH_PAUSE_SECONDS', 0.5))
+MIGRATION_POLL_SECONDS = float(os.environ.get('MIGRATION_POLL_SECONDS', 10))
+MIGRATION_MEASURE_SAMPLES = int(os.environ.get('MIGRATION_MEASURE_SAMPLES', 50))
+MIGRATION_LEASE_SECONDS = 120
+
+MIGRATION_DOCUMENTS = Counter("migrations.documents_migrated")
+
+_migration_owner = secrets.token_hex(8)
+_migration_status: dict = {}  # name -> status, as last read from the migrations collection
+
+class MigrationError(Exception):
+    """A migration that cannot run, or cannot run safely, against this deployment."""
+
+def migration_started(name: str) -> bool:
+    return _migration_status.get(name) in ("running", "complete")
+
+def migration_complete(name: str) -> bool:
+    return _migration_status.get(name) == "complete"
+
+async def refresh_migration_status():
+    async for state in db.migrations.find({"status": {"$exists": True}}, {"status": 1}):
+        _migration_status[state["_id"]] = state["status"]
+
+def parse_timestamp(value) -> datetime:
+    """A created_at in either stored form, or an ISO string from a client, as an aware UTC datetime"""
+    when = value if isinstance(value, datetime) else datetime.fromisoformat(value)
+    return when.astimezone(timezone.utc) if when.tzinfo else when.replace(tzinfo=timezone.utc)
+
+def iso_timestamp(value) -> str:
+    """A created_at in either stored form as the ISO string used in responses, cursors and ledger keys"""
+    return value if isinstance(value, str) else parse_timestamp(value).isoformat()
+
+def timestamp():
+    """created_at for a new record: a native date once created_at_dates has started, else an ISO string"""
+    now = datetime.now(timezone.utc)
+    return now if migration_started("created_at_dates") else now.isoformat()
+
+def _created_at_forms(value) -> list:
+    when = parse_timestamp(value)
+    return [when] if migration_complete("created_at_dates") else [when, when.isoformat()]
+
+def created_at_filter(op: str, value) -> dict:
+    """created_at {op: value}, matching both stored forms until created_at_dates is complete"""
+    clauses = [{"created_at": {op: form}} for form in _created_at_forms(value)]
+    return clauses[0] if len(clauses) == 1 else {"$or": clauses}
+
+def created_at_keyset(op: str, value, record_id: str) -> dict:
+    """Records after ("$gt") or before ("$lt") the (created_at, id) position, in either stored form"""
+    forms = _created_at_forms(value)
+    return {"$or": [*({"created_at": {op: form}} for form in forms), {"created_at": {"$in": forms}, "id": {op: record_id}}]}
+
+def user_filter(user_id) -> dict:
+    """Match users by id - a value or an operator such as {"$in": ids} - through _id once user_id_keys is complete"""
+    return {"_id" if migration_complete("user_id_keys") else "id": user_id}
+
+class Migration(abc.ABC):
+    """
+    One versioned migration. run_batch converts up to MIGRATION_BATCH_SIZE
+    documents from `checkpoint` on and returns (checkpoint, converted, done).
+    It must be idempotent: a run resumes from the last saved checkpoint and
+    always ends with a second full sweep.
+    """
+    version = 0
+    name = ""
+    description = ""
+
+    async def check(self, offline: bool):
+        """Raise MigrationError if the migration cannot run safely here."""
+
+    @abc.abstractmethod
+    async def run_batch(self, checkpoint: dict, offline: bool) -> tuple:
+        """Convert the next batch from `checkpoint`; return (checkpoint, converted, done)."""
+
+    async def contract(self):
+        """Drop what only the old layout needed, once every reader uses the new one."""
+
+class CreatedAtDates(Migration):
+    version = 1
+    name = "created_at_dates"
+    description = "Store created_at on users, their recent activity and both log collections as native dates"
+    COLLECTIONS = ("usage_logs", "credit_logs", "users")
+
+    async def run_batch(self, checkpoint: dict, offline: bool) -> tuple:
+        position = checkpoint.get("collection", 0)
+        if position >= len(self.COLLECTIONS):
+            return checkpoint, 0, True
+        collection = self.COLLECTIONS[position]
+        query = {"created_at": {"$type": "string"}}
+        if collection == "users":
+            query = {"$or": [query, {"recent_activity.created_at": {"$type": "string"}}]}
+        # Newest first: dates sort after strings, so the converted records and
+        # the new ones written as dates stay one contiguous, correctly ordered range
+        docs = await db[collection].find(query, {"created_at": 1, "recent_activity": 1, "version": 1}) \
+            .sort("created_at", -1).limit(MIGRATION_BATCH_SIZE).to_list(MIGRATION_BATCH_SIZE)
+        if not docs:
+            return {"collection": position + 1}, 0, position + 1 >= len(self.COLLECTIONS)
+        ops = []
+        for doc in docs:
+            try:
+                changes = {"created_at": parse_timestamp(doc["created_at"])}
+                if "recent_activity" in doc:
+                    changes["recent_activity"] = [
+                        {**entry, "created_at": parse_timestamp(entry["created_at"])} for entry in doc["recent_activity"]
+                    ]
+            except (KeyError, TypeError, ValueError) as e:
+                raise MigrationError(f"{collection} {doc['_id']} has an unreadable created_at ({e})")
+            # Conditional on the value read (or the user's version), so a concurrent write is never overwritten;
+            # a document that changed in between is picked up again by the next batch
+            guard = {"version": doc.get("version")} if collection == "users" else {"created_at": doc["created_at"]}
+            ops.append(UpdateOne({"_id": doc["_id"], **guard}, {"$set": changes}))
+        result = await db[collection].bulk_write(ops, ordered=False)
+        return checkpoint, result.modified_count, False
+
+class UserIdKeys(Migration):
+    version = 2
+    name = "user_id_keys"
+    description = "Key users by their id (_id = id) so lookups use the _id index, then drop the separate unique id index"
+
+    async def check(self, offline: bool):
+        # A fresh database has every user keyed by _id = id already; nothing to move
+        if offline or not await db.users.find_one({"_id": {"$type": "objectId"}}, {"_id": 1}):
+            return
+        hello = await client.admin.command("hello")
+        if "setName" not in hello and hello.get("msg") != "isdbgrid":
+            raise MigrationError(
+                "moving users to new _id values online needs transactions (a replica set); "
+                "stop the API and run `python migrate.py --offline` instead"
+            )
+
+    async def _move(self, doc_id, session=None):
+        doc = await db.users.find_one({"_id": doc_id}, session=session)
+        if doc is not None:
+            await db.users.delete_one({"_id": doc_id}, session=session)
+            await db.users.insert_one({**doc, "_id": doc["id"]}, session=session)
+
+    async def run_batch(self, checkpoint: dict, offline: bool) -> tuple:
+        # Users created by this version already have _id = id; only ObjectId keys are left to move
+        docs = await db.users.find({"_id": {"$type": "objectId"}}, {"_id": 1}).limit(MIGRATION_BATCH_SIZE).to_list(MIGRATION_BATCH_SIZE)
+        for doc in docs:
+            if offline:
+                await self._move(doc["_id"])
+            else:
+                # Delete and re-insert atomically: a concurrent update waits for the commit, then finds the new document
+                async with await client.start_session() as session:
+                    await session.with_transaction(lambda s, doc_id=doc["_id"]: self._move(doc_id, s))
+        return checkpoint, len(docs), not docs
+
+    async def contract(self):
+        with contextlib.suppress(PyMongoError):
+            await db.users.drop_index("id_1")
+
+class UserSearchKeys(Migration):
+    version = 3
+    name = "user_search_keys"
+    description = "Backfill the lowercase name and email keys the directory searches for users created before it existed"
+
+    async def run_batch(self, checkpoint: dict, offline: bool) -> tuple:
+        query = {"$or": [{"name_lower": {"$exists": False}}, {"email_lower": {"$exists": False}}]}
+        ids = [doc["_id"] for doc in await db.users.find(query, {"_id": 1}).limit(MIGRATION_BATCH_SIZE).to_list(MIGRATION_BATCH_SIZE)]
+        if not ids:
+            return checkpoint, 0, True
+        # A pipeline update lowercases the current name, so a rename in between is never undone
+        result = await db.users.update_many(
+            {"_id": {"$in": ids}},
+            [{"$set": {"name_lower": {"$toLower": "$name"}, "email_lower": {"$toLower": "$email"}}}]
+        )
+        return checkpoint, result.modified_count, False
+
+MIGRATIONS = (CreatedAtDates(), UserIdKeys(), UserSearchKeys())
+
+async def _acquire_migration_lease() -> bool:
+    now = datetime.now(timezone.utc)
+    try:
+        await db.migrations.find_one_and_update(
+            {"_id": "lease", "$or": [
+                {"lease_until": {"$lt": now}}, {"lease_owner": _migration_owner}, {"lease_until": {"$exists": False}}
+            ]},
+            {"$set": {"lease_owner": _migration_owner, "lease_until": now + timedelta(seconds=MIGRATION_LEASE_SECONDS)}},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        return False
+
+async def measure_schema() -> dict:
+    """Index sizes of users and both log collections, and the latency of their hot queries"""
+    index_bytes = {}
+    for collection in ("users", "usage_logs", "credit_logs"):
+        try:
+            stats = await db.command("collStats", collection)
+            index_bytes[collection] = {"total": stats.get("totalIndexSize"), **stats.get("indexSizes", {})}
+        except Exception as e:
+            index_bytes[collection] = {"error": str(e)}
+    
+    now = datetime.now(timezone.utc)
+    hot_queries = {
+        "user_by_id": lambda user_id: db.users.find_one(user_filter(user_id), USER_PROJECTION),
+        "usage_history_page": lambda user_id: db.usage_logs.find(
+            {"user_id": user_id, **created_at_filter("$lt", now)}, {"_id": 0}
+        ).sort("created_at", -1).to_list(50),
+        "credit_logs_last_day": lambda user_id: db.credit_logs.find(
+            {"user_id": user_id, **created_at_filter("$gte", now - timedelta(days=1))}, {"_id": 0}
+        ).to_list(100),
+    }
+    user_ids = [u["id"] for u in await db.users.find({}, {"_id": 0, "id": 1}).to_list(MIGRATION_MEASURE_SAMPLES)]
+    query_ms = {}
+    for name, query in hot_queries.items():
+        samples = []
+        for user_id in user_ids[:1] + user_ids:  # the first run only warms the cache
+            started = time.perf_counter()
+            await query(user_id)
+            samples.append((time.perf_counter() - started) * 1000)
+        samples = sorted(samples[1:])
+        query_ms[name] = {
+            "p50": round(samples[len(samples) // 2], 3),
+            "p95": round(samples[int(len(samples) * 0.95)], 3),
+            "samples": len(samples)
+        } if samples else None
+    return {"measured_at": now, "index_bytes": index_bytes, "query_ms": query_ms}
+
+async def _wait_for_workers(since: datetime, offline: bool):
+    """Give every worker time to poll the migration's latest status."""
+    if not offline:
+        remaining = (parse_timestamp(since) + timedelta(seconds=2 * MIGRATION_POLL_SECONDS) - datetime.now(timezone.utc)).total_seconds()
+        await asyncio.sleep(max(0.0, remaining))
+
+async def run_migration(migration: Migration, offline: bool = False) -> bool:
+    """Drive one migration to completion. False if another process holds the lease."""
+    name = migration.name
+    if not await _acquire_migration_lease():
+        return False
+    await migration.check(offline)
+    state = await db.migrations.find_one({"_id": name}) or {}
+    if state.get("status") not in ("running", "complete"):
+        state = {
+            "version": migration.version,
+            "description": migration.description,
+            "status": "running",
+            "started_at": datetime.now(timezone.utc),
+            "sweep": 1,
+            "checkpoint": {},
+            "migrated": 0,
+            "before": await measure_schema()
+        }
+        await db.migrations.update_one({"_id": name}, {"$set": state}, upsert=True)
+        _migration_status[name] = "running"
+        logger.info("Migration %s started", name)
+    
+    if state["status"] == "running":
+        checkpoint, sweep = state.get("checkpoint") or {}, state.get("sweep", 1)
+        while sweep <= 2:
+            if sweep == 2:
+                # Every worker must be writing the new layout before the final sweep
+                await _wait_for_workers(state["started_at"], offline)
+            done = False
+            while not done:
+                if not await _acquire_migration_lease():
+                    return False
+                checkpoint, migrated, done = await migration.run_batch(checkpoint, offline)
+                MIGRATION_DOCUMENTS.increment(migrated)
+                await db.migrations.update_one({"_id": name}, {"$set": {"checkpoint": checkpoint}, "$inc": {"migrated": migrated}})
+                if not done:
+                    await asyncio.sleep(MIGRATION_BATCH_PAUSE_SECONDS)
+            sweep, checkpoint = sweep + 1, {}
+            await db.migrations.update_one({"_id": name}, {"$set": {"sweep": sweep, "checkpoint": checkpoint}})
+        state["completed_at"] = datetime.now(timezone.utc)
+        await db.migrations.update_one({"_id": name}, {"$set": {"status": "complete", "completed_at": state["completed_at"]}})
+        _migration_status[name] = "complete"
+        logger.info("Migration %s complete", name)
+    
+    # Readers switch to the new layout on their next poll; only then can the old one's indexes go
+    await _wait_for_workers(state["completed_at"], offline)
+    await migration.contract()
+    await db.migrations.update_one({"_id": name}, {"$set": {"contracted": True, "after": await measure_schema()}})
+    return True
+
+async def run_migrations(offline: bool = False) -> list:
+    """Run every unfinished migration in version order. Returns the names finished by this call."""
+    await refresh_migration_status()
+    finished = []
+    try:
+        for migration in MIGRATIONS:
+            state = await db.migrations.find_one({"_id": migration.name}, {"contracted": 1}) or {}
+            if state.get("contracted"):
+                continue
+            try:
+                if not await run_migration(migration, offline):
+                    break
+            except Exception as e:
+                await db.migrations.update_one({"_id": migration.name}, {"$set": {"error": str(e)}})
+                raise
+            await db.migrations.update_one({"_id": migration.name}, {"$unset": {"error": ""}})
+            finished.append(migration.name)
+    finally:
+        await db.migrations.update_one(
+            {"_id": "lease", "lease_owner": _migration_owner}, {"$set": {"lease_until": datetime.now(timezone.utc)}}
+        )
+    return finished
+
+async def _follow_migrations():
+    """Keep this worker's view of migration status current, running pending ones when MIGRATIONS_AUTO is on."""
+    auto = MIGRATIONS_AUTO
+    while not all(migration_complete(m.name) for m in MIGRATIONS):
+        await asyncio.sleep(MIGRATION_POLL_SECONDS)
+        try:
+            await refresh_migration_status()
+            if auto:
+                await run_migrations()
+        except asyncio.CancelledError:
+            raise
+        except MigrationError as e:
+            logger.warning("Automatic migrations stopped: %s", e)
+            auto = False
+        except Exception:
+            logger.exception("Migration run failed")
+
+@api_router.get("/admin/migrations")
+async def get_migrations(admin: dict = Depends(require_admin)):
+    """Every migration with its status, progress and before/after measurements"""
+    states = {s.pop("_id"): s for s in await db.migrations.find({"status": {"$exists": True}}).to_list(None)}
+    return [
+        {"version": m.version, "name": m.name, "description": m.description, "status": "pending", **states.get(m.name, {})}
+        for m in MIGRATIONS
+    ]
+
+# ============== TEMP EMAIL POOL ==============
+# Temp-email addresses are generated ahead of time so "generate" hands one
+# out without waiting on 1secmail. A background task keeps the pool at
+# TEMP_EMAIL_POOL_SIZE addresses, each issued by 1secmail and confirmed
+# readable with an inbox probe, using at most TEMP_EMAIL_REFILL_CONCURRENCY
+# upstream calls at a time. Addresses older than TEMP_EMAIL_POOL_MAX_AGE are
+# discarded. When the pool is empty, the request generates one itself, as
+# before, and that counts as a miss. The pool starts filling on the worker's
+# first temp-email request, so workers that never serve one never load httpx.
+
+TEMP_EMAIL_API = "https://www.1secmail.com/api/v1/"
+TEMP_EMAIL_POOL_SIZE = int(os.environ.get('TEMP_EMAIL_POOL_SIZE', 20))
+TEMP_EMAIL_POOL_MAX_AGE = int(os.environ.get('TEMP_EMAIL_POOL_MAX_AGE', 1800))
+TEMP_EMAIL_REFILL_CONCURRENCY = int(os.environ.get('TEMP_EMAIL_REFILL_CONCURRENCY', 4))
+TEMP_EMAIL_POOL_CHECK_SECONDS = int(os.environ.get('TEMP_EMAIL_POOL_CHECK_SECONDS', 30))
+
+TEMP_EMAIL_REFILL_LATENCY = LatencyHistogram("temp_email_pool.refill_latency")
+
+class TempEmailPool:
+    def __init__(self, size: int):
+        self.size = size
+        self.addresses = deque()  # (email, created monotonic), oldest first
+        self.refilling = 0
+        self.wakeup = asyncio.Event()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.refill_failures = 0
+        self.task: Optional[asyncio.Task] = None
+        METRICS["temp_email_pool"] = self
+
+    def start(self):
+        if self.task is None and self.size > 0:
+            self.task = asyncio.create_task(self.run())
+            _background_tasks.append(self.task)
+
+    def _expire(self):
+        cutoff = time.monotonic() - TEMP_EMAIL_POOL_MAX_AGE
+        while self.addresses and self.addresses[0][1] < cutoff:
+            self.addresses.popleft()
+            self.expired += 1
+
+    def take(self) -> Optional[str]:
+        """Hand out the oldest fresh address, or None when the pool is empty."""
+        self.start()
+        self._expire()
+        if len(self.addresses) <= self.size // 2:
+            self.wakeup.set()
+        if not self.addresses:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return self.addresses.popleft()[0]
+
+    async def _generate_one(self, client_http) -> bool:
+        started = time.perf_counter()
+        try:
+            response = await client_http.get(TEMP_EMAIL_API, params={"action": "genRandomMailbox", "count": 1})
+            response.raise_for_status()
+            email = response.json()[0]
+            login, domain = email.split("@")
+            probe = await client_http.get(TEMP_EMAIL_API, params={"action": "getMessages", "login": login, "domain": domain})
+            probe.raise_for_status()
+        except Exception as e:
+            self.refill_failures += 1
+            logger.debug("Temp email pool refill failed: %s", e)
+            return False
+        self.addresses.append((email, time.monotonic()))
+        TEMP_EMAIL_REFILL_LATENCY.observe((time.perf_counter() - started) * 1000)
+        return True
+
+    async def _refill_worker(self, client_http):
+        while len(self.addresses) + self.refilling < self.size:
+            self.refilling += 1
+            try:
+                generated = await self._generate_one(client_http)
+            finally:
+                self.refilling -= 1
+            if not generated:
+                # Upstream is failing; leave the rest to the next check
+                return
+
+    async def run(self):
+        async with upstream_client(timeout=10.0) as client_http:
+            while True:
+                self.wakeup.clear()
+                self._expire()
+                missing = self.size - len(self.addresses)
+                if missing > 0:
+                    workers = min(missing, TEMP_EMAIL_REFILL_CONCURRENCY)
+                    await asyncio.gather(*(self._refill_worker(client_http) for _ in range(workers)))
+                # Sleep until a take() drains the pool below half, or the next expiry check
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self.wakeup.wait(), TEMP_EMAIL_POOL_CHECK_SECONDS)
+
+    def snapshot(self) -> dict:
+        served = self.hits + self.misses
+        return {
+            "depth": len(self.addresses),
+            "target": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "miss_rate": round(self.misses / served, 4) if served else 0,
+            "expired": self.expired,
+            "refill_failures": self.refill_failures
+        }
+
+_temp_email_pool = TempEmailPool(TEMP_EMAIL_POOL_SIZE)
+
+# ============== TEMP EMAIL MESSAGES ==============
+# Inbox listings are cached per mailbox for TEMP_EMAIL_INBOX_TTL_SECONDS so
+# repeated refreshes share one upstream call. A message never changes once
+# delivered, so read messages are cached by (mailbox, message id) in an LRU
+# bounded by TEMP_EMAIL_MESSAGE_CACHE_BYTES. Attachments are streamed through
+# without being held in memory. Mailboxes are only readable by the user who
+# generated them (or an admin): generation records the owner in
+# temp_mailboxes, and the owner of recently checked mailboxes is cached.
+
+TEMP_EMAIL_INBOX_TTL_SECONDS = float(os.environ.get('TEMP_EMAIL_INBOX_TTL_SECONDS', 5))
+TEMP_EMAIL_INBOX_CACHE_SIZE = 1024
+TEMP_EMAIL_MESSAGE_CACHE_BYTES = int(os.environ.get('TEMP_EMAIL_MESSAGE_CACHE_BYTES', 8 * 1024 * 1024))
+TEMP_EMAIL_MAILBOX_TTL = timedelta(days=7)
+TEMP_EMAIL_OWNER_CACHE_SIZE = 4096
+
+class ByteBoundedLRU:
+    def __init__(self, name: str, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[tuple, tuple]" = OrderedDict()  # key -> (value, size)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        METRICS[name] = self
+        MemoryAccount(name, max_bytes, lambda: self.bytes, self.shrink, lambda: len(self.entries))
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, value, size: int):
+        if size > self.max_bytes:
+            return
+        if key in self.entries:
+            self.bytes -= self.entries.pop(key)[1]
+        self.entries[key] = (value, size)
+        self.bytes += size
+        self.shrink(self.max_bytes)
+
+    def shrink(self, target_bytes: int) -> int:
+        """Evict least recently used entries until at most target_bytes remain."""
+        freed = 0
+        while self.bytes > target_bytes:
+            _, (_, evicted_size) = self.entries.popitem(last=False)
+            self.bytes -= evicted_size
+            self.evictions += 1
+            freed += evicted_size
+        return freed
+
+    def snapshot(self) -> dict:
+        return {
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
+
+_temp_email_http: Optional["httpx.AsyncClient"] = None
+_temp_email_inboxes: "OrderedDict[str, tuple]" = OrderedDict()  # mailbox -> (fetched monotonic, messages)
+_temp_email_messages = ByteBoundedLRU("temp_email_messages", TEMP_EMAIL_MESSAGE_CACHE_BYTES)
+_temp_mailbox_owners: "OrderedDict[str, str]" = OrderedDict()  # mailbox -> user id
+account_container("temp_email.inboxes", 16 * 1024 * 1024, _temp_email_inboxes)
+account_container("temp_email.owners", 1024 * 1024, _temp_mailbox_owners)
+
+def _temp_email_client() -> "httpx.AsyncClient":
+    global _temp_email_http
+    if _temp_email_http is None:
+        _temp_email_http = upstream_client(timeout=10.0, follow_redirects=True)
+    return _temp_email_http
+
+def _split_mailbox(email: str) -> tuple:
+    login, _, domain = email.strip().lower().partition("@")
+    if not login or not domain:
+        raise HTTPException(status_code=400, detail="Invalid email address")
+    return login, domain
+
+def _remember_mailbox_owner(mailbox: str, user_id: str):
+    _temp_mailbox_owners[mailbox] = user_id
+    _temp_mailbox_owners.move_to_end(mailbox)
+    if len(_temp_mailbox_owners) > TEMP_EMAIL_OWNER_CACHE_SIZE:
+        _temp_mailbox_owners.popitem(last=False)
+
+async def record_temp_mailbox(email: str, user_id: str):
+    login, domain = _split_mailbox(email)
+    mailbox = f"{login}@{domain}"
+    await db.temp_mailboxes.update_one(
+        {"_id": mailbox},
+        {"$set": {"user_id": user_id, "expires_at": datetime.now(timezone.utc) + TEMP_EMAIL_MAILBOX_TTL}},
+        upsert=True
+    )
+    _remember_mailbox_owner(mailbox, user_id)
+
+async def require_temp_mailbox_owner(email: str, claims: dict):
+    """404 unless the caller generated this mailbox; admins may read any."""
+    if claims.get("role") == "admin":
+        return
+    login, domain = _split_mailbox(email)
+    mailbox = f"{login}@{domain}"
+    owner = _temp_mailbox_owners.get(mailbox)
+    if owner is None:
+        record = await db.temp_mailboxes.find_one({"_id": mailbox}, {"user_id": 1})
+        if record is not None:
+            owner = record["user_id"]
+            _remember_mailbox_owner(mailbox, owner)
+    if owner != claims["sub"]:
+        raise HTTPException(status_code=404, detail="Mailbox not found")
+
+async def get_temp_email_inbox(email: str) -> list:
+    login, domain = _split_mailbox(email)
+    mailbox = f"{login}@{domain}"
+    cached = _temp_email_inboxes.get(mailbox)
+    if cached and time.monotonic() - cached[0] < TEMP_EMAIL_INBOX_TTL_SECONDS:
+        return cached[1]
+    try:
+        response = await _temp_email_client().get(
+            TEMP_EMAIL_API, params={"action": "getMessages", "login": login, "domain": domain}
+        )
+        messages = response.json() if response.status_code == 200 else []
+    except Exception:
+        messages = []
+    _temp_email_inboxes[mailbox] = (time.monotonic(), messages)
+    _temp_email_inboxes.move_to_end(mailbox)
+    if len(_temp_email_inboxes) > TEMP_EMAIL_INBOX_CACHE_SIZE:
+        _temp_email_inboxes.popitem(last=False)
+    return messages
+
+async def read_temp_email_message(email: str, message_id: int) -> dict:
+    login, domain = _split_mailbox(email)
+    key = (f"{login}@{domain}", message_id)
+    message = _temp_email_messages.get(key)
+    if message is not None:
+        return message
+    try:
+        response = await _temp_email_client().get(
+            TEMP_EMAIL_API, params={"action": "readMessage", "login": login, "domain": domain, "id": message_id}
+        )
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=502, detail=f"Temp email service unavailable: {e}")
+    try:
+        message = response.json()
+    except ValueError:
+        # 1secmail answers unknown ids with a plain-text "Message not found"
+        raise HTTPException(status_code=404, detail="Message not found")
+    _temp_email_messages.put(key, message, len(response.content))
+    return message
+
+
+# ============== IMAGE PROXY ==============
+# Channel logos and video thumbnails are served through /api/images/proxy:
+# the source is fetched once, downscaled to one of IMAGE_PROXY_WIDTHS and
+# re-encoded to WebP in a process pool (image_worker.py), and the result is
+# kept on disk under the source's content hash, so the same picture behind
+# different URLs is stored once. Files are evicted least recently used first
+# once IMAGE_CACHE_MAX_BYTES is exceeded. URLs are HMAC-signed instead of
+# authenticated, since <img> tags cannot send the bearer header.
+
+IMAGE_PROXY_PATH = "/api/images/proxy"
+IMAGE_PROXY_WIDTHS = (64, 128, 256, 480, 960)
+IMAGE_PROXY_QUALITY = int(os.environ.get('IMAGE_PROXY_QUALITY', 80))
+IMAGE_PROXY_WORKERS = int(os.environ.get('IMAGE_PROXY_WORKERS', 2))
+IMAGE_PROXY_MAX_SOURCE_BYTES = int(os.environ.get('IMAGE_PROXY_MAX_SOURCE_BYTES', 10 * 1024 * 1024))
+IMAGE_CACHE_DIR = Path(os.environ.get('IMAGE_CACHE_DIR', str(ROOT_DIR / 'image_cache')))
+IMAGE_CACHE_MAX_BYTES = int(os.environ.get('IMAGE_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+
+IMAGE_CACHE_HITS = Counter("image_proxy.cache_hits")
+IMAGE_CACHE_MISSES = Counter("image_proxy.cache_misses")
+IMAGE_CACHE_EVICTIONS = Counter("image_proxy.evictions")
+IMAGE_RENDER_LATENCY = LatencyHistogram("image_proxy.render_latency")
+
+_image_pool = None
+_image_http: Optional["httpx.AsyncClient"] = None
+_image_inflight: dict = {}  # (url, width) -> shared render task
+_image_cache_bytes: Optional[int] = None
+
+def _image_sign(url: str) -> str:
+    digest = hmac.new(JWT_SECRET.encode(), f"image|{url}".encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest[:18]).decode()
+
+def image_proxy_url(url: Optional[str], width: int) -> Optional[str]:
+    if not url:
+        return None
+    encoded = base64.urlsafe_b64encode(url.encode()).decode().rstrip("=")
+    return f"{IMAGE_PROXY_PATH}?u={encoded}&w={width}&s={_image_sign(url)}"
+
+def _image_executor():
+    global _image_pool
+    if _image_pool is None:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        # spawn, so pool processes start clean instead of inheriting the event loop and Mongo threads
+        _image_pool = ProcessPoolExecutor(IMAGE_PROXY_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _image_pool
+
+def _image_paths(url: str, width: int) -> tuple:
+    """(file holding the source's content hash, rendered file for a given content hash)"""
+    url_key = hashlib.sha256(url.encode()).hexdigest()
+    return IMAGE_CACHE_DIR / "urls" / url_key, lambda content_hash: IMAGE_CACHE_DIR / "webp" / f"{content_hash}_{width}.webp"
+
+def _cached_image(url: str, width: int) -> Optional[Path]:
+    index_file, rendered = _image_paths(url, width)
+    try:
+        path = rendered(index_file.read_text().strip())
+        os.utime(path)  # mtime is the LRU clock
+        return path
+    except OSError:
+        return None
+
+def _store_image(url: str, width: int, content_hash: str, data: Optional[bytes]) -> Path:
+    """Point url at the render of content_hash, writing the render first unless data is None."""
+    global _image_cache_bytes
+    index_file, rendered = _image_paths(url, width)
+    path = rendered(content_hash)
+    for directory in (index_file.parent, path.parent):
+        directory.mkdir(parents=True, exist_ok=True)
+    if data is not None:
+        temp = path.with_suffix(f".{secrets.token_hex(4)}.tmp")
+        temp.write_bytes(data)
+        temp.replace(path)
+    index_file.write_text(content_hash)
+    if data is None:
+        os.utime(path)
+        return path
+    if _image_cache_bytes is None:
+        _image_cache_bytes = sum(f.stat().st_size for f in path.parent.glob("*.webp"))
+    else:
+        _image_cache_bytes += len(data)
+    if _image_cache_bytes > IMAGE_CACHE_MAX_BYTES:
+        _evict_images()
+    return path
+
+def _evict_images():
+    """Delete least recently used renders until the cache is back under 90% of its budget."""
+    global _image_cache_bytes
+    files = []
+    for f in (IMAGE_CACHE_DIR / "webp").glob("*.webp"):
+        with contextlib.suppress(OSError):
+            stat = f.stat()
+            files.append((stat.st_mtime, stat.st_size, f))
+    files.sort()
+    total = sum(size for _, size, _ in files)
+    for _, size, f in files:
+        if total <= IMAGE_CACHE_MAX_BYTES * 0.9:
+            break
+        with contextlib.suppress(OSError):
+            f.unlink()
+            total -= size
+            IMAGE_CACHE_EVICTIONS.increment()
+    # Stale url index entries are harmless: a lookup that finds no render refetches
+    _image_cache_bytes = total
+
+async def _fetch_image_source(url: str) -> bytes:
+    global _image_http
+    if _image_http is None:
+        _image_http = upstream_client(timeout=15.0, follow_redirects=True)
+    try:
+        async with _image_http.stream("GET", url) as response:
+            if response.status_code >= 400:
+                raise HTTPException(status_code=502, detail=f"Image source returned status {response.status_code}")
+            chunks, size = [], 0
+            async for chunk in response.aiter_bytes():
+                size += len(chunk)
+                if size > IMAGE_PROXY_MAX_SOURCE_BYTES:
+                    raise HTTPException(status_code=413, detail="Source image too large")
+                chunks.append(chunk)
+            return b"".join(chunks)
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=502, detail=f"Image source unavailable: {e}")
+
+async def _render_image(url: str, width: int) -> Path:
+    source = await _fetch_image_source(url)
+    content_hash = hashlib.sha256(source).hexdigest()
+    _, rendered = _image_paths(url, width)
+    existing = rendered(content_hash)
+    if existing.exists():
+        # Same picture already rendered for another URL
+        return await asyncio.to_thread(_store_image, url, width, content_hash, None)
+    started = time.perf_counter()
+    from image_worker import render_webp
+    try:
+        data = await asyncio.get_running_loop().run_in_executor(
+            _image_executor(), render_webp, source, width, IMAGE_PROXY_QUALITY
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=415, detail=f"Unsupported image: {e}")
+    IMAGE_RENDER_LATENCY.observe((time.perf_counter() - started) * 1000)
+    return await asyncio.to_thread(_store_image, url, width, content_hash, data)
+
+@api_router.get("/images/proxy")
+async def image_proxy(u: str = Query(...), s: str = Query(...), w: int = Query(128)):
+    """Resized WebP rendition of a signed image URL"""
+    try:
+        url = base64.urlsafe_b64decode(u + "=" * (-len(u) % 4)).decode()
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid image URL")
+    if not hmac.compare_digest(s, _image_sign(url)):
+        raise HTTPException(status_code=403, detail="Invalid image URL signature")
+    # Snap to a fixed set of widths so each source has a bounded number of renditions
+    width = next((size for size in IMAGE_PROXY_WIDTHS if size >= w), IMAGE_PROXY_WIDTHS[-1])
+    path = await asyncio.to_thread(_cached_image, url, width)
+    if path is not None:
+        IMAGE_CACHE_HITS.increment()
+    else:
+        IMAGE_CACHE_MISSES.increment()
+        key = (url, width)
+        task = _image_inflight.get(key)
+        if task is None:
+            task = _image_inflight[key] = asyncio.ensure_future(_render_image(url, width))
+            task.add_done_callback(lambda _: _image_inflight.pop(key, None))
+        path = await asyncio.shield(task)
+    return FileResponse(
+        path,
+        media_type="image/webp",
+        headers={"Cache-Control": "public, max-age=31536000, immutable", "ETag": f'"{path.stem}"'}
+    )
+
+# ============== TOOL REGISTRY ==============
+# Every paid tool is declared once as a ToolSpec: cost, charging mode,
+# upstream, timeout budget, retry policy, concurrency limit, result cache and
+# metric name. Handlers parse the request and shape the response; run_tool
+# does everything between the two the same way for every tool:
+#
+#   charge    "hold" reserves the cost up front and refunds it if the call
+#             fails (upstream lookups); "on_success" checks the balance and
+#             deducts after the call succeeds
+#   cache     successful results are reused for cache_ttl seconds per key
+#   limit     at most `concurrency` calls run at once; callers wait up to
+#             queue_timeout seconds for a slot, then get 503
+#   budget    all attempts share one `timeout` deadline; transport errors and
+#             retryable ToolErrors are retried up to `retries` times with
+#             jittered exponential backoff while budget remains
+#
+# Policies can be overridden per tool without a deploy through TOOL_POLICIES,
+# a JSON object such as {"eyecon_lookup": {"timeout": 10, "retries": 0}}.
+
+TOOL_POLICIES = os.environ.get('TOOL_POLICIES', '')
+
+class ToolError(Exception):
+    """A tool call that produced no billable result. The attempt is logged with `status` and not charged."""
+
+    def __init__(self, status: str, message: str, retryable: bool = False, response: Optional[dict] = None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.retryable = retryable
+        self.response = response  # handler-specific body to return instead of an error
+
+class ToolSpec:
+    POLICY_FIELDS = ("cost", "timeout", "retries", "retry_backoff", "concurrency", "queue_timeout", "cache_ttl", "cache_bytes")
+    # field -> (type, minimum) that policy overrides are coerced to and checked against
+    POLICY_TYPES = {
+        "cost": (int, 0), "timeout": (float, 0.001), "retries": (int, 0), "retry_backoff": (float, 0),
+        "concurrency": (int, 1), "queue_timeout": (float, 0), "cache_ttl": (float, 0), "cache_bytes": (int, 0)
+    }
+
+    @classmethod
+    def coerce_policy(cls, field: str, value):
+        """A policy override as its field's type, or ValueError if it is not a number in range."""
+        kind, minimum = cls.POLICY_TYPES[field]
+        if isinstance(value, bool):
+            raise ValueError(f"{field} must be a number, not {value!r}")
+        try:
+            number = float(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"{field} must be a number, not {value!r}") from None
+        if kind is int and not number.is_integer():
+            raise ValueError(f"{field} must be a whole number, not {value!r}")
+        if not math.isfinite(number) or number < minimum:
+            raise ValueError(f"{field} must be at least {minimum}, not {value!r}")
+        return kind(number)
+
+    def __init__(self, name: str, cost: int, charge: str = "on_success", upstream: Optional[str] = None,
+                 timeout: float = 30.0, retries: int = 0, retry_backoff: float = 0.2, concurrency: int = 50,
+                 queue_timeout: float = 5.0, cache_ttl: float = 0, cache_bytes: int = 4 * 1024 * 1024,
+                 metric: Optional[str] = None):
+        self.name = name
+        self.cost = cost
+        self.charge = charge
+        self.upstream = upstream
+        self.timeout = timeout
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.concurrency = concurrency
+        self.queue_timeout = queue_timeout
+        self.cache_ttl = cache_ttl
+        self.cache_bytes = cache_bytes
+        self.metric = metric or name
+
+    def start(self):
+        """Build the limiter, cache, client factory and metrics once policies are final."""
+        self.slots = asyncio.Semaphore(self.concurrency)
+        self.cache = ByteBoundedLRU(f"tools.{self.metric}.cache", self.cache_bytes) if self.cache_ttl > 0 else None
+        self.http: Optional["httpx.AsyncClient"] = None
+        self.latency = LatencyHistogram(f"tools.{self.metric}.latency")
+        self.upstream_latency = LatencyHistogram(f"tools.{self.metric}.upstream_latency")
+        self.calls = self.failures = self.retried = self.shed = self.cache_hits = self.in_flight = 0
+        self.execute = traced(f"tool.{self.metric}")(self._execute)
+        CREDIT_COSTS[self.name] = self.cost
+        METRICS[f"tools.{self.metric}"] = self
+
+    def client(self) -> Optional["httpx.AsyncClient"]:
+        if self.upstream is None:
+            return None
+        if self.http is None:
+            # One pooled client per tool, sized to its concurrency limit, so connections are reused
+            self.http = upstream_client(
+                limits=httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency),
+                timeout=self.timeout
+            )
+        return self.http
+
+    async def _execute(self, call: Callable):
+        try:
+            await asyncio.wait_for(self.slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.shed += 1
+            raise HTTPException(status_code=503, detail=f"{self.name} is busy, try again shortly", headers={"Retry-After": "2"})
+        self.in_flight += 1
+        deadline = time.monotonic() + self.timeout
+        try:
+            for attempt in range(self.retries + 1):
+                remaining = deadline - time.monotonic()
+                started = time.perf_counter()
+                try:
+                    return await asyncio.wait_for(call(self.client(), remaining), remaining)
+                except asyncio.TimeoutError:
+                    raise ToolError("timeout", f"{self.name} timed out after {self.timeout:g}s")
+                except (httpx.TransportError, ToolError) as e:
+                    retryable = isinstance(e, httpx.TransportError) or e.retryable
+                    backoff = self.retry_backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+                    if not retryable or attempt == self.retries or time.monotonic() + backoff >= deadline:
+                        raise
+                    self.retried += 1
+                    await asyncio.sleep(backoff)
+                finally:
+                    if self.upstream is not None:
+                        self.upstream_latency.observe((time.perf_counter() - started) * 1000)
+        finally:
+            self.in_flight -= 1
+            self.slots.release()
+
+    def policy(self) -> dict:
+        return {"charge": self.charge, "upstream": self.upstream, **{f: getattr(self, f) for f in self.POLICY_FIELDS}}
+
+    def snapshot(self) -> dict:
+        return {
+            "calls": self.calls, "failures": self.failures, "retries": self.retried, "shed": self.shed,
+            "cache_hits": self.cache_hits, "in_flight": self.in_flight
+        }
+
+TOOL_REGISTRY = {spec.name: spec for spec in (
+    ToolSpec("phone_lookup", cost=1, charge="hold", upstream="https://sychosimdatabase.vercel.app/api/lookup",
+             timeout=30.0, retries=1, concurrency=20, cache_ttl=3600),
+    ToolSpec("eyecon_lookup", cost=1, charge="hold", upstream="https://api.eyecon-app.com/app/getnames.jsp",
+             timeout=30.0, retries=1, concurrency=10, cache_ttl=3600),
+    ToolSpec("temp_email", cost=1, upstream=TEMP_EMAIL_API, timeout=10.0, concurrency=20),
+    ToolSpec("youtube_download", cost=3, upstream="https://noembed.com/embed",
+             timeout=30.0, retries=1, concurrency=20, cache_ttl=86400),
+    ToolSpec("image_enhance", cost=2),
+    ToolSpec("tamasha_otp", cost=2),
+    ToolSpec("live_tv", cost=1, timeout=5.0),
+)}
+
+def _apply_tool_policies(spec: str):
+    overrides = json.loads(spec) if spec.strip() else {}
+    for name, policy in overrides.items():
+        if name not in TOOL_REGISTRY:
+            raise ValueError(f"TOOL_POLICIES names unknown tool {name!r}")
+        unknown = set(policy) - set(ToolSpec.POLICY_FIELDS)
+        if unknown:
+            raise ValueError(f"TOOL_POLICIES[{name!r}] has unknown fields {sorted(unknown)}")
+        for field, value in policy.items():
+            try:
+                setattr(TOOL_REGISTRY[name], field, ToolSpec.coerce_policy(field, value))
+            except ValueError as e:
+                raise ValueError(f"TOOL_POLICIES[{name!r}]: {e}") from None
+
+_apply_tool_policies(TOOL_POLICIES)
+for _spec in TOOL_REGISTRY.values():
+    _spec.start()
+
+async def run_tool(name: str, user: dict, call: Callable, details: Optional[str] = None, cache_key=None) -> tuple:
+    """
+    Run a registered tool's call under its policies and charge for it.
+
+    call(http, remaining_seconds) returns the result, or raises ToolError for
+    an outcome that should not be charged. Returns (result, credits charged).
+    A ToolError is re-raised after any hold is refunded and the attempt logged.
+    """
+    spec = TOOL_REGISTRY[name]
+    spec.calls += 1
+    started = time.perf_counter()
+    if spec.charge == "hold":
+        hold = await hold_credits(user, name)
+    else:
+        hold, cost = None, await check_credits(user, name)
+    
+    try:
+        cached = spec.cache.get(cache_key) if spec.cache is not None and cache_key is not None else None
+        if cached is not None and cached[0] > time.monotonic():
+            spec.cache_hits += 1
+            result = cached[1]
+        else:
+            result = await spec.execute(call)
+            if spec.cache is not None and cache_key is not None:
+                spec.cache.put(cache_key, (time.monotonic() + spec.cache_ttl, result), len(json.dumps(result, default=str)))
+    except HTTPException:
+        if hold:
+            await release_hold(hold, "rejected", details)
+        raise
+    except ToolError as e:
+        spec.failures += 1
+        if hold:
+            await release_hold(hold, e.status, details or e.message)
+        raise
+    except Exception as e:
+        spec.failures += 1
+        error = ToolError("timeout" if isinstance(e, httpx.TimeoutException) else "failed", str(e) or type(e).__name__)
+        if hold:
+            await release_hold(hold, error.status, details or error.message)
+        raise error from e
+    finally:
+        spec.latency.observe((time.perf_counter() - started) * 1000)
+    
+    if hold:
+        cost = await commit_hold(hold, "success", details)
+    else:
+        await deduct_credits(user["id"], name, cost, "success", details)
+    return result, cost
+
+@api_router.get("/admin/tools")
+async def get_tools(admin: dict = Depends(require_admin)):
+    """Effective policy, counters and latency of every registered tool"""
+    return {
+        name: {
+            "policy": spec.policy(),
+            **spec.snapshot(),
+            "latency": spec.latency.snapshot(),
+            "upstream_latency": spec.upstream_latency.snapshot(),
+            "cache": spec.cache.snapshot() if spec.cache is not None else None
+        }
+        for name, spec in TOOL_REGISTRY.items()
+    }
+
+async def close_tool_clients():
+    for spec in TOOL_REGISTRY.values():
+        if spec.http is not None:
+            await spec.http.aclose()
+            spec.http = None
+
 # ============== TOOL ROUTES ==============
 
+def _sanitize_phone(phone: str) -> str:
+    """Digits only, with a leading 0 replaced by the 92 country code"""
+    sanitized_phone = re.sub(r'\D', '', phone)
+    if sanitized_phone.startswith('0'):
+        sanitized_phone = '92' + sanitized_phone[1:]
+    return sanitized_phone
+
 @api_router.post("/tools/phone-lookup")
 async def phone_lookup(data: PhoneLookupRequest, user: dict = Depends(get_current_user)):
-    cost = await check_credits(user, "phone_lookup")
+    sanitized_phone = _sanitize_phone(data.phone)
     
-    # Sanitize phone number - remove all non-numeric characters
-    import re
-    sanitized_phone = re.sub(r'\D', '', data.phone)
-    
-    # Ensure proper format (add 92 prefix if starts with 0)
-    if sanitized_phone.startswith('0'):
-        sanitized_phone = '92' + sanitized_phone[1:]
+    async def lookup(http, remaining: float):
+        response = await http.get(TOOL_REGISTRY["phone_lookup"].upstream, params={"query": sanitized_phone}, timeout=remaining)
+        if response.status_code >= 500:
+            raise ToolError("failed", f"Lookup service returned status {response.status_code}", retryable=True)
+        return response.json()
     
     try:
-        async with httpx.AsyncClient() as client_http:
-            response = await client_http.get(
-                f"https://sychosimdatabase.vercel.app/api/lookup?query={sanitized_phone}",
-                timeout=30.0
-            )
-            api_response = response.json()
-        
-        await deduct_credits(user["id"], "phone_lookup", cost, "success", sanitized_phone)
-        
-        # Return the exact API response structure
-        return {
-            "success": api_response.get("success", False),
-            "results_count": api_response.get("results_count", 0),
-            "results": api_response.get("results", []),
-            "query": sanitized_phone,
-            "credits_used": cost
-        }
-    except Exception as e:
-        await deduct_credits(user["id"], "phone_lookup", cost, "failed", str(e))
+        api_response, cost = await run_tool("phone_lookup", user, lookup, details=sanitized_phone, cache_key=sanitized_phone)
+    except ToolError as e:
         return {
             "success": False,
             "results_count": 0,
             "results": [],
             "query": sanitized_phone,
-            "error": str(e),
-            "credits_used": cost
+            "error": e.message,
+            "credits_used": 0
         }
+    
+    # Return the exact API response structure
+    return {
+        "success": api_response.get("success", False),
+        "results_count": api_response.get("results_count", 0),
+        "results": api_response.get("results", []),
+        "query": sanitized_phone,
+        "credits_used": cost
+    }
 
 @api_router.post("/tools/eyecon-lookup")
 async def eyecon_lookup(data: EyeconLookupRequest, user: dict = Depends(get_current_user)):
-    cost = await check_credits(user, "eyecon_lookup")
-    
-    # Sanitize phone number - remove all non-numeric characters
-    import re
-    sanitized_phone = re.sub(r'\D', '', data.phone)
-    
-    # Ensure proper format (add 92 prefix if starts with 0)
-    if sanitized_phone.startswith('0'):
-        sanitized_phone = '92' + sanitized_phone[1:]
+    sanitized_phone = _sanitize_phone(data.phone)
     
-    logger.info(f"Eyecon lookup initiated for: {sanitized_phone}")
+    logger.info("Eyecon lookup initiated for: %s", sanitized_phone)
     
     # Get Eyecon credentials from env
     e_auth_v = os.environ.get("EYECON_E_AUTH_V", "")
@@ -380,7 +3490,7 @@ async def eyecon_lookup(data: EyeconLookupRequest, user: dict = Depends(get_curr
         e_auth_k and e_auth_k != "REPLACE_ME"
     ])
     
-    logger.info(f"Eyecon headers configured: {headers_configured}")
+    logger.debug("Eyecon headers configured: %s", headers_configured)
     
     # Build headers
     headers = {
@@ -410,228 +3520,226 @@ async def eyecon_lookup(data: EyeconLookupRequest, user: dict = Depends(get_curr
         "source": "MenifaFragment"
     }
     
-    try:
-        async with httpx.AsyncClient() as client_http:
-            logger.info(f"Eyecon request sending to API...")
-            response = await client_http.get(
-                "https://api.eyecon-app.com/app/getnames.jsp",
-                headers=headers,
-                params=params,
-                timeout=30.0
+    async def lookup(http, remaining: float):
+        logger.debug("Eyecon request sending to API...")
+        response = await http.get(TOOL_REGISTRY["eyecon_lookup"].upstream, headers=headers, params=params, timeout=remaining)
+        status_code = response.status_code
+        
+        # Parse response
+        response_text = response.text
+        logger.info("Eyecon response received → status %s, %d chars", status_code, len(response_text))
+        
+        # Try to parse as JSON
+        try:
+            result_data = response.json()
+            logger.debug("Eyecon response parsed as JSON successfully")
+        except Exception as json_err:
+            logger.warning("Eyecon response not JSON: %s", json_err)
+            result_data = None
+        
+        # Handle different status codes
+        if status_code == 200 and result_data:
+            # Success - extract names
+            names = []
+            if isinstance(result_data, list):
+                names = result_data
+            elif isinstance(result_data, dict):
+                names = result_data.get("names", result_data.get("results", []))
+                if not names and "name" in result_data:
+                    names = [{"name": result_data["name"]}]
+            return {
+                "status_code": status_code,
+                "names": names if isinstance(names, list) else [names],
+                "raw_data": result_data
+            }
+        
+        if status_code in [401, 403]:
+            # Auth failed - return safe mode
+            logger.warning("Eyecon auth failed with status %s", status_code)
+            raise ToolError(
+                "auth_failed", "Eyecon authentication failed - headers may be invalid or expired",
+                response={"status_code": status_code}
             )
-            
-            status_code = response.status_code
-            logger.info(f"Eyecon response received → status {status_code}")
-            
-            # Parse response
-            response_text = response.text
-            logger.info(f"Eyecon response body length: {len(response_text)} chars")
-            
-            # Try to parse as JSON
-            try:
-                result_data = response.json()
-                logger.info(f"Eyecon response parsed as JSON successfully")
-            except Exception as json_err:
-                logger.warning(f"Eyecon response not JSON: {str(json_err)}")
-                result_data = None
-            
-            # Handle different status codes
-            if status_code == 200 and result_data:
-                # Success - extract names
-                names = []
-                if isinstance(result_data, list):
-                    names = result_data
-                elif isinstance(result_data, dict):
-                    names = result_data.get("names", result_data.get("results", []))
-                    if not names and "name" in result_data:
-                        names = [{"name": result_data["name"]}]
-                
-                await deduct_credits(user["id"], "eyecon_lookup", cost, "success", sanitized_phone)
-                return {
-                    "success": True,
-                    "mode": "live",
-                    "query": sanitized_phone,
-                    "status_code": status_code,
-                    "names": names if isinstance(names, list) else [names],
-                    "raw_data": result_data,
-                    "credits_used": cost,
-                    "headers_configured": headers_configured
-                }
-            
-            elif status_code in [401, 403]:
-                # Auth failed - return safe mode
-                logger.warning(f"Eyecon auth failed with status {status_code}")
-                await deduct_credits(user["id"], "eyecon_lookup", cost, "auth_failed", sanitized_phone)
-                return {
-                    "success": True,
-                    "mode": "safe",
-                    "query": sanitized_phone,
-                    "status_code": status_code,
-                    "names": [],
-                    "message": "Eyecon authentication failed - headers may be invalid or expired",
-                    "credits_used": cost,
-                    "headers_configured": headers_configured
-                }
-            
-            else:
-                # Other status - return what we got
-                logger.warning(f"Eyecon returned status {status_code}")
-                await deduct_credits(user["id"], "eyecon_lookup", cost, f"status_{status_code}", sanitized_phone)
-                return {
-                    "success": True,
-                    "mode": "safe",
-                    "query": sanitized_phone,
-                    "status_code": status_code,
-                    "names": [],
-                    "raw_response": response_text[:500] if response_text else "",
-                    "message": f"Eyecon returned status {status_code}",
-                    "credits_used": cost,
-                    "headers_configured": headers_configured
-                }
-                
-    except httpx.TimeoutException:
-        logger.error(f"Eyecon request timed out for {sanitized_phone}")
-        await deduct_credits(user["id"], "eyecon_lookup", cost, "timeout", sanitized_phone)
-        return {
-            "success": True,
-            "mode": "safe",
-            "query": sanitized_phone,
-            "names": [],
-            "message": "Eyecon request timed out",
-            "credits_used": cost,
-            "headers_configured": headers_configured
-        }
         
-    except Exception as e:
-        logger.error(f"Eyecon request failed: {str(e)}")
-        await deduct_credits(user["id"], "eyecon_lookup", cost, "error", str(e))
-        return {
+        # Other status - return what we got
+        logger.warning("Eyecon returned status %s", status_code)
+        raise ToolError(
+            f"status_{status_code}", f"Eyecon returned status {status_code}", retryable=status_code >= 500,
+            response={"status_code": status_code, "raw_response": response_text[:500] if response_text else ""}
+        )
+    
+    try:
+        result, cost = await run_tool("eyecon_lookup", user, lookup, details=sanitized_phone, cache_key=sanitized_phone)
+    except ToolError as e:
+        safe = {
             "success": True,
             "mode": "safe",
             "query": sanitized_phone,
             "names": [],
-            "message": f"Eyecon unavailable: {str(e)}",
-            "error": str(e),
-            "credits_used": cost,
+            "credits_used": 0,
             "headers_configured": headers_configured
         }
+        if e.response is not None:
+            return {**safe, **e.response, "message": e.message}
+        if e.status == "timeout":
+            logger.error("Eyecon request timed out for %s", sanitized_phone)
+            return {**safe, "message": "Eyecon request timed out"}
+        logger.error("Eyecon request failed: %s", e.message)
+        return {**safe, "message": f"Eyecon unavailable: {e.message}", "error": e.message}
+    
+    return {
+        "success": True,
+        "mode": "live",
+        "query": sanitized_phone,
+        **result,
+        "credits_used": cost,
+        "headers_configured": headers_configured
+    }
 
 @api_router.post("/tools/temp-email")
 async def temp_email(data: TempEmailRequest, user: dict = Depends(get_current_user)):
-    cost = await check_credits(user, "temp_email")
+    if data.action == "check" and data.email:
+        await require_temp_mailbox_owner(data.email, {"sub": user["id"], "role": user.get("role")})
+        messages = await get_temp_email_inbox(data.email)
+        return {"success": True, "messages": messages, "credits_used": 0}  # Checking is free
+    if data.action != "generate":
+        raise HTTPException(status_code=400, detail="Invalid action")
+    
+    async def generate(http, remaining: float):
+        email = _temp_email_pool.take()
+        if not email:
+            # Pool empty - generate one on demand
+            try:
+                response = await http.get(TEMP_EMAIL_API, params={"action": "genRandomMailbox", "count": 1}, timeout=remaining)
+                emails = response.json() if response.status_code == 200 else None
+                email = emails[0] if emails else None
+            except (httpx.HTTPError, ValueError):
+                email = None
+        
+        # Fallback to generating local temp email
+        if not email:
+            import string
+            random_str = ''.join(random.choices(string.ascii_lowercase + string.digits, k=10))
+            email = f"{random_str}@1secmail.com"
+        return email
     
     try:
-        async with httpx.AsyncClient() as client_http:
-            if data.action == "generate":
-                # Generate new temp email using guerrillamail API as fallback
-                try:
-                    response = await client_http.get(
-                        "https://www.1secmail.com/api/v1/?action=genRandomMailbox&count=1",
-                        timeout=10.0
-                    )
-                    if response.status_code == 200:
-                        try:
-                            emails = response.json()
-                            email = emails[0] if emails else None
-                        except:
-                            email = None
-                    else:
-                        email = None
-                except:
-                    email = None
-                
-                # Fallback to generating local temp email
-                if not email:
-                    import random
-                    import string
-                    random_str = ''.join(random.choices(string.ascii_lowercase + string.digits, k=10))
-                    email = f"{random_str}@1secmail.com"
-                
-                await deduct_credits(user["id"], "temp_email", cost, "success", "generated")
-                return {"success": True, "email": email, "credits_used": cost}
-            elif data.action == "check" and data.email:
-                # Check inbox
-                try:
-                    login, domain = data.email.split("@")
-                    response = await client_http.get(
-                        f"https://www.1secmail.com/api/v1/?action=getMessages&login={login}&domain={domain}",
-                        timeout=10.0
-                    )
-                    if response.status_code == 200:
-                        try:
-                            messages = response.json()
-                        except:
-                            messages = []
-                    else:
-                        messages = []
-                except:
-                    messages = []
-                return {"success": True, "messages": messages, "credits_used": 0}  # Checking is free
-            else:
-                raise HTTPException(status_code=400, detail="Invalid action")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Temp email error: {str(e)}")
+        email, cost = await run_tool("temp_email", user, generate, details="generated")
+    except ToolError as e:
+        raise HTTPException(status_code=500, detail=f"Temp email error: {e.message}")
+    await record_temp_mailbox(email, user["id"])
+    return {"success": True, "email": email, "credits_used": cost}
+
+@api_router.get("/tools/temp-email/{email}/messages/{message_id}")
+async def read_temp_email(email: str, message_id: int, claims: dict = Depends(get_current_claims)):
+    """Full message with body and attachment links; reading is free"""
+    await require_temp_mailbox_owner(email, claims)
+    message = await read_temp_email_message(email, message_id)
+    attachments = [
+        {**a, "url": f"/api/tools/temp-email/{email}/messages/{message_id}/attachments/{quote(a['filename'])}"}
+        for a in message.get("attachments", [])
+    ]
+    return JSONResponse(
+        {**message, "attachments": attachments},
+        headers={"Cache-Control": "private, max-age=86400, immutable"}
+    )
+
+@api_router.get("/tools/temp-email/{email}/messages/{message_id}/attachments/{filename}")
+async def download_temp_email_attachment(email: str, message_id: int, filename: str, claims: dict = Depends(get_current_claims)):
+    await require_temp_mailbox_owner(email, claims)
+    login, domain = _split_mailbox(email)
+    http = _temp_email_client()
+    request = http.build_request("GET", TEMP_EMAIL_API, params={
+        "action": "download", "login": login, "domain": domain, "id": message_id, "file": filename
+    })
+    try:
+        upstream = await http.send(request, stream=True)
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=502, detail=f"Temp email service unavailable: {e}")
+    if upstream.status_code >= 400:
+        await upstream.aclose()
+        raise HTTPException(status_code=404, detail="Attachment not found")
+    
+    headers = {
+        "Cache-Control": "private, max-age=86400, immutable",
+        "Content-Disposition": f"attachment; filename*=UTF-8''{quote(filename)}"
+    }
+    # Raw bytes are relayed as the origin encoded them, so its length must travel with its encoding
+    for name in ("content-length", "content-encoding"):
+        if name in upstream.headers:
+            headers[name.title()] = upstream.headers[name]
+    return StreamingResponse(
+        upstream.aiter_raw(),
+        media_type=upstream.headers.get("content-type", "application/octet-stream"),
+        headers=headers,
+        background=BackgroundTask(upstream.aclose)
+    )
 
 @api_router.post("/tools/youtube-download")
 async def youtube_download(data: YouTubeRequest, user: dict = Depends(get_current_user)):
-    cost = await check_credits(user, "youtube_download")
+    video_id = None
+    if "youtube.com" in data.url:
+        video_id = data.url.split("v=")[1].split("&")[0] if "v=" in data.url else None
+    elif "youtu.be" in data.url:
+        video_id = data.url.split("/")[-1].split("?")[0]
+    
+    if not video_id:
+        raise HTTPException(status_code=400, detail="Invalid YouTube URL")
+    
+    # Get video info using noembed
+    async def fetch_info(http, remaining: float):
+        response = await http.get(
+            TOOL_REGISTRY["youtube_download"].upstream,
+            params={"url": f"https://www.youtube.com/watch?v={video_id}"},
+            timeout=remaining
+        )
+        if response.status_code >= 500:
+            raise ToolError("failed", f"noembed returned status {response.status_code}", retryable=True)
+        return response.json()
     
     try:
-        # Using a free YouTube info API
-        video_id = None
-        if "youtube.com" in data.url:
-            video_id = data.url.split("v=")[1].split("&")[0] if "v=" in data.url else None
-        elif "youtu.be" in data.url:
-            video_id = data.url.split("/")[-1].split("?")[0]
-        
-        if not video_id:
-            raise HTTPException(status_code=400, detail="Invalid YouTube URL")
-        
-        # Get video info using noembed
-        async with httpx.AsyncClient() as client_http:
-            response = await client_http.get(
-                f"https://noembed.com/embed?url=https://www.youtube.com/watch?v={video_id}",
-                timeout=30.0
-            )
-            video_info = response.json()
-        
-        await deduct_credits(user["id"], "youtube_download", cost, "success", video_id)
-        
-        return {
-            "success": True,
-            "video_id": video_id,
-            "title": video_info.get("title", "Unknown"),
-            "author": video_info.get("author_name", "Unknown"),
-            "thumbnail": video_info.get("thumbnail_url", f"https://img.youtube.com/vi/{video_id}/maxresdefault.jpg"),
-            "download_links": [
-                {"quality": "720p", "url": f"https://ssyoutube.com/watch?v={video_id}"},
-                {"quality": "360p", "url": f"https://ssyoutube.com/watch?v={video_id}"}
-            ],
-            "credits_used": cost
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"YouTube download error: {str(e)}")
+        video_info, cost = await run_tool("youtube_download", user, fetch_info, details=video_id, cache_key=video_id)
+    except ToolError as e:
+        raise HTTPException(status_code=500, detail=f"YouTube download error: {e.message}")
+    
+    thumbnail = video_info.get("thumbnail_url", f"https://img.youtube.com/vi/{video_id}/maxresdefault.jpg")
+    return {
+        "success": True,
+        "video_id": video_id,
+        "title": video_info.get("title", "Unknown"),
+        "author": video_info.get("author_name", "Unknown"),
+        "thumbnail": thumbnail,
+        "thumbnail_proxy": image_proxy_url(thumbnail, 480),
+        "download_links": [
+            {"quality": "720p", "url": f"https://ssyoutube.com/watch?v={video_id}"},
+            {"quality": "360p", "url": f"https://ssyoutube.com/watch?v={video_id}"}
+        ],
+        "credits_used": cost
+    }
 
 @api_router.post("/tools/image-enhance")
 async def image_enhance(data: ImageEnhanceRequest, user: dict = Depends(get_current_user)):
-    cost = await check_credits(user, "image_enhance")
+    # Using free image upscaling API placeholder
+    # In production, integrate with real image enhancement service
+    async def enhance(http, remaining: float):
+        return data.image_url  # Placeholder - integrate real service
     
     try:
-        # Using free image upscaling API placeholder
-        # In production, integrate with real image enhancement service
-        await deduct_credits(user["id"], "image_enhance", cost, "success", data.image_url)
-        
-        return {
-            "success": True,
-            "original_url": data.image_url,
-            "enhanced_url": data.image_url,  # Placeholder - integrate real service
-            "message": "Image enhancement service ready. Configure external API for full functionality.",
-            "credits_used": cost
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Image enhance error: {str(e)}")
+        enhanced_url, cost = await run_tool("image_enhance", user, enhance, details=data.image_url)
+    except ToolError as e:
+        raise HTTPException(status_code=500, detail=f"Image enhance error: {e.message}")
+    
+    return {
+        "success": True,
+        "original_url": data.image_url,
+        "enhanced_url": enhanced_url,
+        "message": "Image enhancement service ready. Configure external API for full functionality.",
+        "credits_used": cost
+    }
 
 # Jazz TV / Tamasha Channel Data - Verified Working Streams (HTTPS with CORS)
+# Seeds the channels collection on first startup; the live catalog is edited
+# through the admin channel endpoints.
 JAZZTV_CHANNELS = [
     # Religious (HTTPS + CORS - Most Reliable)
     {
@@ -787,23 +3895,149 @@ JAZZTV_CHANNELS = [
     },
 ]
 
+# ============== CHANNEL CATALOG ==============
+# The catalog lives in the channels collection. Each worker serves it from an
+# immutable ChannelSnapshot - lookup indexes plus the list responses already
+# serialized - that is rebuilt off the request path and swapped in with a
+# single assignment, so readers never wait or lock. Workers reload on a change
+# stream event, or, on a standalone server where change streams are not
+# available, when the catalog version bumped by every admin write changes.
+
+CHANNEL_CATALOG_POLL_SECONDS = float(os.environ.get('CHANNEL_CATALOG_POLL_SECONDS', 5))
+CHANNEL_FIELDS = ("id", "name", "logo", "stream_url", "category", "provider", "active")
+
+class ChannelSnapshot:
+    __slots__ = ("version", "channels", "by_id", "etag", "all_json", "category_json")
+
+    def __init__(self, version: int, channels: list):
+        self.version = version
+        self.channels = tuple(
+            {**{k: ch.get(k) for k in CHANNEL_FIELDS}, "logo_proxy": image_proxy_url(ch.get("logo"), 128)}
+            for ch in channels
+        )
+        self.by_id = {ch["id"]: ch for ch in self.channels}
+        self.all_json = json.dumps({"channels": self.channels, "total": len(self.channels)}).encode()
+        # From the content, not the version: a reload can read the version before a write bumps it
+        self.etag = f'"channels-{hashlib.blake2b(self.all_json, digest_size=8).hexdigest()}"'
+        by_category = {}
+        for ch in self.channels:
+            by_category.setdefault(ch["category"].lower(), []).append(ch)
+        # category -> (serialized channel array, count); the requested category is echoed back as given
+        self.category_json = {category: (json.dumps(chs), len(chs)) for category, chs in by_category.items()}
+
+    def category_response(self, category: str) -> bytes:
+        channels, total = self.category_json.get(category.lower(), ("[]", 0))
+        return f'{{"channels": {channels}, "total": {total}, "category": {json.dumps(category)}}}'.encode()
+
+_channel_catalog = ChannelSnapshot(0, JAZZTV_CHANNELS)
+MemoryAccount("channels.catalog", 8 * 1024 * 1024, lambda: _deep_sizeof(_channel_catalog, depth=6))
+
+async def _catalog_version() -> int:
+    doc = await db.catalog_versions.find_one({"_id": "channels"})
+    return doc["version"] if doc else 0
+
+async def reload_channel_catalog() -> ChannelSnapshot:
+    global _channel_catalog
+    version = await _catalog_version()
+    channels = await db.channels.find({}, {"_id": 0}).sort([("position", 1), ("id", 1)]).to_list(None)
+    _channel_catalog = ChannelSnapshot(version, channels)
+    return _channel_catalog
+
+async def _bump_catalog_version():
+    await db.catalog_versions.update_one({"_id": "channels"}, {"$inc": {"version": 1}}, upsert=True)
+    await reload_channel_catalog()
+
+async def seed_channel_catalog():
+    await db.channels.create_index("id", unique=True)
+    if await db.channels.count_documents({}, limit=1) == 0:
+        try:
+            await db.channels.insert_many([{**ch, "position": i} for i, ch in enumerate(JAZZTV_CHANNELS)], ordered=False)
+            await db.catalog_versions.update_one({"_id": "channels"}, {"$inc": {"version": 1}}, upsert=True)
+        except BulkWriteError as e:
+            # Another worker booting at the same time seeded them first
+            if any(error["code"] != 11000 for error in e.details.get("writeErrors", [])):
+                raise
+    await reload_channel_catalog()
+
+async def _watch_channel_catalog():
+    try:
+        async with db.channels.watch() as stream:
+            logger.info("Channel catalog following the change stream")
+            async for _ in stream:
+                await reload_channel_catalog()
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.info("Channel catalog change stream unavailable (%s); polling the catalog version", e)
+    while True:
+        await asyncio.sleep(CHANNEL_CATALOG_POLL_SECONDS)
+        try:
+            if await _catalog_version() != _channel_catalog.version:
+                await reload_channel_catalog()
+        except Exception:
+            logger.exception("Channel catalog reload failed")
+
+def _channel_list_response(request: Request, body: bytes) -> Response:
+    catalog = _channel_catalog
+    if etag_matches(request, catalog.etag):
+        return not_modified(catalog.etag)
+    return Response(body, media_type="application/json", headers={"ETag": catalog.etag, "Cache-Control": "private, no-cache"})
+
 @api_router.get("/tools/live-tv/channels")
-async def get_tv_channels(user: dict = Depends(get_current_user)):
+async def get_tv_channels(request: Request, claims: dict = Depends(get_current_claims)):
     """Return all Jazz TV / Tamasha channels"""
-    return {"channels": JAZZTV_CHANNELS, "total": len(JAZZTV_CHANNELS)}
+    return _channel_list_response(request, _channel_catalog.all_json)
 
 @api_router.get("/tools/live-tv/channels/{category}")
-async def get_tv_channels_by_category(category: str, user: dict = Depends(get_current_user)):
+async def get_tv_channels_by_category(category: str, request: Request, claims: dict = Depends(get_current_claims)):
     """Return channels filtered by category"""
-    filtered = [ch for ch in JAZZTV_CHANNELS if ch["category"].lower() == category.lower()]
-    return {"channels": filtered, "total": len(filtered), "category": category}
+    return _channel_list_response(request, _channel_catalog.category_response(category))
+
+@api_router.get("/admin/channels")
+async def admin_list_channels(admin: dict = Depends(require_admin)):
+    """Full catalog as stored, with the version this worker is serving"""
+    channels = await db.channels.find({}, {"_id": 0}).sort([("position", 1), ("id", 1)]).to_list(None)
+    return {"channels": channels, "total": len(channels), "serving_version": _channel_catalog.version}
+
+@api_router.post("/admin/channels")
+async def admin_create_channel(data: ChannelCreate, admin: dict = Depends(require_admin)):
+    channel = data.model_dump()
+    if channel["position"] is None:
+        channel["position"] = await db.channels.count_documents({})
+    channel["updated_at"] = datetime.now(timezone.utc).isoformat()
+    try:
+        await db.channels.insert_one(channel)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Channel id already exists")
+    await _bump_catalog_version()
+    channel.pop("_id", None)
+    return channel
+
+@api_router.put("/admin/channels/{channel_id}")
+async def admin_update_channel(channel_id: str, data: ChannelUpdate, admin: dict = Depends(require_admin)):
+    changes = {k: v for k, v in data.model_dump().items() if v is not None}
+    if not changes:
+        raise HTTPException(status_code=400, detail="Nothing to update")
+    changes["updated_at"] = datetime.now(timezone.utc).isoformat()
+    channel = await db.channels.find_one_and_update(
+        {"id": channel_id}, {"$set": changes}, projection={"_id": 0}, return_document=ReturnDocument.AFTER
+    )
+    if not channel:
+        raise HTTPException(status_code=404, detail="Channel not found")
+    await _bump_catalog_version()
+    return channel
+
+@api_router.delete("/admin/channels/{channel_id}")
+async def admin_delete_channel(channel_id: str, admin: dict = Depends(require_admin)):
+    result = await db.channels.delete_one({"id": channel_id})
+    if result.deleted_count == 0:
+        raise HTTPException(status_code=404, detail="Channel not found")
+    await _bump_catalog_version()
+    return {"message": "Channel deleted", "id": channel_id}
 
 @api_router.get("/tools/live-tv/stream/{channel_id}")
 async def get_tv_stream(channel_id: str, user: dict = Depends(get_current_user)):
-    cost = await check_credits(user, "live_tv")
-    
-    # Find channel by ID
-    channel = next((ch for ch in JAZZTV_CHANNELS if ch["id"] == channel_id), None)
+    channel = _channel_catalog.by_id.get(channel_id)
     
     if not channel:
         raise HTTPException(status_code=404, detail="Channel not found")
@@ -811,52 +4045,687 @@ async def get_tv_stream(channel_id: str, user: dict = Depends(get_current_user))
     if not channel.get("active", True):
         raise HTTPException(status_code=503, detail="Channel temporarily unavailable")
     
-    await deduct_credits(user["id"], "live_tv", cost, "success", channel_id)
+    async def issue(http, remaining: float):
+        return f"{HLS_PROXY_PREFIX}/{channel_id}?t={_hls_issue_token(channel_id)}"
+    
+    proxy_url, cost = await run_tool("live_tv", user, issue, details=channel_id)
     
     return {
         "channel_id": channel_id,
         "channel_name": channel["name"],
         "stream_url": channel["stream_url"],
+        "proxy_url": proxy_url,
         "category": channel["category"],
         "credits_used": cost
     }
 
-@api_router.post("/tools/tamasha-otp")
-async def tamasha_otp(data: TamashaOTPRequest, user: dict = Depends(get_current_user)):
-    cost = await check_credits(user, "tamasha_otp")
-    
+# ============== LIVE TV HLS PROXY ==============
+# Playlists are fetched once per refresh interval and shared by every viewer of
+# a channel; segments are streamed through without buffering. Players cannot
+# send the bearer header, so access is granted by a signed, expiring view token
+# issued by get_tv_stream, and every rewritten upstream URI carries its own
+# signature so the proxy cannot be used to fetch arbitrary URLs.
+
+HLS_PROXY_PREFIX = "/api/tools/live-tv/proxy"
+HLS_TOKEN_TTL_SECONDS = int(os.environ.get('HLS_TOKEN_TTL_SECONDS', 4 * 3600))
+HLS_MASTER_TTL_SECONDS = float(os.environ.get('HLS_MASTER_TTL_SECONDS', 30))
+HLS_VOD_TTL_SECONDS = float(os.environ.get('HLS_VOD_TTL_SECONDS', 300))
+HLS_UPSTREAM_TIMEOUT = float(os.environ.get('HLS_UPSTREAM_TIMEOUT', 10))
+HLS_CACHE_MAX_ENTRIES = int(os.environ.get('HLS_CACHE_MAX_ENTRIES', 512))
+HLS_VIEWER_WINDOW_SECONDS = 30
+HLS_TOKEN_PLACEHOLDER = "__HLS_VIEW_TOKEN__"
+HLS_CONTENT_TYPE = "application/vnd.apple.mpegurl"
+
+_HLS_URI_ATTR = re.compile(r'URI="([^"]+)"')
+_HLS_TARGET_DURATION = re.compile(r'#EXT-X-TARGETDURATION:\s*(\d+(?:\.\d+)?)')
+
+_hls_http: Optional["httpx.AsyncClient"] = None
+_hls_cache: dict = {}     # upstream url -> cached playlist entry
+_hls_inflight: dict = {}  # upstream url -> shared fetch task
+_hls_stats: dict = {}     # channel id -> counters
+account_container("hls.playlists", 32 * 1024 * 1024, _hls_cache)
+
+def _hls_client() -> "httpx.AsyncClient":
+    global _hls_http
+    if _hls_http is None:
+        _hls_http = upstream_client(
+            timeout=HLS_UPSTREAM_TIMEOUT,
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=200, max_keepalive_connections=50)
+        )
+    return _hls_http
+
+def _hls_sign(*parts: str) -> str:
+    digest = hmac.new(JWT_SECRET.encode(), "|".join(parts).encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest[:18]).decode()
+
+def _hls_issue_token(channel_id: str) -> str:
+    expires = str(int(time.time()) + HLS_TOKEN_TTL_SECONDS)
+    return f"{expires}.{_hls_sign('view', channel_id, expires)}"
+
+def _hls_check_token(channel_id: str, token: str):
+    expires, _, signature = token.partition(".")
+    if not expires.isdigit() or not hmac.compare_digest(signature, _hls_sign('view', channel_id, expires)):
+        raise HTTPException(status_code=403, detail="Invalid stream token")
+    if int(expires) < time.time():
+        raise HTTPException(status_code=403, detail="Stream token expired")
+
+def _hls_encode_uri(url: str) -> str:
+    return base64.urlsafe_b64encode(url.encode()).decode().rstrip("=")
+
+def _hls_decode_uri(channel_id: str, encoded: str, signature: str) -> str:
     try:
-        if data.action == "send":
-            # Placeholder for Tamasha OTP send
-            await deduct_credits(user["id"], "tamasha_otp", cost, "success", f"send:{data.phone}")
-            return {
-                "success": True,
-                "message": "OTP sent successfully (simulated). Configure Tamasha API for full functionality.",
-                "credits_used": cost
-            }
-        elif data.action == "verify" and data.otp:
-            # Placeholder for OTP verification
-            return {
-                "success": True,
-                "message": "OTP verified (simulated). Configure Tamasha API for full functionality.",
-                "credits_used": 0  # Verification is free
-            }
+        url = base64.urlsafe_b64decode(encoded + "=" * (-len(encoded) % 4)).decode()
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid stream URI")
+    if not hmac.compare_digest(signature, _hls_sign('uri', channel_id, url)):
+        raise HTTPException(status_code=403, detail="Invalid stream URI signature")
+    return url
+
+def _hls_proxy_uri(channel_id: str, url: str, kind: str) -> str:
+    return (f"{HLS_PROXY_PREFIX}/{channel_id}/{kind}?t={HLS_TOKEN_PLACEHOLDER}"
+            f"&u={_hls_encode_uri(url)}&s={_hls_sign('uri', channel_id, url)}")
+
+def _hls_channel_stats(channel_id: str) -> dict:
+    stats = _hls_stats.get(channel_id)
+    if stats is None:
+        stats = _hls_stats[channel_id] = {
+            "playlist_requests": 0,
+            "cache_hits": 0,
+            "coalesced_waits": 0,
+            "origin_fetches": 0,
+            "origin_errors": 0,
+            "origin_fetch_ms_total": 0.0,
+            "playlist_bytes_last": 0,
+            "playlist_bytes_max": 0,
+            "segment_requests": 0,
+            "viewers": {}
+        }
+    return stats
+
+def _hls_playlist_ttl(body: str):
+    """Return (ttl_seconds, is_master) for a playlist body.
+
+    Media playlists are cached for half their target duration, which is the
+    reload interval players fall back to when a playlist has not changed."""
+    if "#EXT-X-STREAM-INF" in body:
+        return HLS_MASTER_TTL_SECONDS, True
+    if "#EXT-X-ENDLIST" in body:
+        return HLS_VOD_TTL_SECONDS, False
+    match = _HLS_TARGET_DURATION.search(body)
+    target = float(match.group(1)) if match else 6.0
+    return max(1.0, target / 2), False
+
+def _hls_rewrite(body: str, base_url: str, channel_id: str, is_master: bool) -> str:
+    """Rewrite every URI in a playlist to a signed proxy URI.
+
+    The view token is left as a placeholder so the rewritten template can be
+    shared between viewers and filled in per request."""
+    def attr_uri(kind):
+        return lambda m: f'URI="{_hls_proxy_uri(channel_id, urljoin(base_url, m.group(1)), kind)}"'
+
+    lines = []
+    for line in body.splitlines():
+        stripped = line.strip()
+        if not stripped:
+            lines.append(line)
+        elif stripped.startswith("#"):
+            # Alternate renditions and I-frame playlists are playlists; keys and init maps are binary
+            kind = "playlist.m3u8" if stripped.startswith(("#EXT-X-MEDIA:", "#EXT-X-I-FRAME-STREAM-INF")) else "segment"
+            lines.append(_HLS_URI_ATTR.sub(attr_uri(kind), line))
         else:
-            raise HTTPException(status_code=400, detail="Invalid action")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Tamasha OTP error: {str(e)}")
+            kind = "playlist.m3u8" if is_master else "segment"
+            lines.append(_hls_proxy_uri(channel_id, urljoin(base_url, stripped), kind))
+    return "\n".join(lines) + "\n"
+
+def _hls_evict():
+    now = time.monotonic()
+    for url in [u for u, e in _hls_cache.items() if e["expires_at"] <= now]:
+        del _hls_cache[url]
+    while len(_hls_cache) >= HLS_CACHE_MAX_ENTRIES:
+        del _hls_cache[next(iter(_hls_cache))]
+
+async def _hls_fetch_playlist(channel_id: str, url: str) -> dict:
+    stats = _hls_channel_stats(channel_id)
+    started = time.monotonic()
+    try:
+        response = await _hls_client().get(url)
+        response.raise_for_status()
+    except httpx.HTTPError as e:
+        stats["origin_errors"] += 1
+        logger.warning("HLS playlist fetch failed for %s: %s", channel_id, e)
+        raise HTTPException(status_code=502, detail="Upstream stream unavailable")
+    
+    body = response.text
+    ttl, is_master = _hls_playlist_ttl(body)
+    size = len(response.content)
+    stats["origin_fetches"] += 1
+    stats["origin_fetch_ms_total"] += (time.monotonic() - started) * 1000
+    stats["playlist_bytes_last"] = size
+    stats["playlist_bytes_max"] = max(stats["playlist_bytes_max"], size)
+    
+    entry = {
+        "template": _hls_rewrite(body, str(response.url), channel_id, is_master),
+        "is_master": is_master,
+        "ttl": ttl,
+        "size": size,
+        "expires_at": time.monotonic() + ttl
+    }
+    _hls_evict()
+    _hls_cache[url] = entry
+    return entry
+
+async def _hls_get_playlist(channel_id: str, url: str) -> dict:
+    """Serve a playlist from cache, joining an in-flight origin fetch if one exists."""
+    stats = _hls_channel_stats(channel_id)
+    stats["playlist_requests"] += 1
+    entry = _hls_cache.get(url)
+    if entry and entry["expires_at"] > time.monotonic():
+        stats["cache_hits"] += 1
+        return entry
+    
+    task = _hls_inflight.get(url)
+    if task is None:
+        task = asyncio.ensure_future(_hls_fetch_playlist(channel_id, url))
+        _hls_inflight[url] = task
+        task.add_done_callback(lambda _: _hls_inflight.pop(url, None))
+    else:
+        stats["coalesced_waits"] += 1
+    # Shield so one viewer disconnecting does not cancel the fetch the others wait on
+    return await asyncio.shield(task)
+
+def _hls_prune_viewers(viewers: dict):
+    now = time.monotonic()
+    for token in [k for k, seen in viewers.items() if now - seen > HLS_VIEWER_WINDOW_SECONDS]:
+        del viewers[token]
+
+def _hls_playlist_response(channel_id: str, token: str, entry: dict) -> Response:
+    viewers = _hls_channel_stats(channel_id)["viewers"]
+    viewers[token] = time.monotonic()
+    if len(viewers) > 1000:
+        _hls_prune_viewers(viewers)
+    remaining = max(0, int(entry["expires_at"] - time.monotonic()))
+    return Response(
+        content=entry["template"].replace(HLS_TOKEN_PLACEHOLDER, token),
+        media_type=HLS_CONTENT_TYPE,
+        headers={"Cache-Control": f"private, max-age={remaining}"}
+    )
+
+def _hls_channel_or_404(channel_id: str) -> dict:
+    channel = _channel_catalog.by_id.get(channel_id)
+    if not channel:
+        raise HTTPException(status_code=404, detail="Channel not found")
+    if not channel.get("active", True):
+        raise HTTPException(status_code=503, detail="Channel temporarily unavailable")
+    return channel
+
+@api_router.get("/tools/live-tv/proxy/{channel_id}")
+async def proxy_tv_master(channel_id: str, t: str = Query(...)):
+    _hls_check_token(channel_id, t)
+    channel = _hls_channel_or_404(channel_id)
+    entry = await _hls_get_playlist(channel_id, channel["stream_url"])
+    return _hls_playlist_response(channel_id, t, entry)
+
+@api_router.get("/tools/live-tv/proxy/{channel_id}/playlist.m3u8")
+async def proxy_tv_playlist(channel_id: str, t: str = Query(...), u: str = Query(...), s: str = Query(...)):
+    _hls_check_token(channel_id, t)
+    url = _hls_decode_uri(channel_id, u, s)
+    entry = await _hls_get_playlist(channel_id, url)
+    return _hls_playlist_response(channel_id, t, entry)
+
+@api_router.get("/tools/live-tv/proxy/{channel_id}/segment")
+async def proxy_tv_segment(channel_id: str, t: str = Query(...), u: str = Query(...), s: str = Query(...)):
+    _hls_check_token(channel_id, t)
+    url = _hls_decode_uri(channel_id, u, s)
+    _hls_channel_stats(channel_id)["segment_requests"] += 1
+    
+    http = _hls_client()
+    try:
+        upstream = await http.send(http.build_request("GET", url), stream=True)
+    except httpx.HTTPError as e:
+        logger.warning("HLS segment fetch failed for %s: %s", channel_id, e)
+        raise HTTPException(status_code=502, detail="Upstream stream unavailable")
+    if upstream.status_code >= 400:
+        await upstream.aclose()
+        raise HTTPException(status_code=502, detail=f"Upstream returned status {upstream.status_code}")
+    
+    headers = {"Cache-Control": "private, max-age=60"}
+    # Raw bytes are relayed as the origin encoded them, so its length must travel with its encoding
+    for name in ("content-length", "content-encoding"):
+        if name in upstream.headers:
+            headers[name.title()] = upstream.headers[name]
+    return StreamingResponse(
+        upstream.aiter_raw(),
+        media_type=upstream.headers.get("content-type", "video/mp2t"),
+        headers=headers,
+        background=BackgroundTask(upstream.aclose)
+    )
+
+@api_router.get("/admin/live-tv/proxy-stats")
+async def get_tv_proxy_stats(admin: dict = Depends(require_admin)):
+    """Per-channel playlist sizes, origin fetches and viewer fan-in"""
+    channels = []
+    for channel_id, stats in _hls_stats.items():
+        viewers = stats["viewers"]
+        _hls_prune_viewers(viewers)
+        fetches = stats["origin_fetches"]
+        channels.append({
+            "channel_id": channel_id,
+            **{k: v for k, v in stats.items() if k != "viewers"},
+            "active_viewers": len(viewers),
+            "fan_in": round(stats["playlist_requests"] / fetches, 2) if fetches else 0,
+            "avg_origin_fetch_ms": round(stats["origin_fetch_ms_total"] / fetches, 1) if fetches else 0
+        })
+    return {"channels": channels, "cached_playlists": len(_hls_cache), "inflight_fetches": len(_hls_inflight)}
+
+@api_router.post("/tools/tamasha-otp")
+async def tamasha_otp(data: TamashaOTPRequest, user: dict = Depends(get_current_user)):
+    if data.action == "send":
+        # Placeholder for Tamasha OTP send
+        async def send(http, remaining: float):
+            return None
+        
+        try:
+            _, cost = await run_tool("tamasha_otp", user, send, details=f"send:{data.phone}")
+        except ToolError as e:
+            raise HTTPException(status_code=500, detail=f"Tamasha OTP error: {e.message}")
+        return {
+            "success": True,
+            "message": "OTP sent successfully (simulated). Configure Tamasha API for full functionality.",
+            "credits_used": cost
+        }
+    elif data.action == "verify" and data.otp:
+        # Placeholder for OTP verification
+        return {
+            "success": True,
+            "message": "OTP verified (simulated). Configure Tamasha API for full functionality.",
+            "credits_used": 0  # Verification is free
+        }
+    else:
+        raise HTTPException(status_code=400, detail="Invalid action")
 
 @api_router.get("/user/usage-history", response_model=List[UsageLogResponse])
-async def get_user_usage_history(user: dict = Depends(get_current_user), limit: int = Query(50, le=200)):
-    logs = await db.usage_logs.find({"user_id": user["id"]}, {"_id": 0}).sort("created_at", -1).to_list(limit)
+async def get_user_usage_history(
+    request: Request,
+    claims: dict = Depends(get_current_claims),
+    limit: int = Query(50, le=200),
+    before: Optional[str] = Query(None, description="created_at of the last entry already shown, for older pages")
+):
+    """Recent usage from the user's embedded buffer; older pages come from usage_logs"""
+    user = _batch_user(request) or await _load_active_user(
+        claims["sub"], {"_id": 0, "id": 1, "email": 1, "is_active": 1, "version": 1, "recent_activity": 1, "recent_activity_seeded": 1}
+    )
+    if before is None and limit <= RECENT_ACTIVITY_SIZE:
+        etag = user_etag(user, f"history-{limit}")
+        if etag_matches(request, etag):
+            return not_modified(etag)
+        recent = user.get("recent_activity") or []
+        if not user.get("recent_activity_seeded"):
+            # The buffer only holds charges made since it was introduced: fill it once from usage_logs,
+            # keeping entries pushed but not yet logged
+            logs = await db.usage_logs.find({"user_id": user["id"]}, {"_id": 0, "user_id": 0, "user_email": 0}) \
+                .sort("created_at", -1).to_list(RECENT_ACTIVITY_SIZE)
+            merged = {entry["id"]: entry for entry in [*logs, *recent]}
+            recent = sorted(merged.values(), key=lambda entry: parse_timestamp(entry["created_at"]), reverse=True)[:RECENT_ACTIVITY_SIZE]
+            # Conditional on the version read, so a concurrent push is never overwritten
+            await db.users.update_one(
+                {**user_filter(user["id"]), "version": user.get("version")},
+                {"$set": {"recent_activity": recent, "recent_activity_seeded": True}}
+            )
+        return JSONResponse(
+            [{**entry, "created_at": iso_timestamp(entry["created_at"]), "user_id": user["id"], "user_email": user["email"]}
+             for entry in recent[:limit]],
+            headers={"ETag": etag, "Cache-Control": "private, no-cache"}
+        )
+    
+    query = {"user_id": user["id"]}
+    if before is not None:
+        try:
+            query.update(created_at_filter("$lt", before))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="before must be an ISO timestamp")
+    logs = await db.usage_logs.find(query, {"_id": 0}).sort("created_at", -1).to_list(limit)
     return logs
 
+# ============== BATCH ==============
+# POST /api/batch runs several GET requests for one page load in a single round
+# trip. The caller is authenticated and the user document read once; each
+# sub-request is then dispatched through the router concurrently and finds
+# that user on its scope instead of reading it again. Only the read-only,
+# non-streaming routes in BATCH_ALLOWED_PATHS can be batched: sub-requests
+# bypass the middleware (admission, tracing, idempotency), which the batch
+# passes through once as a whole.
+
+BATCH_MAX_REQUESTS = int(os.environ.get('BATCH_MAX_REQUESTS', 10))
+
+# fnmatch patterns
+BATCH_ALLOWED_PATHS = (
+    "/api/auth/me",
+    "/api/user/usage-history",
+    "/api/tools/live-tv/channels",
+    "/api/tools/live-tv/channels/*",
+    "/api/admin/users",
+    "/api/admin/users/directory",
+    "/api/admin/usage-logs",
+    "/api/admin/credit-logs",
+    "/api/admin/credit-holds",
+    "/api/admin/channels",
+    "/api/admin/ledger/drift",
+    "/api/admin/metrics",
+    "/api/admin/memory",
+    "/api/admin/traces",
+    "/api/admin/query-profile",
+    "/api/admin/tools",
+    "/api/admin/migrations",
+    "/api/admin/live-tv/proxy-stats",
+)
+
+async def _dispatch_sub_request(parent_scope: dict, target: str, user: dict) -> dict:
+    path, _, query = target.partition("?")
+    scope = {
+        "type": "http",
+        # Not every server (or test client) sets the optional ASGI keys
+        "asgi": parent_scope.get("asgi", {"version": "3.0"}),
+        "http_version": parent_scope.get("http_version", "1.1"),
+        "method": "GET",
+        "scheme": parent_scope.get("scheme", "http"),
+        "server": parent_scope.get("server"),
+        "client": parent_scope.get("client"),
+        "root_path": parent_scope.get("root_path", ""),
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query.encode(),
+        "headers": [(k, v) for k, v in parent_scope["headers"] if k == b"authorization"],
+        "app": parent_scope["app"],
+        "starlette.exception_handlers": parent_scope["starlette.exception_handlers"],
+        "batch_user": user
+    }
+    status_code, content_type, chunks = 500, "", []
+    request_sent = False
+    
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        return {"type": "http.disconnect"}
+    
+    async def send(message):
+        nonlocal status_code, content_type
+        if message["type"] == "http.response.start":
+            status_code = message["status"]
+            content_type = dict(message.get("headers", [])).get(b"content-type", b"").decode()
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+    
+    try:
+        await app.router(scope, receive, send)
+    except StarletteHTTPException as e:
+        # Raised by the router itself for unknown paths and methods
+        return {"status": e.status_code, "body": {"detail": e.detail}}
+    body = b"".join(chunks)
+    if content_type.startswith("application/json"):
+        return {"status": status_code, "body": json.loads(body) if body else None}
+    return {"status": status_code, "body": body.decode(errors="replace")}
+
+class BatchSubRequest(BaseModel):
+    id: str
+    path: str  # e.g. "/api/user/usage-history?limit=10"
+
+class BatchRequest(BaseModel):
+    requests: List[BatchSubRequest]
+
+@api_router.post("/batch")
+async def batch(data: BatchRequest, request: Request, claims: dict = Depends(get_current_claims)):
+    """Run up to BATCH_MAX_REQUESTS GET sub-requests with one authentication"""
+    if len(data.requests) > BATCH_MAX_REQUESTS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_REQUESTS} requests per batch")
+    user = await _load_active_user(claims["sub"], {"_id": 0})
+    
+    async def run(sub: BatchSubRequest) -> dict:
+        path = sub.path.partition("?")[0]
+        if not any(fnmatch(path, pattern) for pattern in BATCH_ALLOWED_PATHS):
+            return {"id": sub.id, "status": 400, "body": {"detail": "Path cannot be batched"}}
+        return {"id": sub.id, **await _dispatch_sub_request(request.scope, sub.path, user)}
+    
+    return {"responses": await asyncio.gather(*(run(sub) for sub in data.requests))}
+
 @api_router.get("/")
 async def root():
     return {"message": "OmniHub API", "version": "1.0.0"}
 
+# ============== ADMISSION CONTROL ==============
+# Each route group gets an AIMD concurrency limit learned from its own
+# latency: the limit grows by about one per round trip while latency stays
+# within ADMISSION_LATENCY_TOLERANCE of the group's baseline, and is cut by
+# ADMISSION_BACKOFF when it does not or the handler fails with a 5xx.
+# Requests over the limit wait in a bounded per-group queue and get a 503
+# when that queue is full or the wait exceeds ADMISSION_QUEUE_TIMEOUT.
+# Auth and admin have priority over tools: when their own limit is full they
+# take an idle tool slot, and a freed tool slot goes to their queued requests
+# before queued tool requests. They only ever wait for a slot they can use,
+# so a slow admin endpoint cannot hold tool traffic back.
+
+ADMISSION_CONTROL = os.environ.get('ADMISSION_CONTROL', 'on') == 'on'
+ADMISSION_INITIAL_LIMIT = int(os.environ.get('ADMISSION_INITIAL_LIMIT', 20))
+ADMISSION_MIN_LIMIT = int(os.environ.get('ADMISSION_MIN_LIMIT', 4))
+ADMISSION_MAX_LIMIT = int(os.environ.get('ADMISSION_MAX_LIMIT', 500))
+ADMISSION_QUEUE_SIZE = int(os.environ.get('ADMISSION_QUEUE_SIZE', 100))
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', 2))
+ADMISSION_LATENCY_TOLERANCE = float(os.environ.get('ADMISSION_LATENCY_TOLERANCE', 2.0))
+ADMISSION_BACKOFF = float(os.environ.get('ADMISSION_BACKOFF', 0.9))
+
+# Long-lived streams would hold a slot for as long as the client stays connected
+# and skew the group's latency baseline (fnmatch patterns)
+ADMISSION_EXEMPT = (
+    "/api/admin/logs/stream",
+    "/api/tools/live-tv/proxy/*/segment",
+    "/api/tools/temp-email/*/messages/*/attachments/*",
+)
+
+# (group, path prefix, priority) - the first matching prefix wins; lower priority values
+# are served first and may use idle slots of higher-valued groups
+ADMISSION_GROUPS = (
+    ("auth", "/api/auth/", 0),
+    ("admin", "/api/admin/", 0),
+    ("tools", "/api/", 1),
+)
+
+class AdaptiveLimiter:
+    def __init__(self, name: str, priority: int = 0, register: bool = True):
+        self.name = name
+        self.priority = priority
+        self.limit = float(ADMISSION_INITIAL_LIMIT)
+        self.in_flight = 0
+        self.waiters = deque()
+        self.baseline_ms = None
+        self.last_backoff = 0.0
+        self.shed = 0
+        self.timed_out = 0
+        self.borrowed = 0
+        if register:
+            METRICS[f"admission.{name}"] = self
+
+    def on_sample(self, latency_ms: float, failed: bool):
+        if self.baseline_ms is None:
+            self.baseline_ms = latency_ms
+        # The baseline follows improvements quickly and regressions slowly, so
+        # a lasting change in service time is eventually accepted as normal
+        self.baseline_ms += (latency_ms - self.baseline_ms) * (0.1 if latency_ms < self.baseline_ms else 0.01)
+        if failed or latency_ms > self.baseline_ms * ADMISSION_LATENCY_TOLERANCE:
+            now = time.monotonic()
+            # At most one cut per round trip, so one slow burst counts once
+            if now - self.last_backoff >= self.baseline_ms / 1000:
+                self.limit = max(ADMISSION_MIN_LIMIT, self.limit * ADMISSION_BACKOFF)
+                self.last_backoff = now
+        elif self.in_flight >= self.limit / 2:
+            # Only grow while the current limit is actually in use
+            self.limit = min(ADMISSION_MAX_LIMIT, self.limit + 1 / self.limit)
+
+    def snapshot(self) -> dict:
+        return {
+            "limit": round(self.limit, 1),
+            "in_flight": self.in_flight,
+            "queued": len(self.waiters),
+            "baseline_ms": round(self.baseline_ms or 0, 2),
+            "shed": self.shed,
+            "timed_out": self.timed_out,
+            "borrowed": self.borrowed
+        }
+
+class AdmissionController:
+    def __init__(self, groups=ADMISSION_GROUPS, register: bool = True):
+        self.routes = [(prefix, AdaptiveLimiter(name, priority, register)) for name, prefix, priority in groups]
+        self.limiters = sorted((limiter for _, limiter in self.routes), key=lambda l: l.priority)
+
+    def limiter_for(self, path: str) -> Optional[AdaptiveLimiter]:
+        if any(fnmatch(path, pattern) for pattern in ADMISSION_EXEMPT):
+            return None
+        return next((limiter for prefix, limiter in self.routes if path.startswith(prefix)), None)
+
+    def _free_slot(self, limiter: AdaptiveLimiter) -> Optional[AdaptiveLimiter]:
+        """The group whose slot a request of `limiter` can take now: its own, else an idle lower-priority one"""
+        if limiter.in_flight < int(limiter.limit):
+            return limiter
+        return next((other for other in reversed(self.limiters)
+                     if other.priority > limiter.priority and other.in_flight < int(other.limit)), None)
+
+    async def acquire(self, limiter: AdaptiveLimiter) -> Optional[AdaptiveLimiter]:
+        """Take a slot, waiting in the group's queue if needed. Returns the group the slot
+        belongs to, to pass back to release(); None means shed."""
+        slot = None if limiter.waiters else self._free_slot(limiter)
+        if slot is not None:
+            self._take(limiter, slot)
+            return slot
+        if len(limiter.waiters) >= ADMISSION_QUEUE_SIZE:
+            limiter.shed += 1
+            return None
+        waiter = asyncio.get_running_loop().create_future()
+        limiter.waiters.append(waiter)
+        try:
+            return await asyncio.wait_for(waiter, ADMISSION_QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            limiter.timed_out += 1
+            return None
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Admitted just as the client went away
+                self.release(limiter, slot=waiter.result())
+            raise
+        finally:
+            with contextlib.suppress(ValueError):
+                limiter.waiters.remove(waiter)
+
+    def _take(self, limiter: AdaptiveLimiter, slot: AdaptiveLimiter):
+        slot.in_flight += 1
+        if slot is not limiter:
+            limiter.borrowed += 1
+
+    def release(self, limiter: AdaptiveLimiter, latency_ms: float = None, failed: bool = False,
+                slot: AdaptiveLimiter = None):
+        (slot or limiter).in_flight -= 1
+        if latency_ms is not None:
+            limiter.on_sample(latency_ms, failed)
+        # Hand freed slots (and any a limit grew by) to queued requests, highest priority first
+        for candidate in self.limiters:
+            while candidate.waiters:
+                free = self._free_slot(candidate)
+                if free is None:
+                    break
+                waiter = candidate.waiters.popleft()
+                if not waiter.done():
+                    self._take(candidate, free)
+                    waiter.set_result(free)
+
+_admission = AdmissionController()
+
+class AdmissionMiddleware:
+    """Applies the adaptive concurrency limit of the request's route group."""
+
+    def __init__(self, app, controller: AdmissionController = None):
+        self.app = app
+        self.controller = controller or _admission
+
+    async def __call__(self, scope, receive, send):
+        limiter = self.controller.limiter_for(scope["path"]) if scope["type"] == "http" and ADMISSION_CONTROL else None
+        if limiter is None:
+            return await self.app(scope, receive, send)
+        slot = await self.controller.acquire(limiter)
+        if slot is None:
+            response = JSONResponse({"detail": "Server busy, retry shortly"}, status_code=503, headers={"Retry-After": "1"})
+            return await response(scope, receive, send)
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            self.controller.release(limiter, (time.perf_counter() - started) * 1000, status_code >= 500, slot)
+
+class FirstRequestTimer:
+    """Records how long after import the worker finished its first request."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        await self.app(scope, receive, send)
+        if scope["type"] == "http" and TIME_TO_FIRST_REQUEST_MS.value is None:
+            TIME_TO_FIRST_REQUEST_MS.set(round((time.perf_counter() - _IMPORT_STARTED) * 1000, 1))
+            logger.info("First request served %.1f ms after import", TIME_TO_FIRST_REQUEST_MS.value)
+
+class TracingMiddleware:
+    """Opens a trace per HTTP request and returns its id in X-Trace-Id."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or TRACE_EXPORT == "off":
+            return await self.app(scope, receive, send)
+        trace = Trace(scope["method"], scope["path"])
+
+        async def send_with_trace_id(message):
+            if message["type"] == "http.response.start":
+                trace.status = message["status"]
+                trace.endpoint = getattr(scope.get("endpoint"), "__name__", None)
+                message["headers"] = [*message.get("headers", []), (b"x-trace-id", trace.trace_id.encode())]
+            await send(message)
+
+        token = _current_trace.set(trace)
+        try:
+            await self.app(scope, receive, send_with_trace_id)
+        finally:
+            _current_trace.reset(token)
+            finish_trace(trace)
+
+class LogContextMiddleware:
+    """Exposes the request path to log filters for per-route sampling."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        token = _log_route.set(scope["path"])
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _log_route.reset(token)
+
 # Include the router
 app.include_router(api_router)
+app.add_middleware(AdmissionMiddleware)
+app.add_middleware(FirstRequestTimer)
+app.add_middleware(LogContextMiddleware)
+app.add_middleware(TracingMiddleware)
 
 # CORS
 app.add_middleware(
@@ -867,31 +4736,168 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+# Logging - request handlers only put records on a bounded in-memory queue; a
+# listener thread formats and writes them, so log I/O never blocks the event
+# loop. Records are formatted lazily on that thread. INFO and DEBUG can be
+# sampled per route, repeated errors are rate limited per call site, and
+# anything that does not fit the queue is dropped and counted.
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+LOG_SAMPLE_RATES = os.environ.get('LOG_SAMPLE_RATES', '')  # e.g. "/api/tools/eyecon-lookup=0.1,/api/tools/*=0.5"
+LOG_ERROR_BURST = int(os.environ.get('LOG_ERROR_BURST', 10))
+LOG_ERROR_WINDOW_SECONDS = float(os.environ.get('LOG_ERROR_WINDOW_SECONDS', 60))
+
+_log_route: ContextVar[Optional[str]] = ContextVar("log_route", default=None)
+
+LOGS_DROPPED = Counter("logging.dropped")
+LOGS_SAMPLED_OUT = Counter("logging.sampled_out")
+LOGS_RATE_LIMITED = Counter("logging.rate_limited")
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage()
+        }
+        if getattr(record, "route", None):
+            entry["route"] = record.route
+        if getattr(record, "suppressed", 0):
+            entry["suppressed"] = record.suppressed
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class SamplingFilter(logging.Filter):
+    """Keeps a per-route fraction of INFO and DEBUG records; warnings and above always pass."""
+
+    def __init__(self, spec: str):
+        super().__init__()
+        self.rates = []
+        for item in filter(None, (part.strip() for part in spec.split(","))):
+            pattern, _, rate = item.rpartition("=")
+            self.rates.append((pattern, float(rate)))
+        self.rate_for = functools.lru_cache(maxsize=1024)(self._lookup)
+
+    def _lookup(self, route: str) -> float:
+        return next((rate for pattern, rate in self.rates if fnmatch(route, pattern)), 1.0)
+
+    def filter(self, record):
+        route = _log_route.get()
+        record.route = route
+        if record.levelno >= logging.WARNING or route is None or not self.rates:
+            return True
+        rate = self.rate_for(route)
+        if rate >= 1.0 or random.random() < rate:
+            return True
+        LOGS_SAMPLED_OUT.increment()
+        return False
+
+class ErrorRateLimitFilter(logging.Filter):
+    """Passes at most `burst` ERROR records per call site per window.
+
+    The first record of the next window carries the count that was dropped."""
+
+    def __init__(self, burst: int, window: float):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self._sites = {}  # (pathname, lineno) -> [window start, passed, suppressed]
+
+    def filter(self, record):
+        if record.levelno < logging.ERROR:
+            return True
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        site = self._sites.get(key)
+        if site is None or now - site[0] >= self.window:
+            record.suppressed = site[2] if site else 0
+            site = self._sites[key] = [now, 0, 0]
+        if site[1] >= self.burst:
+            site[2] += 1
+            LOGS_RATE_LIMITED.increment()
+            return False
+        site[1] += 1
+        return True
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # Args can be mutable objects that change before the listener thread gets to
+        # the record, so the message is merged here; formatting (timestamps, JSON,
+        # tracebacks) is still left to the listener
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOGS_DROPPED.increment()
+
+def setup_logging() -> logging.handlers.QueueListener:
+    output = logging.StreamHandler()
+    if LOG_FORMAT == "json":
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    
+    handler = NonBlockingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+    account_container("logging.queue", 32 * 1024 * 1024, handler.queue.queue, evictable=False)
+    handler.addFilter(SamplingFilter(LOG_SAMPLE_RATES))
+    handler.addFilter(ErrorRateLimitFilter(LOG_ERROR_BURST, LOG_ERROR_WINDOW_SECONDS))
+    
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(LOG_LEVEL)
+    # uvicorn installs its own blocking stream handlers; send its records through the queue too
+    for name in ("uvicorn", "uvicorn.error", "uvicorn.access"):
+        logging.getLogger(name).handlers = []
+        logging.getLogger(name).propagate = True
+    
+    listener = logging.handlers.QueueListener(handler.queue, output, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+_log_listener = setup_logging()
 logger = logging.getLogger(__name__)
 
+# Long-running loops started on startup and cancelled on shutdown
+_background_tasks: List[asyncio.Task] = []
+
 # Startup event - Create admin users
 @app.on_event("startup")
 async def startup_event():
+    # Writers and readers pick the created_at and users key layout from it
+    await refresh_migration_status()
+    
     # Main Super Admin
     admin_email = os.environ.get("ADMIN_EMAIL", "admin@omnihub.com")
     admin_password = os.environ.get("ADMIN_PASSWORD", "Admin@123")
     
     existing_admin = await db.users.find_one({"email": admin_email})
     if not existing_admin:
+        admin_id = str(uuid.uuid4())
         admin_user = {
-            "id": str(uuid.uuid4()),
+            "_id": admin_id,
+            "id": admin_id,
             "email": admin_email,
             "name": "Super Admin",
-            "password_hash": get_password_hash(admin_password),
+            "email_lower": admin_email.lower(),
+            "name_lower": "super admin",
+            "password_hash": await get_password_hash(admin_password),
             "role": "admin",
             "credits": 999999,
             "is_active": True,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "created_at": timestamp()
         }
         await db.users.insert_one(admin_user)
-        logger.info(f"Super Admin created: {admin_email}")
+        await db.credit_logs.insert_one(_initial_credit_log(admin_user))
+        logger.info("Super Admin created: %s", admin_email)
     
     # Additional Admin accounts with 100 credits each
     additional_admins = [
@@ -905,27 +4911,78 @@ async def startup_event():
     for admin_data in additional_admins:
         existing = await db.users.find_one({"email": admin_data["email"]})
         if not existing:
+            admin_id = str(uuid.uuid4())
             new_admin = {
-                "id": str(uuid.uuid4()),
+                "_id": admin_id,
+                "id": admin_id,
                 "email": admin_data["email"],
                 "name": admin_data["name"],
-                "password_hash": get_password_hash(admin_data["password"]),
+                "email_lower": admin_data["email"].lower(),
+                "name_lower": admin_data["name"].lower(),
+                "password_hash": await get_password_hash(admin_data["password"]),
                 "role": "admin",
                 "credits": 100,
                 "is_active": True,
-                "created_at": datetime.now(timezone.utc).isoformat()
+                "created_at": timestamp()
             }
             await db.users.insert_one(new_admin)
-            logger.info(f"Admin created: {admin_data['email']} with 100 credits")
+            await db.credit_logs.insert_one(_initial_credit_log(new_admin))
+            logger.info("Admin created: %s with 100 credits", admin_data["email"])
     
     # Create indexes
     await db.users.create_index("email", unique=True)
-    await db.users.create_index("id", unique=True)
+    if not migration_complete("user_id_keys"):
+        # Redundant once users are keyed by _id = id; user_id_keys drops it
+        await db.users.create_index("id", unique=True)
+    await db.users.create_index([("created_at", -1), ("id", -1)])
+    await db.users.create_index([("credits", -1), ("id", -1)])
+    await db.users.create_index([("name_lower", 1), ("id", 1)])
+    await db.users.create_index("email_lower")
+    await db.users.create_index([("name", "text"), ("email", "text")])
     await db.usage_logs.create_index("user_id")
     await db.usage_logs.create_index("created_at")
     await db.credit_logs.create_index("user_id")
     await db.credit_logs.create_index("created_at")
+    await db.usage_logs.create_index([("created_at", 1), ("id", 1)])
+    await db.credit_logs.create_index([("created_at", 1), ("id", 1)])
+    await db.idempotency_keys.create_index("expires_at", expireAfterSeconds=0)
+    await db.credit_holds.create_index("expires_at")
+    await db.ledger_drift.create_index("abs_drift")
+    await db.refresh_tokens.create_index("expires_at", expireAfterSeconds=0)
+    await db.refresh_tokens.create_index("user_id")
+    await db.refresh_tokens.create_index("family_id")
+    await db.token_revocations.create_index("expires_at", expireAfterSeconds=0)
+    await db.temp_mailboxes.create_index("expires_at", expireAfterSeconds=0)
+    
+    await seed_channel_catalog()
+    
+    _background_tasks.append(asyncio.create_task(_credit_hold_sweeper()))
+    _background_tasks.append(asyncio.create_task(_watch_channel_catalog()))
+    _background_tasks.append(asyncio.create_task(_sync_token_revocations()))
+    if TRACE_EXPORT in ("file", "otlp"):
+        _background_tasks.append(asyncio.create_task(_export_traces()))
+    if _query_profiler is not None:
+        _background_tasks.append(asyncio.create_task(_explain_slow_queries()))
+    _background_tasks.append(asyncio.create_task(_memory_watchdog()))
+    if RECONCILE_INTERVAL_SECONDS > 0:
+        _background_tasks.append(asyncio.create_task(_reconcile_ledger_periodically()))
+    _background_tasks.append(asyncio.create_task(_follow_migrations()))
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    for task in _background_tasks:
+        task.cancel()
+    await _log_tail.stop()
     client.close()
+    analytics_client.close()
+    if _hls_http is not None:
+        await _hls_http.aclose()
+    if _temp_email_http is not None:
+        await _temp_email_http.aclose()
+    if _image_http is not None:
+        await _image_http.aclose()
+    await close_tool_clients()
+    if _image_pool is not None:
+        _image_pool.shutdown(wait=False, cancel_futures=True)
+
+IMPORT_DURATION_MS.set(round((time.perf_counter() - _IMPORT_STARTED) * 1000, 1))
@@ -15,6 +15,7 @@ class OmniHubAPITester:
         self.base_url = base_url
         self.admin_token = None
         self.user_token = None
+        self.user_refresh_token = None
         self.test_user_id = None
         self.tests_run = 0
         self.tests_passed = 0
@@ -57,6 +58,8 @@ class OmniHubAPITester:
                 response = requests.post(url, json=data, headers=headers, timeout=30)
             elif method.upper() == 'PUT':
                 response = requests.put(url, json=data, headers=headers, timeout=30)
+            elif method.upper() == 'DELETE':
+                response = requests.delete(url, headers=headers, timeout=30)
             else:
                 return False, {"error": f"Unsupported method: {method}"}
             
@@ -101,6 +104,7 @@ class OmniHubAPITester:
         
         if success and "access_token" in response:
             self.user_token = response["access_token"]
+            self.user_refresh_token = response.get("refresh_token")
             user_data = response.get("user", {})
             self.test_user_id = user_data.get("id")
             self.log_test("User Registration", True, 
@@ -125,6 +129,30 @@ class OmniHubAPITester:
             self.log_test("User Login", False, str(response))
             return False
 
+    def test_token_refresh(self):
+        """Test refresh token rotation"""
+        if not self.user_refresh_token:
+            self.log_test("Token Refresh", False, "No refresh token available")
+            return False
+        
+        success, response = self.make_request(
+            "POST", "/auth/refresh", {"refresh_token": self.user_refresh_token}
+        )
+        
+        if not (success and response.get("refresh_token")):
+            self.log_test("Token Refresh", False, str(response))
+            return False
+        
+        # The consumed refresh token must not work a second time
+        old_token = self.user_refresh_token
+        self.user_token = response["access_token"]
+        self.user_refresh_token = response["refresh_token"]
+        reused, _ = self.make_request(
+            "POST", "/auth/refresh", {"refresh_token": old_token}, expected_status=401
+        )
+        self.log_test("Token Refresh", reused, "Rotated; old refresh token rejected" if reused else "Old refresh token still accepted")
+        return reused
+
     def test_admin_get_users(self):
         """Test admin get all users"""
         success, response = self.make_request(
@@ -139,6 +167,19 @@ class OmniHubAPITester:
             self.log_test("Admin Get Users", False, str(response))
             return False
 
+    def test_admin_user_directory(self):
+        """Test admin paged user directory with prefix search"""
+        success, response = self.make_request(
+            "GET", f"/admin/users/directory?q={self.test_user_email[:8]}&limit=5", token=self.admin_token
+        )
+        
+        if success and any(u.get("email") == self.test_user_email for u in response.get("users", [])):
+            self.log_test("Admin User Directory", True, f"Total matches: {response.get('total')}")
+            return True
+        else:
+            self.log_test("Admin User Directory", False, str(response))
+            return False
+
     def test_admin_assign_credits(self):
         """Test admin credit assignment"""
         if not self.test_user_id:
@@ -163,6 +204,27 @@ class OmniHubAPITester:
             self.log_test("Admin Assign Credits", False, str(response))
             return False
 
+    def test_admin_bulk_credits(self):
+        """Test admin bulk credit grant with per-row outcomes"""
+        success, response = self.make_request(
+            "POST", "/admin/credits/bulk",
+            {
+                "reason": "Test bulk grant",
+                "items": [
+                    {"user_id": self.test_user_id, "amount": 5},
+                    {"user_id": "missing-user", "amount": 5}
+                ]
+            },
+            token=self.admin_token
+        )
+        
+        if success and response.get("applied") == 1 and response.get("rejected") == 1:
+            self.log_test("Admin Bulk Credits", True, f"Results: {response['results']}")
+            return True
+        else:
+            self.log_test("Admin Bulk Credits", False, str(response))
+            return False
+
     def test_phone_lookup_insufficient_credits(self):
         """Test phone lookup with insufficient credits (should fail)"""
         # First, let's check current user credits
@@ -239,6 +301,75 @@ class OmniHubAPITester:
             self.log_test("Live TV Channels", False, str(response))
             return False
 
+    def test_admin_channel_catalog(self):
+        """Test admin channel create/update/delete and catalog reload"""
+        channel_id = f"test_{datetime.now().strftime('%H%M%S')}"
+        created, response = self.make_request(
+            "POST", "/admin/channels",
+            {"id": channel_id, "name": "Catalog Test", "stream_url": "https://example.com/live.m3u8", "category": "Test"},
+            token=self.admin_token
+        )
+        updated, _ = self.make_request("PUT", f"/admin/channels/{channel_id}", {"active": False}, token=self.admin_token)
+        listed, channels = self.make_request("GET", "/tools/live-tv/channels", token=self.user_token)
+        listed = listed and any(ch.get("id") == channel_id and not ch.get("active") for ch in channels.get("channels", []))
+        deleted, _ = self.make_request("DELETE", f"/admin/channels/{channel_id}", token=self.admin_token)
+        
+        if created and updated and listed and deleted:
+            self.log_test("Admin Channel Catalog", True, f"Channel {channel_id} created, disabled and deleted")
+            return True
+        else:
+            self.log_test("Admin Channel Catalog", False, str(response))
+            return False
+
+    def test_live_tv_proxy(self):
+        """Test live TV stream returns a playable proxy URL"""
+        success, response = self.make_request(
+            "GET", "/tools/live-tv/stream/test_stream", token=self.user_token
+        )
+        
+        if not (success and response.get("proxy_url")):
+            self.log_test("Live TV Proxy", False, str(response))
+            return False
+        
+        # The proxy is authorized by its signed view token, not the bearer header
+        root = self.base_url[:-len("/api")]
+        try:
+            playlist = requests.get(f"{root}{response['proxy_url']}", timeout=30)
+        except Exception as e:
+            self.log_test("Live TV Proxy", False, str(e))
+            return False
+        
+        if playlist.status_code == 200 and playlist.text.startswith("#EXTM3U"):
+            self.log_test("Live TV Proxy", True, f"Playlist size: {len(playlist.text)} bytes")
+            return True
+        else:
+            self.log_test("Live TV Proxy", False, f"Status {playlist.status_code}")
+            return False
+
+    def test_idempotent_retry(self):
+        """Test a retried tool call with the same Idempotency-Key is charged once"""
+        url = f"{self.base_url}/tools/image-enhance"
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': f'Bearer {self.user_token}',
+            'Idempotency-Key': f"test-{datetime.now().strftime('%H%M%S%f')}"
+        }
+        payload = {"image_url": "https://i.imgur.com/qPD9J4I.png"}
+        
+        try:
+            first = requests.post(url, json=payload, headers=headers, timeout=30)
+            retry = requests.post(url, json=payload, headers=headers, timeout=30)
+        except Exception as e:
+            self.log_test("Idempotent Retry", False, str(e))
+            return False
+        
+        if first.status_code == 200 and retry.status_code == 200 and retry.headers.get("Idempotent-Replayed") == "true":
+            self.log_test("Idempotent Retry", True, "Retry replayed without a second charge")
+            return True
+        else:
+            self.log_test("Idempotent Retry", False, f"Status {first.status_code}/{retry.status_code}")
+            return False
+
     def test_usage_history(self):
         """Test user usage history"""
         success, response = self.make_request(
@@ -253,6 +384,46 @@ class OmniHubAPITester:
             self.log_test("Usage History", False, str(response))
             return False
 
+    def test_usage_history_not_modified(self):
+        """Test conditional GET of usage history with the returned ETag"""
+        headers = {"Authorization": f"Bearer {self.user_token}"}
+        try:
+            first = requests.get(f"{self.base_url}/user/usage-history", headers=headers, timeout=30)
+            etag = first.headers.get("ETag")
+            second = requests.get(
+                f"{self.base_url}/user/usage-history", headers={**headers, "If-None-Match": etag or ""}, timeout=30
+            )
+        except Exception as e:
+            self.log_test("Usage History Not Modified", False, str(e))
+            return False
+        
+        if etag and second.status_code == 304:
+            self.log_test("Usage History Not Modified", True, f"ETag: {etag}")
+            return True
+        else:
+            self.log_test("Usage History Not Modified", False, f"ETag: {etag}, status: {second.status_code}")
+            return False
+
+    def test_batch(self):
+        """Test batched page-load requests with one authentication"""
+        success, response = self.make_request(
+            "POST", "/batch",
+            {"requests": [
+                {"id": "me", "path": "/api/auth/me"},
+                {"id": "history", "path": "/api/user/usage-history?limit=5"},
+                {"id": "channels", "path": "/api/tools/live-tv/channels"}
+            ]},
+            token=self.user_token
+        )
+        
+        statuses = {r.get("id"): r.get("status") for r in response.get("responses", [])} if success else {}
+        if statuses == {"me": 200, "history": 200, "channels": 200}:
+            self.log_test("Batch Requests", True, f"Sub-requests: {len(statuses)}")
+            return True
+        else:
+            self.log_test("Batch Requests", False, str(response))
+            return False
+
     def test_admin_usage_logs(self):
         """Test admin usage logs"""
         success, response = self.make_request(
@@ -312,20 +483,29 @@ class OmniHubAPITester:
             print("❌ User registration failed - stopping tests")
             return False
             
+        self.test_token_refresh()
+        
         # Admin functionality tests
         self.test_admin_get_users()
+        self.test_admin_user_directory()
         
         # Test credit system
         self.test_phone_lookup_insufficient_credits()  # Should fail with 0 credits
         self.test_admin_assign_credits()  # Admin assigns credits
+        self.test_admin_bulk_credits()
         
         # Tool tests with credits
         self.test_phone_lookup_with_credits()
         self.test_temp_email_generation()
         self.test_live_tv_channels()
+        self.test_admin_channel_catalog()
+        self.test_live_tv_proxy()
+        self.test_idempotent_retry()
         
         # History and logs
         self.test_usage_history()
+        self.test_usage_history_not_modified()
+        self.test_batch()
         self.test_admin_usage_logs()
         self.test_admin_credit_logs()
         
@@ -5,10 +5,72 @@ const AuthContext = createContext(null);
 
 const API = `${process.env.REACT_APP_BACKEND_URL}/api`;
 
+const TOKEN_KEY = "omnihub_token";
+const REFRESH_TOKEN_KEY = "omnihub_refresh_token";
+
+const storeTokens = (accessToken, refreshToken) => {
+  localStorage.setItem(TOKEN_KEY, accessToken);
+  if (refreshToken) {
+    localStorage.setItem(REFRESH_TOKEN_KEY, refreshToken);
+  }
+  axios.defaults.headers.common["Authorization"] = `Bearer ${accessToken}`;
+};
+
+// Access tokens are short-lived; one shared refresh runs when any request gets a 401
+let refreshPromise = null;
+
+const refreshAccessToken = async () => {
+  const refreshToken = localStorage.getItem(REFRESH_TOKEN_KEY);
+  if (!refreshToken) {
+    throw new Error("No refresh token");
+  }
+  try {
+    const response = await axios.post(`${API}/auth/refresh`, { refresh_token: refreshToken });
+    storeTokens(response.data.access_token, response.data.refresh_token);
+    return response.data.access_token;
+  } catch (error) {
+    // Another tab may have rotated the token first; use its result if so
+    const latest = localStorage.getItem(REFRESH_TOKEN_KEY);
+    if (latest && latest !== refreshToken) {
+      const accessToken = localStorage.getItem(TOKEN_KEY);
+      axios.defaults.headers.common["Authorization"] = `Bearer ${accessToken}`;
+      return accessToken;
+    }
+    throw error;
+  }
+};
+
 export const AuthProvider = ({ children }) => {
   const [user, setUser] = useState(null);
   const [loading, setLoading] = useState(true);
-  const [token, setToken] = useState(localStorage.getItem("omnihub_token"));
+  const [token, setToken] = useState(localStorage.getItem(TOKEN_KEY));
+
+  // Registered before the first /auth/me so an expired stored token gets refreshed
+  useEffect(() => {
+    const interceptor = axios.interceptors.response.use(
+      (response) => response,
+      async (error) => {
+        const original = error.config;
+        const isAuthCall = original?.url?.includes("/auth/refresh") || original?.url?.includes("/auth/login");
+        if (error.response?.status !== 401 || !original || original._retried || isAuthCall) {
+          return Promise.reject(error);
+        }
+        original._retried = true;
+        try {
+          refreshPromise = refreshPromise || refreshAccessToken().finally(() => {
+            refreshPromise = null;
+          });
+          const accessToken = await refreshPromise;
+          original.headers["Authorization"] = `Bearer ${accessToken}`;
+          return axios(original);
+        } catch (refreshError) {
+          logout();
+          return Promise.reject(error);
+        }
+      }
+    );
+    return () => axios.interceptors.response.eject(interceptor);
+  }, []);
 
   useEffect(() => {
     if (token) {
@@ -33,9 +95,8 @@ export const AuthProvider = ({ children }) => {
 
   const login = async (email, password) => {
     const response = await axios.post(`${API}/auth/login`, { email, password });
-    const { access_token, user: userData } = response.data;
-    localStorage.setItem("omnihub_token", access_token);
-    axios.defaults.headers.common["Authorization"] = `Bearer ${access_token}`;
+    const { access_token, refresh_token, user: userData } = response.data;
+    storeTokens(access_token, refresh_token);
     setToken(access_token);
     setUser(userData);
     return userData;
@@ -43,16 +104,20 @@ export const AuthProvider = ({ children }) => {
 
   const register = async (email, password, name) => {
     const response = await axios.post(`${API}/auth/register`, { email, password, name });
-    const { access_token, user: userData } = response.data;
-    localStorage.setItem("omnihub_token", access_token);
-    axios.defaults.headers.common["Authorization"] = `Bearer ${access_token}`;
+    const { access_token, refresh_token, user: userData } = response.data;
+    storeTokens(access_token, refresh_token);
     setToken(access_token);
     setUser(userData);
     return userData;
   };
 
   const logout = () => {
-    localStorage.removeItem("omnihub_token");
+    const refreshToken = localStorage.getItem(REFRESH_TOKEN_KEY);
+    if (refreshToken) {
+      axios.post(`${API}/auth/logout`, { refresh_token: refreshToken }).catch(() => {});
+    }
+    localStorage.removeItem(TOKEN_KEY);
+    localStorage.removeItem(REFRESH_TOKEN_KEY);
     delete axios.defaults.headers.common["Authorization"];
     setToken(null);
     setUser(null);
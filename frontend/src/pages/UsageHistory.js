@@ -2,14 +2,18 @@ import { useState, useEffect } from "react";
 import axios from "axios";
 import { Card, CardContent, CardDescription, CardHeader, CardTitle } from "../components/ui/card";
 import { Badge } from "../components/ui/badge";
+import { Button } from "../components/ui/button";
 import { toast } from "sonner";
 import { History, Loader2, CheckCircle, XCircle } from "lucide-react";
 
 const API = `${process.env.REACT_APP_BACKEND_URL}/api`;
+const PAGE_SIZE = 50;
 
 const UsageHistory = () => {
   const [logs, setLogs] = useState([]);
   const [loading, setLoading] = useState(true);
+  const [loadingMore, setLoadingMore] = useState(false);
+  const [hasMore, setHasMore] = useState(false);
 
   useEffect(() => {
     fetchHistory();
@@ -17,8 +21,9 @@ const UsageHistory = () => {
 
   const fetchHistory = async () => {
     try {
-      const response = await axios.get(`${API}/user/usage-history`);
+      const response = await axios.get(`${API}/user/usage-history`, { params: { limit: PAGE_SIZE } });
       setLogs(response.data);
+      setHasMore(response.data.length === PAGE_SIZE);
     } catch (error) {
       toast.error("Failed to load usage history");
     } finally {
@@ -26,6 +31,20 @@ const UsageHistory = () => {
     }
   };
 
+  const loadMore = async () => {
+    setLoadingMore(true);
+    try {
+      const before = logs[logs.length - 1].created_at;
+      const response = await axios.get(`${API}/user/usage-history`, { params: { limit: PAGE_SIZE, before } });
+      setLogs((current) => [...current, ...response.data]);
+      setHasMore(response.data.length === PAGE_SIZE);
+    } catch (error) {
+      toast.error("Failed to load usage history");
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const getToolColor = (tool) => {
     const colors = {
       live_tv: "bg-blue-500/20 text-blue-400",
@@ -108,6 +127,13 @@ const UsageHistory = () => {
                   </div>
                 </div>
               ))}
+              {hasMore && (
+                <div className="flex justify-center pt-2">
+                  <Button variant="outline" onClick={loadMore} disabled={loadingMore} data-testid="load-more-usage-btn">
+                    {loadingMore ? <Loader2 className="w-4 h-4 animate-spin" /> : "Load more"}
+                  </Button>
+                </div>
+              )}
             </div>
           )}
         </CardContent>
@@ -7,31 +7,91 @@ import { toast } from "sonner";
 import { FileText, Loader2, CheckCircle, XCircle, Coins, History } from "lucide-react";
 
 const API = `${process.env.REACT_APP_BACKEND_URL}/api`;
+const MAX_ROWS = 100;
+
+// Newest "created_at|id" event position among the loaded rows, to resume the live tail from
+const latestPosition = (...lists) =>
+  lists
+    .flat()
+    .map((log) => `${log.created_at}|${log.id}`)
+    .reduce((latest, position) => (latest === null || position > latest ? position : latest), null);
+
+const prependLog = (log) => (logs) =>
+  logs.some((existing) => existing.id === log.id) ? logs : [log, ...logs].slice(0, MAX_ROWS);
 
 const AdminLogs = () => {
   const [usageLogs, setUsageLogs] = useState([]);
   const [creditLogs, setCreditLogs] = useState([]);
   const [loading, setLoading] = useState(true);
+  const [live, setLive] = useState(false);
 
   useEffect(() => {
-    fetchLogs();
+    const controller = new AbortController();
+    fetchLogs().then((position) => followLogs(position, controller.signal));
+    return () => controller.abort();
   }, []);
 
   const fetchLogs = async () => {
     try {
       const [usageRes, creditRes] = await Promise.all([
-        axios.get(`${API}/admin/usage-logs?limit=100`),
-        axios.get(`${API}/admin/credit-logs?limit=100`),
+        axios.get(`${API}/admin/usage-logs?limit=${MAX_ROWS}`),
+        axios.get(`${API}/admin/credit-logs?limit=${MAX_ROWS}`),
       ]);
       setUsageLogs(usageRes.data);
       setCreditLogs(creditRes.data);
+      return latestPosition(usageRes.data, creditRes.data);
     } catch (error) {
       toast.error("Failed to load logs");
+      return null;
     } finally {
       setLoading(false);
     }
   };
 
+  // Server-Sent Events read with fetch so the Authorization header is sent;
+  // reconnects resume after the last event received
+  const followLogs = async (position, signal) => {
+    let lastEventId = position;
+    while (!signal.aborted) {
+      try {
+        const response = await fetch(`${API}/admin/logs/stream`, {
+          headers: {
+            Authorization: axios.defaults.headers.common["Authorization"],
+            ...(lastEventId ? { "Last-Event-ID": lastEventId } : {}),
+          },
+          signal,
+        });
+        if (!response.ok) throw new Error(`Log stream returned ${response.status}`);
+        setLive(true);
+        const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+        let buffer = "";
+        for (;;) {
+          const { value, done } = await reader.read();
+          if (done) break;
+          buffer += value;
+          let end;
+          while ((end = buffer.indexOf("\n\n")) >= 0) {
+            const event = { type: "message", id: null, data: "" };
+            for (const line of buffer.slice(0, end).split("\n")) {
+              if (line.startsWith("id: ")) event.id = line.slice(4);
+              else if (line.startsWith("event: ")) event.type = line.slice(7);
+              else if (line.startsWith("data: ")) event.data = line.slice(6);
+            }
+            buffer = buffer.slice(end + 2);
+            if (event.id) lastEventId = event.id;
+            if (event.type === "usage_logs") setUsageLogs(prependLog(JSON.parse(event.data)));
+            else if (event.type === "credit_logs") setCreditLogs(prependLog(JSON.parse(event.data)));
+            else if (event.type === "gap") lastEventId = (await fetchLogs()) || lastEventId;
+          }
+        }
+      } catch (error) {
+        if (signal.aborted) return;
+      }
+      setLive(false);
+      await new Promise((resolve) => setTimeout(resolve, 3000));
+    }
+  };
+
   const getToolColor = (tool) => {
     const colors = {
       live_tv: "bg-blue-500/20 text-blue-400",
@@ -48,7 +108,14 @@ const AdminLogs = () => {
   return (
     <div className="space-y-6 animate-fade-in" data-testid="admin-logs-page">
       <div>
-        <h1 className="text-3xl font-heading font-bold text-foreground mb-2">System Logs</h1>
+        <div className="flex items-center gap-3 mb-2">
+          <h1 className="text-3xl font-heading font-bold text-foreground">System Logs</h1>
+          {live && (
+            <Badge className="bg-green-500/20 text-green-400" data-testid="logs-live-badge">
+              Live
+            </Badge>
+          )}
+        </div>
         <p className="text-muted-foreground">View all usage and credit transaction logs</p>
       </div>
 
@@ -1,8 +1,9 @@
-import { useState, useEffect } from "react";
+import { useState, useEffect, useCallback } from "react";
 import axios from "axios";
 import { Card, CardContent, CardDescription, CardHeader, CardTitle } from "../../components/ui/card";
 import { Button } from "../../components/ui/button";
 import { Badge } from "../../components/ui/badge";
+import { Input } from "../../components/ui/input";
 import {
   Table,
   TableBody,
@@ -12,28 +13,47 @@ import {
   TableRow,
 } from "../../components/ui/table";
 import { toast } from "sonner";
-import { Users, Loader2, UserX, UserCheck, Shield } from "lucide-react";
+import { Users, Loader2, UserX, UserCheck, Shield, Search } from "lucide-react";
 
 const API = `${process.env.REACT_APP_BACKEND_URL}/api`;
+const PAGE_SIZE = 50;
+const SEARCH_DEBOUNCE_MS = 300;
 
 const AdminUsers = () => {
   const [users, setUsers] = useState([]);
+  const [total, setTotal] = useState(0);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [search, setSearch] = useState("");
   const [loading, setLoading] = useState(true);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [actionLoading, setActionLoading] = useState(null);
 
-  useEffect(() => {
-    fetchUsers();
-  }, []);
-
-  const fetchUsers = async () => {
+  // Search and paging run server-side against the indexed user directory
+  const fetchUsers = useCallback(async (cursor = null) => {
     try {
-      const response = await axios.get(`${API}/admin/users`);
-      setUsers(response.data);
+      const params = { limit: PAGE_SIZE };
+      if (search.trim()) params.q = search.trim();
+      if (cursor) params.cursor = cursor;
+      const response = await axios.get(`${API}/admin/users/directory`, { params });
+      setUsers((prev) => (cursor ? [...prev, ...response.data.users] : response.data.users));
+      setNextCursor(response.data.next_cursor);
+      setTotal(response.data.total);
     } catch (error) {
       toast.error("Failed to load users");
     } finally {
       setLoading(false);
+      setLoadingMore(false);
     }
+  }, [search]);
+
+  useEffect(() => {
+    const timer = setTimeout(() => fetchUsers(), SEARCH_DEBOUNCE_MS);
+    return () => clearTimeout(timer);
+  }, [fetchUsers]);
+
+  const loadMore = () => {
+    setLoadingMore(true);
+    fetchUsers(nextCursor);
   };
 
   const toggleSuspend = async (userId, currentStatus) => {
@@ -41,7 +61,9 @@ const AdminUsers = () => {
     try {
       const response = await axios.post(`${API}/admin/users/${userId}/suspend`);
       toast.success(response.data.message);
-      fetchUsers();
+      setUsers((prev) =>
+        prev.map((u) => (u.id === userId ? { ...u, is_active: response.data.is_active } : u))
+      );
     } catch (error) {
       const message = error.response?.data?.detail || "Action failed";
       toast.error(message);
@@ -63,7 +85,17 @@ const AdminUsers = () => {
             <Users className="w-5 h-5" />
             All Users
           </CardTitle>
-          <CardDescription>{users.length} registered users</CardDescription>
+          <CardDescription>{total.toLocaleString()} registered users</CardDescription>
+          <div className="relative pt-2">
+            <Search className="absolute left-3 top-1/2 translate-y-[-25%] w-4 h-4 text-muted-foreground" />
+            <Input
+              placeholder="Search by name or email"
+              value={search}
+              onChange={(e) => setSearch(e.target.value)}
+              className="pl-9"
+              data-testid="user-search-input"
+            />
+          </div>
         </CardHeader>
         <CardContent>
           {loading ? (
@@ -140,6 +172,13 @@ const AdminUsers = () => {
                   ))}
                 </TableBody>
               </Table>
+              {nextCursor && (
+                <div className="flex justify-center pt-4">
+                  <Button variant="outline" onClick={loadMore} disabled={loadingMore} data-testid="load-more-users-btn">
+                    {loadingMore ? <Loader2 className="w-4 h-4 animate-spin" /> : "Load more"}
+                  </Button>
+                </div>
+              )}
             </div>
           )}
         </CardContent>
@@ -20,6 +20,10 @@ const categoryColors = {
   Kids: "bg-pink-500/20 text-pink-400",
 };
 
+// Resized, cached logo from the backend image proxy, falling back to the original
+const logoSrc = (channel) =>
+  channel.logo_proxy ? `${process.env.REACT_APP_BACKEND_URL}${channel.logo_proxy}` : channel.logo;
+
 const LiveTV = () => {
   const { refreshUser } = useAuth();
   const [channels, setChannels] = useState([]);
@@ -161,7 +165,10 @@ const LiveTV = () => {
     
     try {
       const response = await axios.get(`${API}/tools/live-tv/stream/${channel.id}`);
-      setStreamUrl(response.data.stream_url);
+      // Prefer the backend HLS proxy; it shares playlist fetches and fixes CORS-less origins
+      setStreamUrl(response.data.proxy_url
+        ? `${process.env.REACT_APP_BACKEND_URL}${response.data.proxy_url}`
+        : response.data.stream_url);
       toast.success(`Playing ${channel.name} (-${response.data.credits_used} credit)`);
       refreshUser();
     } catch (error) {
@@ -302,7 +309,7 @@ const LiveTV = () => {
               <CardContent className="p-4 border-t border-border">
                 <div className="flex items-center gap-4">
                   <img 
-                    src={selectedChannel.logo} 
+                    src={logoSrc(selectedChannel)} 
                     alt={selectedChannel.name}
                     className="w-12 h-12 rounded-lg object-contain bg-muted p-1"
                     onError={(e) => { e.target.style.display = 'none'; }}
@@ -361,7 +368,7 @@ const LiveTV = () => {
                       >
                         <div className="w-10 h-10 rounded-lg bg-muted flex items-center justify-center overflow-hidden flex-shrink-0">
                           <img 
-                            src={channel.logo} 
+                            src={logoSrc(channel)} 
                             alt={channel.name}
                             className="w-full h-full object-contain p-1"
                             onError={(e) => { 
@@ -5,7 +5,7 @@ import { Card, CardContent, CardDescription, CardHeader, CardTitle } from "../..
 import { Button } from "../../components/ui/button";
 import { Badge } from "../../components/ui/badge";
 import { toast } from "sonner";
-import { Mail, RefreshCw, Copy, Inbox, Loader2 } from "lucide-react";
+import { Mail, RefreshCw, Copy, Inbox, Loader2, ArrowLeft, Paperclip } from "lucide-react";
 
 const API = `${process.env.REACT_APP_BACKEND_URL}/api`;
 
@@ -15,6 +15,8 @@ const TempEmail = () => {
   const [messages, setMessages] = useState([]);
   const [loading, setLoading] = useState(false);
   const [checkingMail, setCheckingMail] = useState(false);
+  const [openMessage, setOpenMessage] = useState(null);
+  const [loadingMessage, setLoadingMessage] = useState(null);
 
   const generateEmail = async () => {
     setLoading(true);
@@ -24,6 +26,7 @@ const TempEmail = () => {
       });
       setEmail(response.data.email);
       setMessages([]);
+      setOpenMessage(null);
       toast.success(`Email generated! (-${response.data.credits_used} credit)`);
       refreshUser();
     } catch (error) {
@@ -55,6 +58,34 @@ const TempEmail = () => {
     }
   };
 
+  const readMessage = async (id) => {
+    setLoadingMessage(id);
+    try {
+      const response = await axios.get(`${API}/tools/temp-email/${email}/messages/${id}`);
+      setOpenMessage(response.data);
+    } catch (error) {
+      toast.error(error.response?.data?.detail || "Failed to open message");
+    } finally {
+      setLoadingMessage(null);
+    }
+  };
+
+  const downloadAttachment = async (attachment) => {
+    try {
+      const response = await axios.get(`${process.env.REACT_APP_BACKEND_URL}${attachment.url}`, {
+        responseType: "blob",
+      });
+      const url = URL.createObjectURL(response.data);
+      const link = document.createElement("a");
+      link.href = url;
+      link.download = attachment.filename;
+      link.click();
+      URL.revokeObjectURL(url);
+    } catch (error) {
+      toast.error("Failed to download attachment");
+    }
+  };
+
   const copyEmail = () => {
     if (email) {
       navigator.clipboard.writeText(email);
@@ -155,7 +186,47 @@ const TempEmail = () => {
             </CardDescription>
           </CardHeader>
           <CardContent>
-            {messages.length === 0 ? (
+            {openMessage ? (
+              <div className="space-y-4" data-testid="open-message">
+                <Button variant="ghost" size="sm" onClick={() => setOpenMessage(null)} data-testid="back-to-inbox-btn">
+                  <ArrowLeft className="w-4 h-4 mr-2" />
+                  Back to inbox
+                </Button>
+                <div>
+                  <p className="font-bold">{openMessage.subject}</p>
+                  <p className="text-sm text-muted-foreground">
+                    {openMessage.from} · {openMessage.date}
+                  </p>
+                </div>
+                {openMessage.htmlBody ? (
+                  <iframe
+                    title="message-body"
+                    sandbox=""
+                    srcDoc={openMessage.htmlBody}
+                    className="w-full h-80 rounded-lg bg-white"
+                  />
+                ) : (
+                  <pre className="whitespace-pre-wrap text-sm p-4 rounded-lg bg-muted/50">
+                    {openMessage.textBody || openMessage.body}
+                  </pre>
+                )}
+                {openMessage.attachments.length > 0 && (
+                  <div className="flex flex-wrap gap-2">
+                    {openMessage.attachments.map((attachment) => (
+                      <Button
+                        key={attachment.filename}
+                        variant="outline"
+                        size="sm"
+                        onClick={() => downloadAttachment(attachment)}
+                      >
+                        <Paperclip className="w-4 h-4 mr-2" />
+                        {attachment.filename}
+                      </Button>
+                    ))}
+                  </div>
+                )}
+              </div>
+            ) : messages.length === 0 ? (
               <div className="py-12 text-center text-muted-foreground">
                 <Inbox className="w-12 h-12 mx-auto mb-4 opacity-50" />
                 <p>No messages yet</p>
@@ -167,11 +238,16 @@ const TempEmail = () => {
                   <div
                     key={index}
                     className="p-4 rounded-lg bg-muted/50 hover:bg-muted transition-colors cursor-pointer"
+                    onClick={() => readMessage(msg.id)}
                     data-testid={`message-${index}`}
                   >
                     <div className="flex items-center justify-between mb-2">
                       <span className="font-bold text-sm truncate">{msg.from}</span>
-                      <span className="text-xs text-muted-foreground">{msg.date}</span>
+                      {loadingMessage === msg.id ? (
+                        <Loader2 className="w-4 h-4 animate-spin" />
+                      ) : (
+                        <span className="text-xs text-muted-foreground">{msg.date}</span>
+                      )}
                     </div>
                     <p className="text-sm text-foreground truncate">{msg.subject}</p>
                   </div>
@@ -88,7 +88,9 @@ const YouTubeDownloader = () => {
             <div className="mt-6 space-y-4">
               <div className="flex gap-4 p-4 rounded-lg bg-muted/50">
                 <img
-                  src={result.thumbnail}
+                  src={result.thumbnail_proxy
+                    ? `${process.env.REACT_APP_BACKEND_URL}${result.thumbnail_proxy}`
+                    : result.thumbnail}
                   alt={result.title}
                   className="w-40 h-24 object-cover rounded-lg"
                 />
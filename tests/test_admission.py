@@ -0,0 +1,118 @@
+"""
+Behaviour checks for the per-group admission controller in backend/server.py.
+
+Auth and admin requests have priority over tool traffic: with tools
+saturated they still get in ahead of queued tool requests, and a full auth
+or admin limit borrows idle tool capacity instead of queueing.
+"""
+
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "omnihub_tests")
+sys.path.insert(0, str(BACKEND_DIR))
+
+import server  # noqa: E402
+
+
+def controller_with_limits(**limits) -> server.AdmissionController:
+    controller = server.AdmissionController(register=False)
+    for limiter in controller.limiters:
+        limiter.limit = float(limits.get(limiter.name, server.ADMISSION_INITIAL_LIMIT))
+    return controller
+
+
+def group(controller: server.AdmissionController, name: str) -> server.AdaptiveLimiter:
+    return next(limiter for limiter in controller.limiters if limiter.name == name)
+
+
+def test_auth_is_admitted_ahead_of_queued_tool_requests():
+    async def run():
+        controller = controller_with_limits(auth=1, tools=2)
+        auth, tools = group(controller, "auth"), group(controller, "tools")
+        tool_slots = [await controller.acquire(tools) for _ in range(2)]
+        assert await controller.acquire(auth) is auth
+
+        admitted = []
+
+        async def request(limiter, label):
+            slot = await controller.acquire(limiter)
+            admitted.append(label)
+            return slot
+
+        queued_tool = asyncio.create_task(request(tools, "tool"))
+        await asyncio.sleep(0)
+        queued_auth = asyncio.create_task(request(auth, "auth"))
+        await asyncio.sleep(0)
+        assert (len(tools.waiters), len(auth.waiters)) == (1, 1)
+
+        # The first freed tool slot goes to the auth request that queued after the tool request
+        controller.release(tools, slot=tool_slots[0])
+        assert await asyncio.wait_for(queued_auth, 1) is tools
+        assert admitted == ["auth"] and not queued_tool.done()
+        assert auth.borrowed == 1
+
+        controller.release(auth, slot=tools)
+        assert await asyncio.wait_for(queued_tool, 1) is tools
+        assert admitted == ["auth", "tool"]
+    asyncio.run(run())
+
+
+def test_full_auth_limit_borrows_idle_tool_capacity():
+    async def run():
+        controller = controller_with_limits(auth=1, tools=3)
+        auth, tools = group(controller, "auth"), group(controller, "tools")
+        assert await controller.acquire(auth) is auth
+        assert await controller.acquire(auth) is tools, "a full auth limit takes an idle tool slot"
+        assert (auth.in_flight, tools.in_flight, len(auth.waiters)) == (1, 1, 0)
+        controller.release(auth, slot=tools)
+        assert tools.in_flight == 0
+    asyncio.run(run())
+
+
+def test_tools_never_borrow_from_auth_or_admin():
+    async def run():
+        controller = controller_with_limits(tools=1)
+        tools = group(controller, "tools")
+        assert await controller.acquire(tools) is tools
+        queued = asyncio.create_task(controller.acquire(tools))
+        await asyncio.sleep(0)
+        assert len(tools.waiters) == 1, "tool traffic only ever uses tool slots"
+        assert group(controller, "auth").in_flight == 0 and group(controller, "admin").in_flight == 0
+        controller.release(tools)
+        assert await asyncio.wait_for(queued, 1) is tools
+    asyncio.run(run())
+
+
+def test_middleware_returns_the_borrowed_slot():
+    async def run():
+        controller = controller_with_limits(auth=1, tools=2)
+        auth, tools = group(controller, "auth"), group(controller, "tools")
+        release = asyncio.Event()
+
+        async def app(scope, receive, send):
+            await release.wait()
+            await send({"type": "http.response.start", "status": 200, "headers": []})
+            await send({"type": "http.response.body", "body": b"{}"})
+
+        async def call(path):
+            statuses = []
+
+            async def send(message):
+                if message["type"] == "http.response.start":
+                    statuses.append(message["status"])
+
+            await server.AdmissionMiddleware(app, controller)({"type": "http", "path": path, "headers": []}, None, send)
+            return statuses[0]
+
+        calls = [asyncio.create_task(call("/api/auth/me")) for _ in range(2)]
+        await asyncio.sleep(0)
+        assert (auth.in_flight, tools.in_flight) == (1, 1)
+        release.set()
+        assert await asyncio.gather(*calls) == [200, 200]
+        assert (auth.in_flight, tools.in_flight) == (0, 0)
+    asyncio.run(run())
@@ -0,0 +1,34 @@
+"""
+Behaviour checks for /api/batch sub-request dispatch in backend/server.py.
+
+Sub-requests are built from the parent request's scope, which does not
+always carry the optional ASGI keys (asgi, http_version, scheme).
+"""
+
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "omnihub_tests")
+sys.path.insert(0, str(BACKEND_DIR))
+
+import server  # noqa: E402
+
+USER = {
+    "id": "u1", "email": "u1@example.com", "name": "U1", "role": "user", "credits": 3,
+    "is_active": True, "created_at": "2026-01-01T00:00:00+00:00"
+}
+
+
+def test_sub_request_without_optional_scope_keys():
+    token = server.create_access_token({"sub": USER["id"]})
+    parent_scope = {
+        "type": "http", "headers": [(b"authorization", f"Bearer {token}".encode())],
+        "app": server.app, "starlette.exception_handlers": ({}, {})
+    }
+    result = asyncio.run(server._dispatch_sub_request(parent_scope, "/api/auth/me", USER))
+    assert result["status"] == 200, result
+    assert result["body"]["email"] == "u1@example.com"
@@ -0,0 +1,50 @@
+"""
+Cold-start regression checks for the backend worker.
+
+Each probe imports backend/server.py in a fresh interpreter. The import must
+stay under COLD_START_BUDGET_MS (best of a few runs, to ride out noisy hosts),
+and dependencies only the tool routes need must not be loaded eagerly.
+"""
+
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+COLD_START_BUDGET_MS = float(os.environ.get("COLD_START_BUDGET_MS", 1500))
+PROBE_RUNS = 3
+
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import server
+print(json.dumps({
+    "import_ms": (time.perf_counter() - started) * 1000,
+    "eager": [m for m in ("httpx._client", "passlib.context") if m in sys.modules]
+}))
+"""
+
+
+def probe_import() -> dict:
+    env = dict(os.environ)
+    env.setdefault("MONGO_URL", "mongodb://localhost:27017")
+    env.setdefault("DB_NAME", "omnihub_cold_start")
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE], cwd=BACKEND_DIR, env=env,
+        capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_import_within_budget():
+    best_ms = min(probe_import()["import_ms"] for _ in range(PROBE_RUNS))
+    assert best_ms <= COLD_START_BUDGET_MS, (
+        f"Importing server.py took {best_ms:.0f} ms, over the {COLD_START_BUDGET_MS:.0f} ms budget; "
+        f"run backend/profile_startup.py to see which imports grew"
+    )
+
+
+def test_tool_dependencies_load_lazily():
+    assert probe_import()["eager"] == []
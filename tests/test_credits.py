@@ -0,0 +1,182 @@
+"""
+Behaviour checks for charging credits in backend/server.py.
+
+Each test runs against a fresh in-memory Mongo (mongomock-motor) swapped in
+for the server's database. Charges must be atomic: concurrent charges never
+lose an update or take a balance below zero. Bulk credit changes report an
+outcome for every row, including rows that lose a race or fail to write.
+"""
+
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+import pytest
+from fastapi import HTTPException
+from mongomock_motor import AsyncMongoMockClient
+from pymongo.errors import BulkWriteError
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "omnihub_tests")
+sys.path.insert(0, str(BACKEND_DIR))
+
+import server  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def fresh_db(monkeypatch):
+    client = AsyncMongoMockClient(tz_aware=True)
+    monkeypatch.setattr(server, "client", client)
+    monkeypatch.setattr(server, "db", client["omnihub_tests"])
+    monkeypatch.setattr(server, "analytics_db", client["omnihub_tests"])
+    monkeypatch.setattr(server, "_migration_status", {})
+
+
+async def create_user(credits: int) -> dict:
+    user = {"_id": "u1", "id": "u1", "email": "u1@example.com", "credits": credits, "version": 1}
+    await server.db.users.insert_one(user)
+    return user
+
+
+def test_deduct_credits_returns_the_new_balance():
+    async def run():
+        await create_user(5)
+        assert await server.deduct_credits("u1", "temp_email", 2) == 3
+        user = await server.db.users.find_one({"id": "u1"})
+        assert (user["credits"], user["version"], len(user["recent_activity"])) == (3, 2, 1)
+        assert await server.db.usage_logs.count_documents({"user_id": "u1", "credits_used": 2}) == 1
+    asyncio.run(run())
+
+
+def test_concurrent_charges_never_overdraw():
+    async def run():
+        await create_user(3)
+        results = await asyncio.gather(
+            *(server.deduct_credits("u1", "temp_email", 2) for _ in range(2)), return_exceptions=True
+        )
+        assert sorted(map(type, results), key=lambda t: t.__name__) == [HTTPException, int]
+        refused = next(r for r in results if isinstance(r, HTTPException))
+        assert refused.status_code == 402
+        user = await server.db.users.find_one({"id": "u1"})
+        assert user["credits"] == 1, "both charges applied, or one lost"
+        assert await server.db.usage_logs.count_documents({"user_id": "u1"}) == 1, "only the applied charge is logged"
+        assert len(user["recent_activity"]) == 1
+    asyncio.run(run())
+
+
+def test_tool_with_overridden_cost_charges_atomically(monkeypatch):
+    spec = server.TOOL_REGISTRY["tamasha_otp"]
+    assert spec.charge == "on_success"
+    monkeypatch.setattr(spec, "cost", spec.cost)
+    monkeypatch.setitem(server.CREDIT_COSTS, spec.name, server.CREDIT_COSTS[spec.name])
+    server._apply_tool_policies('{"tamasha_otp": {"cost": "3"}}')
+    server.CREDIT_COSTS[spec.name] = spec.cost  # published by start() at import
+
+    async def call(http, remaining):
+        await asyncio.sleep(0)
+        return {"ok": True}
+
+    async def run():
+        # Both requests pass the balance check with the same snapshot of the user
+        user = await create_user(4)
+        results = await asyncio.gather(
+            *(server.run_tool(spec.name, user, call) for _ in range(2)), return_exceptions=True
+        )
+        assert [r for r in results if not isinstance(r, Exception)] == [({"ok": True}, 3)]
+        assert [r.status_code for r in results if isinstance(r, HTTPException)] == [402]
+        assert (await server.db.users.find_one({"id": "u1"}))["credits"] == 1
+    asyncio.run(run())
+
+
+ADMIN = {"id": "admin", "email": "admin@example.com"}
+
+
+async def create_users(**credits):
+    await server.db.users.insert_many([
+        {"_id": user_id, "id": user_id, "email": f"{user_id}@example.com", "credits": amount, "version": 1}
+        for user_id, amount in credits.items()
+    ])
+
+
+async def balances() -> dict:
+    return {u["id"]: u["credits"] async for u in server.db.users.find({}, {"id": 1, "credits": 1})}
+
+
+def bulk(*pairs) -> list:
+    return [server.BulkCreditItem(user_id=user_id, amount=amount) for user_id, amount in pairs]
+
+
+def test_bulk_credits_apply_grants_and_deductions():
+    async def run():
+        await create_users(a=5, b=5, c=1)
+        result = await server.apply_bulk_credits(bulk(("a", 10), ("b", -3), ("c", -2), ("nope", 1)), "campaign", ADMIN)
+        assert [(r["row"], r["status"], r.get("balance_after"), r.get("error")) for r in result["results"]] == [
+            (0, "applied", 15, None), (1, "applied", 2, None),
+            (2, "rejected", None, "Cannot reduce credits below 0"), (3, "rejected", None, "User not found")
+        ]
+        assert await balances() == {"a": 15, "b": 2, "c": 1}
+        logs = {log["user_id"]: log["balance_after"] async for log in server.db.credit_logs.find({})}
+        assert logs == {"a": 15, "b": 2}
+        user = await server.db.users.find_one({"id": "b"})
+        assert "credit_ops" not in user, "no bookkeeping is left on user documents"
+    asyncio.run(run())
+
+
+def test_bulk_deduction_that_loses_a_race_is_reported(monkeypatch):
+    collection = type(server.db.users)
+    update_one = collection.update_one
+
+    async def charge_first(self, query, update, **kwargs):
+        # A charge lands between validation and the deduction
+        await update_one(self, {"id": "b"}, {"$set": {"credits": 1}})
+        return await update_one(self, query, update, **kwargs)
+
+    async def run():
+        await create_users(a=5, b=5)
+        monkeypatch.setattr(collection, "update_one", charge_first)
+        result = await server.apply_bulk_credits(bulk(("a", 1), ("b", -3)), "campaign", ADMIN)
+        assert [(r["status"], r.get("error")) for r in result["results"]] == [
+            ("applied", None), ("rejected", "Cannot reduce credits below 0")
+        ]
+        assert await balances() == {"a": 6, "b": 1}
+        assert await server.db.credit_logs.count_documents({}) == 1
+    asyncio.run(run())
+
+
+def test_bulk_credits_report_users_deleted_during_the_batch(monkeypatch):
+    collection = type(server.db.users)
+    bulk_write = collection.bulk_write
+
+    async def delete_after(self, ops, **kwargs):
+        result = await bulk_write(self, ops, **kwargs)
+        await self.delete_one({"id": "b"})
+        return result
+
+    async def run():
+        await create_users(a=5, b=5)
+        monkeypatch.setattr(collection, "bulk_write", delete_after)
+        result = await server.apply_bulk_credits(bulk(("a", 1), ("b", 1)), "campaign", ADMIN)
+        assert [(r["status"], r.get("error")) for r in result["results"]] == [("applied", None), ("rejected", "User not found")]
+        assert [log["user_id"] async for log in server.db.credit_logs.find({})] == ["a"]
+    asyncio.run(run())
+
+
+def test_bulk_write_errors_are_mapped_to_rows(monkeypatch):
+    collection = type(server.db.users)
+    bulk_write = collection.bulk_write
+
+    async def fail_second(self, ops, **kwargs):
+        await bulk_write(self, [op for i, op in enumerate(ops) if i != 1], **kwargs)
+        raise BulkWriteError({"writeErrors": [{"index": 1, "code": 14, "errmsg": "Cannot apply $inc to a non-numeric value"}]})
+
+    async def run():
+        await create_users(a=5, b=5, c=5)
+        monkeypatch.setattr(collection, "bulk_write", fail_second)
+        result = await server.apply_bulk_credits(bulk(("a", 1), ("b", 2), ("c", 3)), "campaign", ADMIN)
+        assert [(r["status"], r.get("error")) for r in result["results"]] == [
+            ("applied", None), ("rejected", "Cannot apply $inc to a non-numeric value"), ("applied", None)
+        ]
+        assert sorted([log["user_id"] async for log in server.db.credit_logs.find({})]) == ["a", "c"]
+    asyncio.run(run())
@@ -0,0 +1,102 @@
+"""
+Behaviour checks for the Idempotency-Key middleware in backend/server.py.
+
+Each test runs against a fresh in-memory Mongo (mongomock-motor) swapped in
+for the server's database and drives the middleware with a stub handler:
+only final outcomes are replayed, with their headers, and any other status
+releases the key for a retry.
+"""
+
+import asyncio
+import json
+import os
+import sys
+from pathlib import Path
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+from starlette.requests import Request
+from starlette.responses import StreamingResponse
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "omnihub_tests")
+sys.path.insert(0, str(BACKEND_DIR))
+
+import server  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def fresh_db(monkeypatch):
+    client = AsyncMongoMockClient(tz_aware=True)
+    monkeypatch.setattr(server, "client", client)
+    monkeypatch.setattr(server, "db", client["omnihub_tests"])
+
+
+class Handler:
+    """Stands in for the route: answers with the next queued (status, headers)"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = 0
+
+    async def __call__(self, request):
+        self.calls += 1
+        status_code, headers = self.responses.pop(0)
+        body = json.dumps({"status": status_code}).encode()
+        return StreamingResponse(iter([body]), status_code=status_code, headers=headers, media_type="application/json")
+
+
+def post(key: str) -> Request:
+    token = server.create_access_token({"sub": "u1"})
+    scope = {
+        "type": "http", "method": "POST", "path": "/api/tools/tamasha-otp", "query_string": b"",
+        "scheme": "http", "server": ("testserver", 80),
+        "headers": [(b"authorization", f"Bearer {token}".encode()), (b"idempotency-key", key.encode())]
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b'{"phone": "0300"}', "more_body": False}
+
+    return Request(scope, receive)
+
+
+def test_payment_required_is_not_replayed_after_a_top_up():
+    async def run():
+        handler = Handler((402, {}), (200, {}))
+        first = await server.idempotency_middleware(post("k1"), handler)
+        assert first.status_code == 402
+        assert await server.db.idempotency_keys.count_documents({}) == 0, "the key is released"
+
+        retry = await server.idempotency_middleware(post("k1"), handler)
+        assert (retry.status_code, handler.calls) == (200, 2), "the retry runs the tool"
+        replay = await server.idempotency_middleware(post("k1"), handler)
+        assert (replay.status_code, handler.calls) == (200, 2)
+        assert replay.headers["idempotent-replayed"] == "true"
+    asyncio.run(run())
+
+
+def test_replay_keeps_the_original_headers():
+    async def run():
+        handler = Handler((201, {"X-Credits-Remaining": "4", "Location": "/api/tools/jobs/1"}))
+        first = await server.idempotency_middleware(post("k2"), handler)
+        replay = await server.idempotency_middleware(post("k2"), handler)
+        assert handler.calls == 1
+        assert (replay.status_code, replay.body) == (201, b'{"status": 201}')
+        assert replay.headers["x-credits-remaining"] == "4"
+        assert replay.headers["location"] == first.headers["location"]
+        assert replay.headers["content-type"] == "application/json"
+        assert replay.headers["content-length"] == str(len(replay.body))
+    asyncio.run(run())
+
+
+def test_conflicts_are_replayed_but_rate_limits_are_not():
+    async def run():
+        handler = Handler((409, {}), (429, {"Retry-After": "1"}), (200, {}))
+        assert (await server.idempotency_middleware(post("k3"), handler)).status_code == 409
+        assert (await server.idempotency_middleware(post("k3"), handler)).status_code == 409
+        assert handler.calls == 1
+        assert (await server.idempotency_middleware(post("k4"), handler)).status_code == 429
+        assert (await server.idempotency_middleware(post("k4"), handler)).status_code == 200
+        assert handler.calls == 3
+    asyncio.run(run())
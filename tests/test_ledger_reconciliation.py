@@ -0,0 +1,211 @@
+"""
+Behaviour checks for the incremental credit-ledger reconciliation.
+
+Each test runs against a fresh in-memory Mongo (mongomock-motor) swapped in
+for the server's database and seeds users with the credit and usage logs
+behind their balances: folding into per-user sums across several batches,
+the watermark (including a rewind after a crash), drift detection with
+held credits and not-yet-folded records, accepting drift, and the lease.
+"""
+
+import asyncio
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "omnihub_tests")
+sys.path.insert(0, str(BACKEND_DIR))
+
+import server  # noqa: E402
+
+T0 = datetime.now(timezone.utc) - timedelta(hours=1)
+
+
+@pytest.fixture(autouse=True)
+def fresh_db(monkeypatch):
+    client = AsyncMongoMockClient(tz_aware=True)
+    monkeypatch.setattr(server, "client", client)
+    monkeypatch.setattr(server, "db", client["omnihub_tests"])
+    monkeypatch.setattr(server, "analytics_db", client["omnihub_tests"])
+    monkeypatch.setattr(server, "_migration_status", {})
+    monkeypatch.setattr(server, "RECONCILE_BATCH_SIZE", 2)
+    monkeypatch.setattr(server, "RECONCILE_BATCH_PAUSE_SECONDS", 0)
+    monkeypatch.setattr(server, "RECONCILE_CONFIRM_SECONDS", 0)
+    monkeypatch.setattr(server, "RECONCILE_LAG_SECONDS", 60)
+
+
+class Ledger:
+    """Writes users and the log records that explain their balances"""
+
+    def __init__(self):
+        self.records = 0
+
+    def _record(self, kind: str, user_id: str, as_date: bool, at) -> dict:
+        """A record id, and a created_at a minute after the previous record's unless given"""
+        self.records += 1
+        at = at or T0 + timedelta(minutes=self.records)
+        return {"id": f"{kind}-{self.records}-{user_id}", "user_id": user_id, "created_at": at if as_date else at.isoformat()}
+
+    async def user(self, user_id: str, credits: int = 0, held: int = 0):
+        await server.db.users.insert_one({
+            "id": user_id, "email": f"{user_id}@example.com", "credits": credits, "held_credits": held
+        })
+
+    async def grant(self, user_id: str, amount: int, as_date: bool = True, at=None):
+        await server.db.credit_logs.insert_one({**self._record("credit", user_id, as_date, at), "amount": amount})
+
+    async def charge(self, user_id: str, credits: int, as_date: bool = True, at=None):
+        await server.db.usage_logs.insert_one({
+            **self._record("usage", user_id, as_date, at), "tool": "phone_lookup", "credits_used": credits, "status": "success"
+        })
+
+    async def set_credits(self, user_id: str, credits: int):
+        await server.db.users.update_one({"id": user_id}, {"$set": {"credits": credits}})
+
+
+async def sums() -> dict:
+    return {b["_id"]: b.get("sum", 0) for b in await server.db.ledger_balances.find({}).to_list(None)}
+
+
+async def seed(ledger: Ledger):
+    """Two consistent accounts whose history spans both created_at forms and several batches"""
+    await ledger.user("u1", credits=7)
+    await ledger.user("u2", credits=5)
+    await ledger.grant("u1", 10, as_date=False)
+    await ledger.grant("u2", 5, as_date=False)
+    await ledger.charge("u1", 2, as_date=False)
+    await ledger.charge("u1", 1)
+    await ledger.grant("u1", 3)
+    await ledger.charge("u1", 3)
+
+
+def test_fold_matches_balances_across_batches_and_forms():
+    async def run():
+        await seed(Ledger())
+        summary = await server.reconcile_ledger()
+        assert (summary["accounts_checked"], summary["drifted"]) == (2, 0)
+        assert await sums() == {"u1": 7, "u2": 5}
+        state = await server.db.reconciliation_state.find_one({"_id": "credit_ledger"})
+        last_usage = await server.db.usage_logs.find_one({"id": "usage-6-u1"})
+        assert state["usage_logs"] == server._ledger_key(last_usage)
+    asyncio.run(run())
+
+
+def test_only_records_past_the_watermark_are_folded():
+    async def run():
+        ledger = Ledger()
+        await seed(ledger)
+        await server.reconcile_ledger()
+        await ledger.charge("u2", 4)
+        await ledger.set_credits("u2", 1)
+        folded = server.LEDGER_RECORDS_FOLDED.value
+        summary = await server.reconcile_ledger()
+        assert server.LEDGER_RECORDS_FOLDED.value - folded == 1
+        assert (summary["accounts_checked"], summary["drifted"]) == (1, 0), "only the touched account is checked"
+        assert await sums() == {"u1": 7, "u2": 1}
+    asyncio.run(run())
+
+
+def test_rewound_watermark_does_not_double_count():
+    async def run():
+        await seed(Ledger())
+        await server.reconcile_ledger()
+        # As if a pass stopped after updating the sums but before saving the watermarks
+        await server.db.reconciliation_state.update_one(
+            {"_id": "credit_ledger"}, {"$unset": {"usage_logs": "", "credit_logs": ""}}
+        )
+        summary = await server.reconcile_ledger()
+        assert summary["drifted"] == 0
+        assert await sums() == {"u1": 7, "u2": 5}
+    asyncio.run(run())
+
+
+def test_records_inside_the_lag_are_counted_but_not_folded():
+    async def run():
+        ledger = Ledger()
+        await seed(ledger)
+        await server.reconcile_ledger()
+        # Charged just now: too young to fold, but the balance already reflects it
+        await ledger.charge("u1", 2, at=datetime.now(timezone.utc))
+        await ledger.set_credits("u1", 5)
+        await server.db.ledger_drift.insert_one({"_id": "u1", "drift": 0, "abs_drift": 0})
+        summary = await server.reconcile_ledger()
+        assert (summary["drifted"], summary["resolved"]) == (0, 1)
+        assert await sums() == {"u1": 7, "u2": 5}
+    asyncio.run(run())
+
+
+def test_held_credits_are_not_drift():
+    async def run():
+        ledger = Ledger()
+        await ledger.user("u1", credits=6, held=4)
+        await ledger.grant("u1", 10)
+        assert (await server.reconcile_ledger())["drifted"] == 0
+    asyncio.run(run())
+
+
+def test_drift_is_recorded_resolved_and_accepted():
+    async def run():
+        ledger = Ledger()
+        await seed(ledger)
+        await ledger.user("u3", credits=50)
+        await ledger.grant("u3", 20)
+        await server.reconcile_ledger()
+        await ledger.grant("u1", 1)
+        await ledger.set_credits("u1", 15)
+
+        summary = await server.reconcile_ledger()
+        assert summary["drifted"] == 2
+        report = await server.get_ledger_drift(admin={}, limit=10)
+        assert [(a["user_id"], a["expected"], a["actual"], a["drift"]) for a in report["accounts"]] == [
+            ("u3", 20, 50, 30), ("u1", 8, 15, 7)
+        ], "largest drift first"
+        assert report["total"] == 2
+
+        # A corrected balance clears its record on the next pass
+        await ledger.set_credits("u1", 8)
+        summary = await server.reconcile_ledger()
+        assert (summary["drifted"], summary["resolved"]) == (1, 1)
+
+        # Accepting drift makes it the opening balance, after which the account reconciles
+        accepted = await server.accept_ledger_drift("u3", admin={"email": "admin@example.com"})
+        assert accepted["opening_adjustment"] == 30
+        await ledger.charge("u3", 5)
+        await ledger.set_credits("u3", 45)
+        summary = await server.reconcile_ledger()
+        assert (summary["accounts_checked"], summary["drifted"]) == (1, 0)
+        assert await server.db.ledger_drift.count_documents({}) == 0
+    asyncio.run(run())
+
+
+def test_sums_survive_the_created_at_migration():
+    async def run():
+        ledger = Ledger()
+        await seed(ledger)
+        await server.reconcile_ledger()
+        assert await server.run_migration(server.CreatedAtDates(), offline=True)
+        await server.refresh_migration_status()
+        await ledger.charge("u2", 1)
+        await ledger.set_credits("u2", 4)
+        summary = await server.reconcile_ledger()
+        assert summary["drifted"] == 0
+        assert await sums() == {"u1": 7, "u2": 4}
+    asyncio.run(run())
+
+
+def test_lease_held_elsewhere_skips_the_pass():
+    async def run():
+        await seed(Ledger())
+        await server.db.reconciliation_state.insert_one({
+            "_id": "credit_ledger", "lease_owner": "other",
+            "lease_until": datetime.now(timezone.utc) + timedelta(minutes=1)
+        })
+        assert await server.reconcile_ledger() is None
+        assert await sums() == {}
+    asyncio.run(run())
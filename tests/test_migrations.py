@@ -0,0 +1,201 @@
+"""
+Behaviour checks for the versioned migrations in backend/server.py.
+
+Each test runs against a fresh in-memory Mongo (mongomock-motor) swapped in
+for the server's database: the created_at compatibility filters on a mix of
+ISO-string and native-date records, a run that stops part way and resumes
+from its saved checkpoint, and the lease that keeps a second process out.
+"""
+
+import asyncio
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "omnihub_tests")
+sys.path.insert(0, str(BACKEND_DIR))
+
+import server  # noqa: E402
+
+T0 = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+@pytest.fixture(autouse=True)
+def fresh_db(monkeypatch):
+    client = AsyncMongoMockClient(tz_aware=True)
+    monkeypatch.setattr(server, "client", client)
+    monkeypatch.setattr(server, "db", client["omnihub_tests"])
+    monkeypatch.setattr(server, "analytics_db", client["omnihub_tests"])
+    monkeypatch.setattr(server, "_migration_status", {})
+    monkeypatch.setattr(server, "MIGRATION_BATCH_SIZE", 2)
+    monkeypatch.setattr(server, "MIGRATION_BATCH_PAUSE_SECONDS", 0)
+
+
+def log_record(n: int, as_date: bool) -> dict:
+    created_at = T0 + timedelta(minutes=n)
+    return {
+        "id": f"log-{n:02d}", "user_id": "u1", "tool": "phone_lookup", "credits_used": 1,
+        "created_at": created_at if as_date else created_at.isoformat()
+    }
+
+
+async def seed_mixed_logs(strings: int = 5, dates: int = 4):
+    """Older records as ISO strings, newer ones as dates - the layout while created_at_dates runs"""
+    await server.db.usage_logs.insert_many(
+        [log_record(n, as_date=False) for n in range(strings)]
+        + [log_record(n, as_date=True) for n in range(strings, strings + dates)]
+    )
+
+
+async def page_ids(page_size: int) -> list:
+    ids, position = [], None
+    while True:
+        query = {} if position is None else server.created_at_keyset("$gt", *position)
+        page = await server.db.usage_logs.find(query).sort([("created_at", 1), ("id", 1)]).limit(page_size).to_list(None)
+        ids += [doc["id"] for doc in page]
+        if len(page) < page_size:
+            return ids
+        position = (page[-1]["created_at"], page[-1]["id"])
+
+
+def test_created_at_filter_matches_both_stored_forms():
+    async def run():
+        await seed_mixed_logs()
+        found = await server.db.usage_logs.find(server.created_at_filter("$gte", T0 + timedelta(minutes=3))).to_list(None)
+        assert sorted(doc["id"] for doc in found) == [f"log-{n:02d}" for n in range(3, 9)]
+        # A client cursor arrives as an ISO string; it must match both forms the same way
+        found = await server.db.usage_logs.find(server.created_at_filter("$lt", (T0 + timedelta(minutes=6)).isoformat())).to_list(None)
+        assert sorted(doc["id"] for doc in found) == [f"log-{n:02d}" for n in range(6)]
+    asyncio.run(run())
+
+
+def test_created_at_keyset_pages_across_stored_forms():
+    async def run():
+        await seed_mixed_logs()
+        # Two records at the same instant, one per form, are ordered by id
+        await server.db.usage_logs.insert_one({**log_record(4, as_date=True), "id": "log-04b"})
+        expected = [f"log-{n:02d}" for n in range(9)]
+        expected.insert(5, "log-04b")
+        for page_size in (1, 2, 3, 50):
+            assert await page_ids(page_size) == expected, f"page size {page_size}"
+    asyncio.run(run())
+
+
+def test_filters_use_dates_only_once_migration_complete():
+    async def run():
+        await seed_mixed_logs()
+        server._migration_status["created_at_dates"] = "complete"
+        found = await server.db.usage_logs.find(server.created_at_filter("$gte", T0)).to_list(None)
+        assert sorted(doc["id"] for doc in found) == [f"log-{n:02d}" for n in range(5, 9)]
+        assert "$or" not in server.created_at_filter("$gte", T0)
+    asyncio.run(run())
+
+
+def test_created_at_dates_converts_every_record():
+    async def run():
+        await seed_mixed_logs()
+        await server.db.credit_logs.insert_one({"id": "c1", "user_id": "u1", "amount": 5, "created_at": T0.isoformat()})
+        assert await server.run_migrations(offline=True) == ["created_at_dates", "user_id_keys", "user_search_keys"]
+        assert await server.db.usage_logs.count_documents({"created_at": {"$type": "string"}}) == 0
+        assert await server.db.credit_logs.count_documents({"created_at": {"$type": "string"}}) == 0
+        state = await server.db.migrations.find_one({"_id": "created_at_dates"})
+        assert (state["status"], state["migrated"], state["contracted"]) == ("complete", 6, True)
+        assert server.migration_complete("created_at_dates")
+        # Values survive the conversion
+        doc = await server.db.usage_logs.find_one({"id": "log-03"})
+        assert doc["created_at"] == T0 + timedelta(minutes=3)
+    asyncio.run(run())
+
+
+class InterruptedDates(server.CreatedAtDates):
+    """created_at_dates that fails after a given number of batches"""
+
+    def __init__(self, batches: int):
+        self.batches = batches
+        self.checkpoints = []
+
+    async def run_batch(self, checkpoint: dict, offline: bool) -> tuple:
+        self.checkpoints.append(dict(checkpoint))
+        if len(self.checkpoints) > self.batches:
+            raise RuntimeError("worker stopped")
+        return await super().run_batch(checkpoint, offline)
+
+
+def test_interrupted_migration_resumes_from_checkpoint():
+    async def run():
+        await seed_mixed_logs(strings=3, dates=0)
+        await server.db.credit_logs.insert_many(
+            [{"id": f"c{n}", "user_id": "u1", "amount": 1, "created_at": (T0 + timedelta(minutes=n)).isoformat()} for n in range(3)]
+        )
+        # usage_logs takes two batches and an empty one that moves the checkpoint on; then one credit_logs batch
+        first = InterruptedDates(batches=4)
+        with pytest.raises(RuntimeError):
+            await server.run_migration(first, offline=True)
+        state = await server.db.migrations.find_one({"_id": "created_at_dates"})
+        assert (state["status"], state["sweep"], state["checkpoint"], state["migrated"]) == ("running", 1, {"collection": 1}, 5)
+        assert await server.db.credit_logs.count_documents({"created_at": {"$type": "string"}}) == 1
+
+        resumed = InterruptedDates(batches=100)
+        assert await server.run_migration(resumed, offline=True)
+        assert resumed.checkpoints[0] == {"collection": 1}, "the resumed run must start from the saved checkpoint"
+        state = await server.db.migrations.find_one({"_id": "created_at_dates"})
+        assert (state["status"], state["migrated"]) == ("complete", 6)
+        assert await server.db.credit_logs.count_documents({"created_at": {"$type": "string"}}) == 0
+    asyncio.run(run())
+
+
+def test_lease_keeps_a_second_process_out():
+    async def run():
+        await seed_mixed_logs()
+        held_until = datetime.now(timezone.utc) + timedelta(minutes=1)
+        await server.db.migrations.insert_one({"_id": "lease", "lease_owner": "other", "lease_until": held_until})
+        assert await server.run_migrations(offline=True) == []
+        assert await server.db.migrations.find_one({"_id": "created_at_dates"}) is None
+        lease = await server.db.migrations.find_one({"_id": "lease"})
+        assert lease["lease_owner"] == "other", "a process must not release a lease it does not hold"
+
+        # Once the other process's lease expires it is taken over
+        await server.db.migrations.update_one({"_id": "lease"}, {"$set": {"lease_until": datetime.now(timezone.utc) - timedelta(seconds=1)}})
+        assert await server.run_migrations(offline=True) == ["created_at_dates", "user_id_keys", "user_search_keys"]
+        lease = await server.db.migrations.find_one({"_id": "lease"})
+        assert lease["lease_owner"] == server._migration_owner
+        assert lease["lease_until"] <= datetime.now(timezone.utc), "the lease is released when the run ends"
+    asyncio.run(run())
+
+
+def test_migrations_must_implement_run_batch():
+    class Incomplete(server.Migration):
+        name = "incomplete"
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_fresh_database_migrates_online_in_order(monkeypatch):
+    monkeypatch.setattr(server, "MIGRATION_POLL_SECONDS", 0)
+
+    async def run():
+        # Users as this version creates them (_id = id), plus one from before the directory keys
+        await server.db.users.insert_many([
+            {"_id": "u1", "id": "u1", "email": "Ann@Example.com", "name": "Ann", "email_lower": "ann@example.com",
+             "name_lower": "ann", "created_at": T0.isoformat()},
+            {"_id": "u2", "id": "u2", "email": "Bob@Example.com", "name": "Bob", "created_at": T0.isoformat()},
+        ])
+        # No replica set is needed when no user has an ObjectId key to move
+        assert await server.run_migrations(offline=False) == ["created_at_dates", "user_id_keys", "user_search_keys"]
+        user = await server.db.users.find_one({"_id": "u2"})
+        assert (user["name_lower"], user["email_lower"], user["created_at"]) == ("bob", "bob@example.com", T0)
+    asyncio.run(run())
+
+
+def test_user_responses_keep_iso_string_timestamps():
+    fields = {"id": "u1", "email": "u1@example.com", "name": "U1", "role": "user", "credits": 0, "is_active": True}
+    # Stored as a date after created_at_dates, or as the legacy string: clients see the same string
+    for stored in (T0, T0.isoformat()):
+        assert server.UserResponse(**fields, created_at=stored).model_dump(mode="json")["created_at"] == T0.isoformat()